@@ -17,43 +17,131 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import time
 import logging
+from threading import Lock
+
+# property cache policies - a number is a time to live in seconds
+PROP_CACHE_NEVER = 'never'
+PROP_CACHE_STATIC = 'static'
+
+# Alpaca error numbers a server returns for something it does not implement
+ALPACA_ERROR_NOT_IMPLEMENTED = 0x400
+ALPACA_ERROR_ACTION_NOT_IMPLEMENTED = 0x40C
+
+# HTTP status returned for an endpoint the server does not know
+HTTP_STATUS_NOT_IMPLEMENTED = (400, 404)
+
+# returned by backend get_device_state() when the server says it does not
+# support devicestate - None means the request failed
+DEVICE_STATE_UNSUPPORTED = 'unsupported'
+
+
+def is_not_implemented(status_code, resp_json):
+    """
+    Check if a response says the endpoint requested is not implemented.
+
+    :param status_code: HTTP status of response.
+    :type status_code: int
+    :param resp_json: Decoded response body or None if not JSON.
+    :type resp_json: dict
+    :return: True if server or driver does not implement endpoint.
+    :rtype: bool
+    """
+    if status_code in HTTP_STATUS_NOT_IMPLEMENTED:
+        return True
+
+    if not isinstance(resp_json, dict):
+        return False
+
+    return resp_json.get('ErrorNumber') in (ALPACA_ERROR_NOT_IMPLEMENTED,
+                                            ALPACA_ERROR_ACTION_NOT_IMPLEMENTED)
+
 
 class AlpacaDevice:
 
+    # cache policy for each property read - properties not listed are
+    # never cached.  Static values are kept until the device is
+    # reconnected.  Device classes override this.
+    prop_cache_policy = {}
+
+    # properties the device reports through the devicestate endpoint
+    # (Alpaca Platform 7) - reads of these are answered from a single
+    # devicestate snapshot which is refreshed when older than
+    # device_state_max_age seconds.  Device classes override this.
+    device_state_props = ()
+    device_state_max_age = 0.25
+
     def _initialize_device_attr(self):
+        # server is (host, port) or None for backend default server
+        self.server = None
         self.device_number = None
         self.device_type = None
 
+        # maps property name to (timestamp, value)
+        self._prop_cache = {}
+        self._prop_cache_lock = Lock()
+        self.prop_cache_hits = 0
+        self.prop_cache_misses = 0
+
+        # bumped before and after every write - a read only updates the
+        # cache or devicestate snapshot if no write started or finished
+        # while it was in flight, so values from before a write can not
+        # be cached after it
+        self._write_generation = 0
+
+        # None until we know if server supports devicestate
+        self.device_state_supported = None
+        self._device_state = None
+        self._device_state_timestamp = 0
+        self._device_state_lock = Lock()
+
     # Alpaca connect string is "ALPACA:<device type>:<device_number>"
+    # for a device on the backend default server or
+    # "ALPACA:<host>:<port>:<device type>:<device_number>" for any server
     def connect(self, name):
+        alpaca_field = None
+        server = None
         device_number = None
         device_type = None
         try:
-            alpaca_field, device_type, device_number = name.split(':')
+            fields = name.split(':')
+            if len(fields) == 5:
+                alpaca_field, host, port, device_type, device_number = fields
+                server = (host, int(port))
+            else:
+                alpaca_field, device_type, device_number = fields
             device_number = int(device_number)
         except ValueError:
             logging.error('Error parsing Alpaca device spec in connect()')
+            device_type = None
 
         if alpaca_field != 'ALPACA' or None in [device_type, device_number]:
             logging.error('Connect requires Alpaca device spec in the form '
-                          '"ALPACA:<device type>:<device_number>"!')
+                          '"ALPACA:<device type>:<device_number>" or '
+                          '"ALPACA:<host>:<port>:<device type>:<device_number>"!')
 
+            self.server = None
             self.device_number = None
             self.device_type = None
             return False
 
-        logging.debug(f'Alpaca connect device_type={device_type}, '
+        logging.debug(f'Alpaca connect server={server}, '
+                      f'device_type={device_type}, '
                       f'device_number={device_number}')
         logging.debug(f'connect camera {name}')
 
+        self.server = server
         self.device_number = device_number
         self.device_type = device_type
 
+        self.clear_prop_cache()
+        self.device_state_supported = None
+
         return True
 
     def disconnect(self):
-        # FIXME should this do anything?
+        self.clear_prop_cache()
         return True
 
     def is_connected(self):
@@ -71,10 +159,235 @@ class AlpacaDevice:
         logging.warning('Alpaca devices do not have a chooser')
         return None
 
+    def _get_cached_prop(self, prop):
+        """
+        Look up property in the cache.
+
+        :return: Tuple of (found, value).
+        :rtype: (bool, object)
+        """
+        policy = self.prop_cache_policy.get(prop, PROP_CACHE_NEVER)
+        if policy == PROP_CACHE_NEVER:
+            return False, None
+
+        with self._prop_cache_lock:
+            entry = self._prop_cache.get(prop)
+            if entry is not None:
+                timestamp, value = entry
+                if policy == PROP_CACHE_STATIC \
+                   or time.monotonic() - timestamp < policy:
+                    self.prop_cache_hits += 1
+                    return True, value
+
+            self.prop_cache_misses += 1
+
+        return False, None
+
+    def _get_write_generation(self):
+        with self._prop_cache_lock:
+            return self._write_generation
+
+    def _set_cached_prop(self, prop, value, generation):
+        policy = self.prop_cache_policy.get(prop, PROP_CACHE_NEVER)
+        if policy == PROP_CACHE_NEVER or value is None:
+            return
+
+        with self._prop_cache_lock:
+            if generation != self._write_generation:
+                # a write happened while reading so value may be stale
+                return
+            self._prop_cache[prop] = (time.monotonic(), value)
+
+    def clear_prop_cache(self):
+        """
+        Forget all cached property values.
+        """
+        with self._prop_cache_lock:
+            self._prop_cache = {}
+
+        with self._device_state_lock:
+            self._device_state = None
+
+    def get_device_state(self):
+        """
+        Read all operational state properties of device in one request
+        using the devicestate endpoint.
+
+        Property names are lowercase to match the names used with
+        :meth:`get_prop`, for example 'ccdtemperature'.
+
+        :return: Dictionary of property values or None if the server or
+                 driver does not support devicestate or the request failed.
+        :rtype: dict
+        """
+        if self.device_state_supported is False:
+            return None
+
+        generation = self._get_write_generation()
+        vals = self.backend.get_device_state(self.device_type,
+                                             self.device_number,
+                                             server=self.server)
+
+        return self._store_device_state(vals, generation)
+
+    def _store_device_state(self, vals, generation):
+        """
+        Convert devicestate response value to a dictionary and keep it as
+        the current snapshot unless a write happened since generation.
+
+        :return: Dictionary of property values or None if not supported
+                 or the request failed.
+        :rtype: dict
+        """
+        if vals is None:
+            # request failed - try again next time rather than giving up
+            # on devicestate for the session
+            return None
+
+        if vals == DEVICE_STATE_UNSUPPORTED or not isinstance(vals, list):
+            logging.info(f'{self.device_type} {self.device_number} does not '
+                         'support devicestate - reading properties '
+                         'individually')
+            self.device_state_supported = False
+            return None
+
+        self.device_state_supported = True
+
+        state = {}
+        for item in vals:
+            try:
+                state[item['Name'].lower()] = item['Value']
+            except (KeyError, TypeError, AttributeError):
+                logging.warning(f'Bad devicestate entry {item}')
+
+        if generation == self._get_write_generation():
+            with self._device_state_lock:
+                self._device_state = state
+                self._device_state_timestamp = time.monotonic()
+
+        return state
+
+    def _get_device_state_snapshot(self):
+        """
+        Returns devicestate snapshot, refreshing it if too old.
+
+        :return: Dictionary of property values or None if not supported.
+        :rtype: dict
+        """
+        state = self._get_fresh_device_state()
+        if state is None:
+            state = self.get_device_state()
+
+        return state
+
+    def _get_fresh_device_state(self):
+        """
+        Returns devicestate snapshot if it is recent enough to use.
+
+        :return: Dictionary of property values or None.
+        :rtype: dict
+        """
+        with self._device_state_lock:
+            if self._device_state is not None \
+               and time.monotonic() - self._device_state_timestamp \
+               < self.device_state_max_age:
+                return self._device_state
+
+        return None
+
+    def get_prop_cache_stats(self):
+        """
+        Returns cache hit/miss counters for this device.
+
+        :return: Dictionary with keys 'hits', 'misses' and 'entries'.
+        :rtype: dict
+        """
+        with self._prop_cache_lock:
+            return {'hits': self.prop_cache_hits,
+                    'misses': self.prop_cache_misses,
+                    'entries': len(self._prop_cache)}
+
     def get_prop(self, prop, params={}, returndict=False):
-        return self.backend.get_prop(self.device_type, self.device_number,
-                                     prop, params, returndict)
+        # only plain reads can be served from cache
+        if params or returndict:
+            return self.backend.get_prop(self.device_type, self.device_number,
+                                         prop, params, returndict,
+                                         server=self.server)
+
+        found, value = self._get_cached_prop(prop)
+        if found:
+            return value
+
+        if prop in self.device_state_props:
+            state = self._get_device_state_snapshot()
+            if state is not None and prop in state:
+                return state[prop]
+
+        generation = self._get_write_generation()
+        value = self.backend.get_prop(self.device_type, self.device_number,
+                                      prop, params, returndict,
+                                      server=self.server)
+        self._set_cached_prop(prop, value, generation)
+        return value
+
+    def get_props(self, props):
+        vals = {}
+        missing = []
+        for prop in props:
+            found, value = self._get_cached_prop(prop)
+            if found:
+                vals[prop] = value
+            else:
+                missing.append(prop)
+
+        if any(prop in self.device_state_props for prop in missing):
+            state = self._get_device_state_snapshot()
+            if state is not None:
+                for prop in list(missing):
+                    if prop in state:
+                        vals[prop] = state[prop]
+                        missing.remove(prop)
+
+        if missing:
+            generation = self._get_write_generation()
+            fetched = self.backend.get_props(self.device_type,
+                                             self.device_number, missing,
+                                             server=self.server)
+            for prop, value in fetched.items():
+                self._set_cached_prop(prop, value, generation)
+            vals.update(fetched)
+
+        return vals
+
+    def _invalidate_after_write(self, props):
+        # writes can change what other properties read back so drop the
+        # written properties and anything time limited - static values
+        # are kept until reconnect.  Called before and after the write so
+        # nothing read while it is in flight stays cached.
+        with self._prop_cache_lock:
+            self._write_generation += 1
+            self._prop_cache = {k: v for k, v in self._prop_cache.items()
+                                if k not in props and
+                                self.prop_cache_policy.get(k)
+                                == PROP_CACHE_STATIC}
+
+        with self._device_state_lock:
+            self._device_state = None
 
     def set_prop(self, prop, params={}):
-        return self.backend.set_prop(self.device_type, self.device_number,
-                                     prop, params)
+        self._invalidate_after_write((prop,))
+        try:
+            return self.backend.set_prop(self.device_type, self.device_number,
+                                         prop, params, server=self.server)
+        finally:
+            self._invalidate_after_write((prop,))
+
+    def set_props(self, prop_params):
+        props = tuple(prop_params)
+        self._invalidate_after_write(props)
+        try:
+            return self.backend.set_props(self.device_type,
+                                          self.device_number,
+                                          prop_params, server=self.server)
+        finally:
+            self._invalidate_after_write(props)
@@ -0,0 +1,303 @@
+#
+# Alpaca server discovery and device enumeration
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Alpaca UDP discovery and management API queries """
+
+import json
+import time
+import socket
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ALPACA_DISCOVERY_PORT = 32227
+ALPACA_DISCOVERY_MESSAGE = b'alpacadiscovery1'
+
+
+def discover_servers(timeout=1.0, discovery_port=ALPACA_DISCOVERY_PORT,
+                     addresses=['255.255.255.255']):
+    """
+    Find Alpaca servers using the UDP discovery protocol.
+
+    A discovery request is sent to each address and responses are
+    collected until timeout seconds have passed.
+
+    :param timeout: Time in seconds to wait for responses.
+    :type timeout: float
+    :param discovery_port: UDP port servers listen on for discovery.
+    :type discovery_port: int
+    :param addresses: Broadcast (or unicast) addresses to send request to.
+    :type addresses: list
+    :return: List of (ip, port) tuples for each server which responded.
+    :rtype: list
+    """
+    servers = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for address in addresses:
+            try:
+                sock.sendto(ALPACA_DISCOVERY_MESSAGE,
+                            (address, discovery_port))
+            except OSError as err:
+                logging.error(f'discover_servers: unable to send discovery '
+                              f'request to {address}: {err}')
+
+        end_time = time.monotonic() + timeout
+        while True:
+            remaining = end_time - time.monotonic()
+            if remaining <= 0:
+                break
+
+            sock.settimeout(remaining)
+            try:
+                data, (ip, _) = sock.recvfrom(1024)
+            except socket.timeout:
+                break
+
+            try:
+                port = int(json.loads(data)['AlpacaPort'])
+            except (ValueError, KeyError, TypeError):
+                logging.warning(f'discover_servers: bad response {data} '
+                                f'from {ip}')
+                continue
+
+            if (ip, port) not in servers:
+                logging.debug(f'discover_servers: found server {ip}:{port}')
+                servers.append((ip, port))
+    finally:
+        sock.close()
+
+    return servers
+
+
+def get_configured_devices(ip, port, timeout=2.0):
+    """
+    Query the Alpaca management API for the devices on a server.
+
+    :param ip: Server address.
+    :type ip: str
+    :param port: Server port.
+    :type port: int
+    :param timeout: Request timeout in seconds.
+    :type timeout: float
+    :return: List of device description dicts as returned by the server,
+             each with the server 'Host' and 'Port' added.  None if the
+             query failed or the response was not understood.
+    :rtype: list
+    """
+    req = f'http://{ip}:{port}/management/v1/configureddevices'
+    try:
+        resp = requests.get(req, params={'ClientID': 1}, timeout=timeout)
+        resp_dict = resp.json()
+    except (requests.exceptions.RequestException, ValueError) as err:
+        logging.error(f'get_configured_devices: query of {ip}:{port} '
+                      f'failed: {err}')
+        return None
+
+    # whatever answered is not an Alpaca management API
+    if not isinstance(resp_dict, dict):
+        logging.error(f'get_configured_devices: {ip}:{port} returned '
+                      f'status {resp.status_code} and unexpected response '
+                      f'{str(resp_dict)[:80]}')
+        return None
+
+    if resp.status_code != 200 or resp_dict.get('ErrorNumber', 0) != 0:
+        logging.error(f'get_configured_devices: {ip}:{port} returned '
+                      f'status {resp.status_code} '
+                      f'error "{resp_dict.get("ErrorMessage")}"')
+        return None
+
+    value = resp_dict.get('Value', [])
+    if not isinstance(value, list) \
+       or not all(isinstance(dev, dict) for dev in value):
+        logging.error(f'get_configured_devices: {ip}:{port} returned '
+                      f'Value {str(value)[:80]} - expected a list of '
+                      'device descriptions')
+        return None
+
+    devices = []
+    for dev in value:
+        devices.append({**dev, 'Host': ip, 'Port': port})
+
+    return devices
+
+
+def get_device_specs(directory, device_class, server):
+    """
+    Device specs for every device of a class known to a device directory.
+
+    If the server does not answer the management API query device numbers
+    0 to 3 on it are guessed.
+
+    :param directory: Directory of devices to look in.
+    :type directory: AlpacaDeviceDirectory
+    :param device_class: One of 'camera', 'ccd', 'focuser', 'filterwheel',
+                         'mount' or 'telescope'.
+    :type device_class: str
+    :param server: Tuple of (ip, port) of default server - devices on other
+                   servers have host and port in their spec.
+    :type server: tuple
+    :return: List of device specs.
+    :rtype: list
+    """
+    # class should be 'camera', 'focuser', 'filterwheel', or 'telescope'
+    # CASE MATTERS
+    if device_class not in ['camera', 'ccd', 'focuser', 'filterwheel',
+                            'mount', 'telescope']:
+        logging.error('Alpaca getDevicesbyClass: device_class '
+                      f'{device_class} not "camera", "ccd", "focuser", '
+                      '"filterwheel", "mount" or "telescope"')
+        return []
+
+    # accept either 'ccd' or 'camera' for camera class
+    # but alpaca wants 'camera'
+    if device_class == 'ccd':
+        device_class = 'camera'
+    elif device_class == 'mount':
+        device_class = 'telescope'
+
+    # ask server which devices are actually configured
+    devices = directory.get_devices()
+
+    if not directory.server_responded(*server):
+        # for servers without management API just return "0" to "3"
+        # for the device number on remote server
+        logging.warning('Alpaca getDevicesByClass: no response from '
+                        'management API - guessing device numbers')
+        vals = []
+        for d in ["0", "1", "2", "3"]:
+            vals.append(f'ALPACA:{device_class}:{d}')
+        return vals
+
+    vals = []
+    for dev in devices:
+        if dev.get('DeviceType', '').lower() != device_class:
+            continue
+
+        # devices on other servers need host and port in spec
+        if (dev['Host'], dev['Port']) == server:
+            vals.append(f'ALPACA:{device_class}:{dev["DeviceNumber"]}')
+        else:
+            vals.append(f'ALPACA:{dev["Host"]}:{dev["Port"]}:'
+                        f'{device_class}:{dev["DeviceNumber"]}')
+
+    return vals
+
+
+class AlpacaDeviceDirectory:
+    """
+    Cached list of the devices available on a set of Alpaca servers.
+
+    The servers given are always queried and, if discovery is enabled,
+    any servers answering the UDP discovery broadcast as well.  All
+    servers are probed in parallel and results are kept for
+    refresh_interval seconds.
+
+    :param servers: List of (ip, port) tuples for known servers.
+    :type servers: list
+    :param discovery: If True use UDP discovery to find more servers.
+    :type discovery: bool
+    :param refresh_interval: Seconds before cached results are refreshed.
+    :type refresh_interval: float
+    :param timeout: Timeout in seconds for discovery and for each query.
+    :type timeout: float
+    :param discovery_addresses: Addresses discovery requests are sent to.
+    :type discovery_addresses: list
+    :param discovery_port: UDP port used for discovery.
+    :type discovery_port: int
+    """
+
+    def __init__(self, servers=[], discovery=False, refresh_interval=60.0,
+                 timeout=1.0, discovery_addresses=['255.255.255.255'],
+                 discovery_port=ALPACA_DISCOVERY_PORT):
+        self.servers = list(servers)
+        self.discovery = discovery
+        self.discovery_addresses = list(discovery_addresses)
+        self.discovery_port = discovery_port
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+
+        self._lock = Lock()
+        self._devices = None
+        self._server_status = {}
+        self._timestamp = 0
+
+    def server_responded(self, ip, port):
+        """
+        Test if server answered the last management API query.
+
+        :return: True if server responded, False if it did not and None if
+                 it was not queried.
+        :rtype: bool
+        """
+        with self._lock:
+            return self._server_status.get((ip, port))
+
+    def refresh(self):
+        """
+        Probe all servers now and update the cached device list.
+
+        :return: List of device description dicts.
+        :rtype: list
+        """
+        servers = list(self.servers)
+        if self.discovery:
+            for server in discover_servers(timeout=self.timeout,
+                                           discovery_port=self.discovery_port,
+                                           addresses=self.discovery_addresses):
+                if server not in servers:
+                    servers.append(server)
+
+        devices = []
+        status = {}
+        if servers:
+            with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+                results = executor.map(lambda s: get_configured_devices(
+                                         *s, timeout=self.timeout), servers)
+                for server, result in zip(servers, results):
+                    status[server] = result is not None
+                    if result is not None:
+                        devices.extend(result)
+
+        with self._lock:
+            self._devices = devices
+            self._server_status = status
+            self._timestamp = time.monotonic()
+
+        return devices
+
+    def get_devices(self, force=False):
+        """
+        Returns devices on all servers, probing them if the cached list is
+        older than refresh_interval.
+
+        :param force: If True always probe servers.
+        :type force: bool
+        :return: List of device description dicts.
+        :rtype: list
+        """
+        with self._lock:
+            if not force and self._devices is not None \
+               and time.monotonic() - self._timestamp < self.refresh_interval:
+                return list(self._devices)
+
+        return self.refresh()
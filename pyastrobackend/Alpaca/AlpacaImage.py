@@ -0,0 +1,916 @@
+#
+# Alpaca image transfer decoding
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Decoding of the different Alpaca ImageArray transfer formats """
+
+import re
+import struct
+import logging
+import binascii
+import warnings
+import numpy as np
+
+# ujson is much faster parsing the large base64json responses but is optional
+try:
+    import ujson as fast_json
+except ImportError:
+    import json as fast_json
+
+IMAGEBYTES_MIME_TYPE = 'application/imagebytes'
+
+# ways a server can send ImageArray
+IMAGE_MODE_IMAGEBYTES = 'imagebytes'
+IMAGE_MODE_BASE64JSON = 'base64json'
+IMAGE_MODE_BASE64HANDOFF = 'base64handoff'
+IMAGE_MODE_JSON = 'json'
+
+# headers to send with imagearray request for each mode - if mode for a
+# server is not known yet (None) ask for every mode and the server answers
+# with the best one it supports
+IMAGE_MODE_HEADERS = {
+    None: [f'Accept: {IMAGEBYTES_MIME_TYPE}', 'base64json: true',
+           'base64handoff: true'],
+    IMAGE_MODE_IMAGEBYTES: [f'Accept: {IMAGEBYTES_MIME_TYPE}'],
+    IMAGE_MODE_BASE64JSON: ['base64json: true'],
+    IMAGE_MODE_BASE64HANDOFF: ['base64handoff: true'],
+    IMAGE_MODE_JSON: []
+}
+
+# ImageBytes metadata version 1 is 11 little endian 32 bit integers
+IMAGEBYTES_HEADER = struct.Struct('<iiIIiiiiiii')
+IMAGEBYTES_HEADER_FIELDS = ('MetadataVersion', 'ErrorNumber',
+                            'ClientTransactionID', 'ServerTransactionID',
+                            'DataStart', 'ImageElementType',
+                            'TransmissionElementType', 'Rank',
+                            'Dimension1', 'Dimension2', 'Dimension3')
+
+# Alpaca ImageArrayElementTypes codes - all transmitted little endian
+IMAGE_ELEMENT_DTYPES = {
+    1: np.dtype('<i2'),
+    2: np.dtype('<i4'),
+    3: np.dtype('<f8'),
+    4: np.dtype('<f4'),
+    5: np.dtype('<u8'),
+    6: np.dtype('u1'),
+    7: np.dtype('<i8'),
+    8: np.dtype('<u2'),
+    9: np.dtype('<u4')
+}
+
+
+def parse_imagebytes_header(buf):
+    """
+    Parse metadata header at start of an ImageBytes response.
+
+    :param buf: Response body.
+    :type buf: bytes-like
+    :return: Header fields or None if header is invalid.
+    :rtype: dict
+    """
+    if len(buf) < IMAGEBYTES_HEADER.size:
+        logging.error(f'ImageBytes response only {len(buf)} bytes long!')
+        return None
+
+    header = dict(zip(IMAGEBYTES_HEADER_FIELDS,
+                      IMAGEBYTES_HEADER.unpack_from(buf)))
+
+    if header['MetadataVersion'] != 1:
+        logging.error('Unsupported ImageBytes metadata version '
+                      f'{header["MetadataVersion"]}!')
+        return None
+
+    return header
+
+
+def image_output_dtype(element_dtype, maxadu=None):
+    """
+    Choose the data type to return an image in.
+
+    Integer images are returned in the smallest unsigned type holding
+    maxadu, so a 16 bit camera sending int32 elements gives a uint16
+    image and an 8 bit camera a uint8 image.  Floating point images
+    are kept as they are.
+
+    :param element_dtype: Data type of the image elements.
+    :type element_dtype: :class:`numpy.dtype`
+    :param maxadu: Maximum pixel value from camera or None if unknown.
+    :type maxadu: int
+    :return: Data type for image.
+    :rtype: :class:`numpy.dtype`
+    """
+    element_dtype = np.dtype(element_dtype)
+    if element_dtype.kind == 'f' or not isinstance(maxadu, int) \
+       or maxadu <= 0:
+        return element_dtype.newbyteorder('=')
+
+    if maxadu <= 0xff:
+        return np.dtype(np.uint8)
+    elif maxadu <= 0xffff:
+        return np.dtype(np.uint16)
+    elif maxadu <= 0xffffffff:
+        return np.dtype(np.uint32)
+
+    return element_dtype.newbyteorder('=')
+
+
+def check_image_metadata(resp):
+    """
+    Check ImageArray JSON response metadata is for an image we can handle.
+
+    :param resp: Decoded JSON response.
+    :type resp: dict
+    :return: Tuple of element dtype and dimensions as sent (X first) or
+             None if image cannot be handled.
+    :rtype: tuple
+    """
+    # check rank and type
+    imgrank = resp.get('Rank')
+    imgtype = resp.get('Type')
+
+    logging.debug(f'ImageArray Rank = {imgrank} Type = {imgtype}')
+
+    dim0 = resp.get('Dimension0Length')
+    dim1 = resp.get('Dimension1Length')
+    dim2 = resp.get('Dimension2Length')
+
+    logging.debug(f'Dimension0Length: {dim0} '
+                  f'Dimension1Length: {dim1} '
+                  f'Dimension2Length: {dim2} ')
+
+    element_dtype = IMAGE_ELEMENT_DTYPES.get(imgtype)
+    if element_dtype is None:
+        logging.error(f'ImageArray returned unknown Type {imgtype}!')
+        return None
+
+    if imgrank == 2:
+        dims = (dim0, dim1)
+    elif imgrank == 3:
+        dims = (dim0, dim1, dim2)
+    else:
+        logging.error(f'ImageArray returned Rank {imgrank} - only 2 and 3 '
+                      'supported!')
+        return None
+
+    if not all(isinstance(d, int) and d > 0 for d in dims):
+        logging.error(f'ImageArray returned invalid dimensions {dims}!')
+        return None
+
+    return element_dtype, dims
+
+
+class ImageArrayWriter:
+    """
+    Receives image elements in the order they are sent and stores them
+    in the final image.
+
+    Alpaca sends images with X as the first axis but images are returned
+    row-major - (height, width) or (height, width, planes) - and
+    C-contiguous.  Incoming columns are converted to the image data type
+    and scattered into place a block at a time, so the conversion and
+    transpose need no temporary copy of the whole frame and each block
+    is still in cache when it is transposed.
+
+    :param dims: Image dimensions as sent - (X, Y) or (X, Y, planes).
+    :type dims: tuple
+    :param out_dtype: Data type of image.
+    :type out_dtype: :class:`numpy.dtype`
+    """
+
+    # columns converted and transposed at a time
+    block_columns = 256
+
+    def __init__(self, dims, out_dtype):
+        self.dims = tuple(dims)
+        self.size = int(np.prod(self.dims))
+        self.count = 0
+
+        self.image = np.empty((self.dims[1], self.dims[0]) + self.dims[2:],
+                              dtype=out_dtype)
+
+        # view of image indexed in the order elements are sent
+        self._wire_view = self.image.swapaxes(0, 1)
+        self._column_shape = self._wire_view.shape[1:]
+        self._column_size = self.size // self.dims[0]
+
+    def write(self, vals):
+        """
+        Store next elements of image.
+
+        :param vals: Elements in the order sent.
+        :type vals: :class:`numpy.ndarray`
+        :return: True on success, False if more elements than the image
+                 holds were received.
+        :rtype: bool
+        """
+        nvals = vals.size
+        if self.count + nvals > self.size:
+            logging.error(f'ImageArrayWriter: received more than the '
+                          f'expected {self.size} elements!')
+            return False
+
+        pos = 0
+        while pos < nvals:
+            col, offset = divmod(self.count, self._column_size)
+            if offset == 0 and nvals - pos >= self._column_size:
+                ncols = min((nvals - pos) // self._column_size,
+                            self.block_columns)
+                nwrite = ncols * self._column_size
+                block = vals[pos:pos + nwrite].reshape((ncols,)
+                                                       + self._column_shape)
+                # strided assignment with conversion is several times
+                # slower than converting a contiguous block first
+                if block.dtype != self.image.dtype:
+                    block = block.astype(self.image.dtype)
+                self._wire_view[col:col + ncols] = block
+            else:
+                # part of a column at the start or end of the chunk
+                nwrite = min(self._column_size - offset, nvals - pos)
+                self._wire_view[col].flat[offset:offset + nwrite] = \
+                    vals[pos:pos + nwrite]
+            pos += nwrite
+            self.count += nwrite
+
+        return True
+
+    def written(self):
+        """
+        Returns copy of the elements written so far in the order sent.
+
+        :rtype: :class:`numpy.ndarray`
+        """
+        return self._wire_view.reshape(-1)[:self.count]
+
+
+def decode_base64json_image(resp, maxadu=None):
+    """
+    Convert ImageArray sent in base64json mode into an image array.
+
+    :param resp: Decoded JSON response.
+    :type resp: dict
+    :param maxadu: Maximum pixel value used to pick image data type.
+    :type maxadu: int
+    :return: Image data in row-major format or None on error.
+    :rtype: :class:`numpy.ndarray`
+    """
+    metadata = check_image_metadata(resp)
+    if metadata is None:
+        return None
+
+    element_dtype, dims = metadata
+
+    writer = ImageArrayWriter(dims, image_output_dtype(element_dtype, maxadu))
+    if not decode_base64_text(resp['Value'], writer, element_dtype):
+        logging.error('Failed to decode base64json image data!')
+        return None
+
+    return writer.image
+
+
+def _imagebytes_layout(header):
+    """
+    Returns element dtypes and dimensions from an ImageBytes header.
+
+    :return: Tuple of image element dtype, transmitted element dtype and
+             dimensions or None if image cannot be handled.
+    :rtype: tuple
+    """
+    element_dtype = IMAGE_ELEMENT_DTYPES.get(header['ImageElementType'])
+    wire_dtype = IMAGE_ELEMENT_DTYPES.get(header['TransmissionElementType'])
+    if wire_dtype is None:
+        logging.error('Unknown ImageBytes transmission element type '
+                      f'{header["TransmissionElementType"]}!')
+        return None
+
+    # some servers leave image element type unknown (0)
+    if element_dtype is None:
+        element_dtype = wire_dtype
+
+    if header['Rank'] == 2:
+        dims = (header['Dimension1'], header['Dimension2'])
+    elif header['Rank'] == 3:
+        dims = (header['Dimension1'], header['Dimension2'],
+                header['Dimension3'])
+    else:
+        logging.error(f'ImageBytes returned Rank {header["Rank"]} - only 2 '
+                      'and 3 supported!')
+        return None
+
+    if min(dims) <= 0:
+        logging.error(f'ImageBytes returned invalid dimensions {dims}!')
+        return None
+
+    return element_dtype, wire_dtype, dims
+
+
+def decode_imagebytes(buf, maxadu=None):
+    """
+    Convert an ImageBytes response into an image array.
+
+    The elements are read through a view of buf so the only copy made
+    is the final image.
+
+    :param buf: Response body.
+    :type buf: bytes-like
+    :param maxadu: Maximum pixel value used to pick image data type.
+    :type maxadu: int
+    :return: Image data in row-major format or None on error.
+    :rtype: :class:`numpy.ndarray`
+    """
+    header = parse_imagebytes_header(buf)
+    if header is None:
+        return None
+
+    logging.debug(f'ImageBytes header = {header}')
+
+    data_start = header['DataStart']
+    if header['ErrorNumber'] != 0:
+        error_msg = bytes(buf[data_start:]).decode('utf-8', errors='replace')
+        logging.error('ImageBytes request returned error number '
+                      f'{header["ErrorNumber"]} error message "{error_msg}"')
+        return None
+
+    layout = _imagebytes_layout(header)
+    if layout is None:
+        return None
+
+    element_dtype, wire_dtype, dims = layout
+
+    writer = ImageArrayWriter(dims, image_output_dtype(element_dtype, maxadu))
+    if len(buf) - data_start < writer.size * wire_dtype.itemsize:
+        logging.error(f'ImageBytes response truncated - expected '
+                      f'{writer.size} elements of {wire_dtype}')
+        return None
+
+    writer.write(np.frombuffer(buf, dtype=wire_dtype, count=writer.size,
+                               offset=data_start))
+
+    return writer.image
+
+
+class RawStreamDecoder:
+    """
+    Converts raw little endian image elements into an image as they are
+    received.
+
+    :param writer: Image to receive the elements.
+    :type writer: :class:`ImageArrayWriter`
+    :param wire_dtype: Data type of the received elements.
+    :type wire_dtype: :class:`numpy.dtype`
+    """
+
+    def __init__(self, writer, wire_dtype):
+        self.writer = writer
+        self.wire_dtype = np.dtype(wire_dtype)
+        self.error = False
+
+        # bytes not yet making up a whole element
+        self._raw = b''
+
+    def write(self, raw):
+        """
+        Convert next chunk of raw data.
+
+        :param raw: Element data.
+        :type raw: bytes
+        :return: Number of bytes consumed - anything else means an error.
+        :rtype: int
+        """
+        if self.error:
+            return 0
+
+        nraw = len(raw)
+        if self._raw:
+            raw = self._raw + raw
+
+        nelem = len(raw) // self.wire_dtype.itemsize
+        self._raw = raw[nelem * self.wire_dtype.itemsize:]
+
+        if not self.writer.write(np.frombuffer(raw, dtype=self.wire_dtype,
+                                               count=nelem)):
+            self.error = True
+            return 0
+
+        return nraw
+
+    def finish(self):
+        """
+        Check that the whole image was received.
+
+        :return: True if all elements received.
+        :rtype: bool
+        """
+        if self.error:
+            return False
+
+        if self._raw:
+            logging.error(f'{self.__class__.__name__}: data ended on a '
+                          'partial element!')
+            return False
+
+        if self.writer.count != self.writer.size:
+            logging.error(f'{self.__class__.__name__}: only received '
+                          f'{self.writer.count} of {self.writer.size} '
+                          'elements!')
+            return False
+
+        return True
+
+
+class Base64StreamDecoder(RawStreamDecoder):
+    """
+    Decodes base64 encoded image data as it is received.
+
+    Pass :meth:`write` as the pycurl write callback so decoding overlaps
+    the download.  Each chunk is decoded on a 4 character boundary and the
+    complete elements converted straight into the final image, so only a
+    few KB of text and decoded bytes are held besides the frame.
+
+    :param writer: Image to receive the decoded elements.
+    :type writer: :class:`ImageArrayWriter`
+    :param wire_dtype: Data type of the encoded elements.
+    :type wire_dtype: :class:`numpy.dtype`
+    """
+
+    def __init__(self, writer, wire_dtype):
+        super().__init__(writer, wire_dtype)
+
+        # base64 text not yet on a 4 character boundary
+        self._text = b''
+
+    def write(self, chunk):
+        """
+        Decode next chunk of base64 text.
+
+        :param chunk: Base64 text.
+        :type chunk: bytes
+        :return: Number of bytes consumed - anything else tells pycurl
+                 to abort the transfer.
+        :rtype: int
+        """
+        if self.error:
+            return 0
+
+        # servers may wrap lines which would break the 4 character alignment
+        text = chunk.translate(None, b'\r\n')
+        if self._text:
+            text = self._text + text
+
+        nalign = len(text) - len(text) % 4
+        self._text = text[nalign:]
+        if nalign == 0:
+            return len(chunk)
+
+        try:
+            raw = binascii.a2b_base64(text[:nalign])
+        except binascii.Error:
+            logging.error('Base64StreamDecoder: invalid base64 data!')
+            self.error = True
+            return 0
+
+        if super().write(raw) != len(raw):
+            return 0
+
+        return len(chunk)
+
+    def finish(self):
+        """
+        Check that the whole array was received.
+
+        :return: True if all elements decoded.
+        :rtype: bool
+        """
+        if self._text:
+            logging.error('Base64StreamDecoder: data ended on a partial '
+                          'base64 group!')
+            return False
+
+        return super().finish()
+
+
+def decode_base64_text(text, writer, wire_dtype, chunk_size=1024*1024):
+    """
+    Decode base64 encoded image data held in a string into an image.
+
+    The text is decoded a chunk at a time so the only full size copy
+    made is the image itself.
+
+    :param text: Base64 text.
+    :type text: str
+    :param writer: Image to receive the decoded elements.
+    :type writer: :class:`ImageArrayWriter`
+    :param wire_dtype: Data type of the encoded elements.
+    :type wire_dtype: :class:`numpy.dtype`
+    :param chunk_size: Number of characters decoded at a time.
+    :type chunk_size: int
+    :return: True if all elements decoded.
+    :rtype: bool
+    """
+    # keep chunks on a 4 character boundary
+    chunk_size -= chunk_size % 4
+
+    decoder = Base64StreamDecoder(writer, wire_dtype)
+    for i in range(0, len(text), chunk_size):
+        chunk = text[i:i + chunk_size].encode('ascii')
+        if decoder.write(chunk) != len(chunk):
+            break
+
+    return decoder.finish()
+
+
+class ImageBytesStreamDecoder:
+    """
+    Decodes an ImageBytes response as it is received.
+
+    The metadata header is collected first and then the image elements
+    are converted into the final image chunk by chunk, so the response
+    body is never held in memory as a whole.
+
+    :param maxadu: Maximum pixel value used to pick image data type.
+    :type maxadu: int
+    """
+
+    def __init__(self, maxadu=None):
+        self.maxadu = maxadu
+        self.header = None
+        self.error = False
+
+        self._head = b''
+        self._decoder = None
+
+    def _start_data(self):
+        header = parse_imagebytes_header(self._head)
+        if header is None:
+            return False
+
+        data_start = header['DataStart']
+        if len(self._head) < data_start:
+            # header not all here yet
+            return True
+
+        self.header = header
+        logging.debug(f'ImageBytes header = {header}')
+
+        if header['ErrorNumber'] != 0:
+            # rest of response is the error message
+            return True
+
+        layout = _imagebytes_layout(header)
+        if layout is None:
+            return False
+
+        element_dtype, wire_dtype, dims = layout
+
+        writer = ImageArrayWriter(dims, image_output_dtype(element_dtype,
+                                                           self.maxadu))
+        self._decoder = RawStreamDecoder(writer, wire_dtype)
+
+        data = self._head[data_start:]
+        self._head = b''
+        return self._decoder.write(data) == len(data)
+
+    def write(self, chunk):
+        """
+        Decode next chunk of response.
+
+        :param chunk: Response data.
+        :type chunk: bytes
+        :return: Number of bytes consumed - anything else means an error.
+        :rtype: int
+        """
+        if self.error:
+            return 0
+
+        if self._decoder is None:
+            self._head += chunk
+            if len(self._head) >= IMAGEBYTES_HEADER.size \
+               and (self.header is None or self.header['ErrorNumber'] == 0):
+                if not self._start_data():
+                    self.error = True
+                    return 0
+            return len(chunk)
+
+        if self._decoder.write(chunk) != len(chunk):
+            self.error = True
+            return 0
+
+        return len(chunk)
+
+    def finish(self):
+        """
+        Returns decoded image.
+
+        :return: Image data in row-major format or None on error.
+        :rtype: :class:`numpy.ndarray`
+        """
+        if self.error:
+            return None
+
+        if self.header is None:
+            logging.error('ImageBytes response ended before header!')
+            return None
+
+        if self.header['ErrorNumber'] != 0:
+            error_msg = self._head[self.header['DataStart']:]
+            error_msg = error_msg.decode('utf-8', errors='replace')
+            logging.error('ImageBytes request returned error number '
+                          f'{self.header["ErrorNumber"]} '
+                          f'error message "{error_msg}"')
+            return None
+
+        if not self._decoder.finish():
+            return None
+
+        return self._decoder.writer.image
+
+
+class JsonImageStreamDecoder:
+    """
+    Decodes an ImageArray response sent as a plain JSON array as it is
+    received.
+
+    Building Python lists for every pixel of a large frame takes
+    gigabytes of memory and many seconds, so instead the text of the
+    Value array is converted straight into a numpy array with
+    :func:`numpy.fromstring` a chunk at a time.  The rest of the response
+    is small and parsed normally once the whole response is in.
+
+    :param maxadu: Maximum pixel value used to pick image data type.
+    :type maxadu: int
+    :param dims: Expected dimensions (X, Y), if known, so the image can be
+                 preallocated and filled as the response arrives.  The
+                 actual dimensions always come from the response metadata.
+    :type dims: tuple
+    """
+
+    # finds the start of the Value array
+    _VALUE_RE = re.compile(rb'"Value"\s*:\s*')
+    _BRACKET_RE = re.compile(rb'[\[\]]')
+
+    # turns everything between numbers into spaces for numpy.fromstring()
+    _SEPARATORS = bytes.maketrans(b'[],\r\n\t', b'      ')
+
+    # characters only found in floating point numbers
+    _FLOAT_RE = re.compile(rb'[.eE]')
+
+    def __init__(self, maxadu=None, dims=None):
+        self.maxadu = maxadu
+        self.error = False
+
+        # response text before and after the Value array
+        self._head = b''
+        self._value_start = None
+        self._tail = b''
+        self._value_done = False
+        self._not_array = False
+
+        # digits of a number split across chunks
+        self._partial = b''
+        self._depth = 0
+        self._columns = 0
+
+        # plain integers parse much faster than floats so only switch to
+        # floats if the server sends them
+        self._parse_dtype = np.dtype(np.int64)
+
+        # values go straight into the image if its size was given and
+        # otherwise are collected until the metadata is known
+        self._count = 0
+        self._chunks = []
+        self._writer = None
+        if dims:
+            self._writer = ImageArrayWriter(dims, image_output_dtype(
+                                                    np.int32, maxadu))
+
+    def _use_float(self):
+        self._parse_dtype = np.dtype(np.float64)
+        if self._writer is not None:
+            self._drop_writer()
+
+    def _drop_writer(self):
+        # guess of image size or type was wrong
+        self._chunks.append(self._writer.written())
+        self._writer = None
+
+    def _store(self, text):
+        if not text.strip():
+            return True
+
+        # older numpy does not raise on a float when parsing integers - it
+        # warns and returns the values before it - so look for floats first
+        if self._parse_dtype != np.float64 and self._FLOAT_RE.search(text):
+            self._use_float()
+
+        try:
+            with warnings.catch_warnings():
+                # a partial parse is only a DeprecationWarning in numpy
+                warnings.simplefilter('error', DeprecationWarning)
+                vals = np.fromstring(text, dtype=self._parse_dtype, sep=' ')
+        except (ValueError, DeprecationWarning):
+            if self._parse_dtype == np.float64:
+                logging.error('JsonImageStreamDecoder: invalid number in '
+                              'ImageArray!')
+                return False
+            self._use_float()
+            return self._store(text)
+
+        if self._writer is not None \
+           and self._writer.count + vals.size > self._writer.size:
+            self._drop_writer()
+
+        if self._writer is not None:
+            self._writer.write(vals)
+        else:
+            self._chunks.append(vals)
+        self._count += vals.size
+
+        return True
+
+    def _write_value(self, chunk):
+        end = None
+        for match in self._BRACKET_RE.finditer(chunk):
+            if match.group() == b'[':
+                self._depth += 1
+                if self._depth > 3:
+                    logging.error('JsonImageStreamDecoder: only Rank 2 '
+                                  'and 3 images supported!')
+                    return False
+            else:
+                self._depth -= 1
+                if self._depth == 1:
+                    self._columns += 1
+                elif self._depth == 0:
+                    end = match.end()
+                    break
+
+        if end is not None:
+            text = self._partial + chunk[:end]
+            self._partial = b''
+            self._value_done = True
+            self._tail = chunk[end:]
+            return self._store(text.translate(self._SEPARATORS))
+
+        text = (self._partial + chunk).translate(self._SEPARATORS)
+
+        # hold back last number in case it continues in next chunk
+        split = text.rfind(b' ') + 1
+        self._partial = text[split:]
+        return self._store(text[:split])
+
+    def write(self, chunk):
+        """
+        Decode next chunk of response.
+
+        :param chunk: Response data.
+        :type chunk: bytes
+        :return: Number of bytes consumed - anything else means an error.
+        :rtype: int
+        """
+        if self.error:
+            return 0
+
+        chunk = bytes(chunk)
+        nchunk = len(chunk)
+
+        if self._value_done:
+            self._tail += chunk
+            return nchunk
+
+        if self._value_start is None:
+            self._head += chunk
+            if self._not_array:
+                return nchunk
+
+            match = self._VALUE_RE.search(self._head)
+            if match is None or match.end() == len(self._head):
+                return nchunk
+
+            if self._head[match.end():match.end() + 1] != b'[':
+                # probably an error response - finish() will report it
+                self._not_array = True
+                return nchunk
+
+            self._value_start = match.end()
+            chunk = self._head[self._value_start:]
+            self._head = self._head[:self._value_start]
+
+        if not self._write_value(chunk):
+            self.error = True
+            return 0
+
+        return nchunk
+
+    def finish(self):
+        """
+        Returns decoded image.
+
+        :return: Image data in row-major format or None on error.
+        :rtype: :class:`numpy.ndarray`
+        """
+        if self.error:
+            return None
+
+        if self._value_start is None:
+            text = self._head
+        elif self._value_done:
+            text = self._head + b'null' + self._tail
+        else:
+            logging.error('JsonImageStreamDecoder: response ended inside '
+                          'ImageArray Value!')
+            return None
+
+        try:
+            resp = fast_json.loads(text)
+        except ValueError:
+            logging.error('imagearray resp json parse error!')
+            return None
+
+        error_num = resp.get('ErrorNumber', 0)
+        if error_num != 0:
+            logging.error(f'imagearray request returned error number '
+                          f'{error_num} error message '
+                          f'"{resp.get("ErrorMessage", "Unknown")}"')
+            return None
+
+        if self._value_start is None:
+            logging.error('imagearray response Value is not a JSON array!')
+            return None
+
+        metadata = check_image_metadata(resp)
+        if metadata is None:
+            return None
+
+        element_dtype, dims = metadata
+
+        if self._columns != dims[0] or self._count != np.prod(dims):
+            logging.error(f'ImageArray value has {self._columns} columns and '
+                          f'{self._count} elements - expected shape '
+                          f'{dims}!')
+            return None
+
+        out_dtype = image_output_dtype(element_dtype, self.maxadu)
+
+        if self._writer is not None:
+            if self._writer.dims == dims:
+                return self._writer.image.astype(out_dtype, copy=False)
+            self._drop_writer()
+
+        writer = ImageArrayWriter(dims, out_dtype)
+        for vals in self._chunks:
+            writer.write(vals)
+
+        return writer.image
+
+
+def is_json_image_array(body):
+    """
+    Test if an imagearray response holds ImageArray as a plain JSON array.
+
+    :param body: Response body.
+    :type body: bytes-like
+    :rtype: bool
+    """
+    match = JsonImageStreamDecoder._VALUE_RE.search(body)
+    return match is not None \
+        and bytes(body[match.end():match.end() + 1]) == b'['
+
+
+def decode_json_image(body, maxadu=None, chunk_size=1024*1024):
+    """
+    Convert imagearray response holding ImageArray as a plain JSON array
+    into an image array.
+
+    The response is passed to :class:`JsonImageStreamDecoder` a chunk at a
+    time so no Python list is built for the pixels.
+
+    :param body: Response body.
+    :type body: bytes-like
+    :param maxadu: Maximum pixel value used to pick image data type.
+    :type maxadu: int
+    :param chunk_size: Number of bytes decoded at a time.
+    :type chunk_size: int
+    :return: Image data in row-major format or None on error.
+    :rtype: :class:`numpy.ndarray`
+    """
+    decoder = JsonImageStreamDecoder(maxadu)
+    for i in range(0, len(body), chunk_size):
+        chunk = body[i:i + chunk_size]
+        if decoder.write(chunk) != len(chunk):
+            break
+
+    return decoder.finish()
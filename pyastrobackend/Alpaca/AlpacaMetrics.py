@@ -0,0 +1,341 @@
+#
+# Alpaca request metrics
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Per device and property latency histograms and counters """
+
+import time
+import bisect
+from threading import Lock
+from contextlib import contextmanager
+
+# upper bounds in seconds of the latency histogram buckets - a last
+# bucket with no upper bound is always added
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# kinds of error counted
+ERROR_TRANSPORT = 'transport'
+ERROR_TIMEOUT = 'timeout'
+ERROR_CIRCUIT_OPEN = 'circuit_open'
+ERROR_HTTP = 'http'
+ERROR_PARSE = 'parse'
+ERROR_ALPACA = 'alpaca'
+
+
+class RequestSeries:
+    """
+    Counters for one kind of request - one method on one property of one
+    device on one server.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.errors = {}
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.in_flight = 0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def quantile(self, q):
+        """
+        Estimate latency quantile from the histogram.
+
+        Interpolates linearly within the bucket the quantile falls in, the
+        same way Prometheus histogram_quantile() does.
+
+        :param q: Quantile between 0 and 1.
+        :type q: float
+        :return: Estimated latency in seconds or None if nothing observed.
+        :rtype: float
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.bucket_counts):
+            if n and cumulative + n >= rank:
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    # no upper bound so best guess is the largest seen
+                    return self.max_seconds
+                upper = min(self.buckets[i], self.max_seconds)
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+
+        return self.max_seconds
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for le, n in zip((*self.buckets, float('inf')), self.bucket_counts):
+            total += n
+            cumulative.append((le, total))
+
+        return {'count': self.count,
+                'seconds': self.seconds,
+                'max_seconds': self.max_seconds,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'buckets': cumulative,
+                'errors': dict(self.errors),
+                'wire_bytes': self.wire_bytes,
+                'decoded_bytes': self.decoded_bytes,
+                'in_flight': self.in_flight}
+
+
+class RequestTracker:
+    """
+    Handed out by :meth:`AlpacaMetrics.track` to record the outcome of
+    one request.
+    """
+
+    def __init__(self):
+        self.error_kind = None
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+
+    def error(self, kind):
+        """
+        Mark request as failed.
+
+        :param kind: One of ERROR_TRANSPORT, ERROR_TIMEOUT,
+                     ERROR_CIRCUIT_OPEN, ERROR_HTTP, ERROR_PARSE or
+                     ERROR_ALPACA.
+        :type kind: str
+        """
+        self.error_kind = kind
+
+    def transferred(self, wire_bytes, decoded_bytes):
+        """
+        Record size of the response received.
+
+        :param wire_bytes: Bytes received over the network.
+        :type wire_bytes: int
+        :param decoded_bytes: Size of body after any decompression.
+        :type decoded_bytes: int
+        """
+        self.wire_bytes += wire_bytes
+        self.decoded_bytes += decoded_bytes
+
+
+class AlpacaMetrics:
+    """
+    Latency histograms, byte and error counts and in flight request
+    counts for every device property requested from Alpaca servers.
+
+    Requests are grouped by server, device, property and HTTP method.
+    Results can be read as a dictionary with :meth:`get_metrics` or as
+    Prometheus text exposition format with :meth:`prometheus_text`.
+
+    All methods are thread safe.
+
+    :param buckets: Upper bounds in seconds of latency histogram buckets.
+    :type buckets: tuple
+    :param enabled: If False nothing is recorded.
+    :type enabled: bool
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS, enabled=True):
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+
+        self._lock = Lock()
+        self._series = {}
+
+    def _get_series(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = RequestSeries(self.buckets)
+            self._series[key] = series
+        return series
+
+    @contextmanager
+    def track(self, server, device_type, device_number, prop, method):
+        """
+        Time a request and record its outcome.
+
+        Use as a context manager around the request.  The
+        :class:`RequestTracker` yielded is used to record bytes received
+        and errors.  An exception raised inside the block is counted as a
+        transport error.
+
+        :param server: Tuple of (host, port).
+        :type server: tuple
+        :param device_type: Alpaca device type.
+        :type device_type: str
+        :param device_number: Alpaca device number.
+        :type device_number: int
+        :param prop: Property requested.
+        :type prop: str
+        :param method: HTTP method - 'GET' or 'PUT'.
+        :type method: str
+        """
+        tracker = RequestTracker()
+        if not self.enabled:
+            yield tracker
+            return
+
+        key = (f'{server[0]}:{server[1]}', device_type, str(device_number),
+               prop.lower(), method)
+        with self._lock:
+            self._get_series(key).in_flight += 1
+
+        start = time.monotonic()
+        try:
+            yield tracker
+        except BaseException:
+            tracker.error(ERROR_TRANSPORT)
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            with self._lock:
+                series = self._get_series(key)
+                series.in_flight -= 1
+                series.observe(seconds)
+                series.wire_bytes += tracker.wire_bytes
+                series.decoded_bytes += tracker.decoded_bytes
+                if tracker.error_kind is not None:
+                    series.errors[tracker.error_kind] = \
+                        series.errors.get(tracker.error_kind, 0) + 1
+
+    def reset(self):
+        """
+        Clear all recorded metrics.
+        """
+        with self._lock:
+            # keep series with requests in flight so their gauge stays right
+            for key, series in list(self._series.items()):
+                if series.in_flight:
+                    fresh = RequestSeries(self.buckets)
+                    fresh.in_flight = series.in_flight
+                    self._series[key] = fresh
+                else:
+                    del self._series[key]
+
+    def get_metrics(self):
+        """
+        Returns metrics for every kind of request seen.
+
+        :return: Dictionary mapping (server, device type, device number,
+                 property, method) to a dictionary with keys 'count',
+                 'seconds' (total), 'max_seconds', 'p50', 'p90', 'p99'
+                 (estimated from histogram), 'buckets' (list of cumulative
+                 (upper bound, count) pairs), 'errors' (dictionary of count
+                 of each kind of error), 'wire_bytes', 'decoded_bytes' and
+                 'in_flight'.
+        :rtype: dict
+        """
+        with self._lock:
+            return {key: series.snapshot()
+                    for key, series in self._series.items()}
+
+    def get_slowest(self, n=10, q=0.9):
+        """
+        Returns the kinds of request with the highest latency.
+
+        :param n: Number of entries to return.
+        :type n: int
+        :param q: Latency quantile to rank by.
+        :type q: float
+        :return: List of (key, latency in seconds) tuples, slowest first.
+        :rtype: list
+        """
+        with self._lock:
+            latencies = [(key, series.quantile(q))
+                         for key, series in self._series.items()
+                         if series.count]
+        latencies.sort(key=lambda x: x[1], reverse=True)
+        return latencies[:n]
+
+    @staticmethod
+    def _labels(key, **extra):
+        server, device_type, device_number, prop, method = key
+        labels = {'server': server, 'device_type': device_type,
+                  'device_number': device_number, 'property': prop,
+                  'method': method, **extra}
+        text = ','.join(f'{k}="{_escape_label(v)}"'
+                        for k, v in labels.items())
+        return '{' + text + '}'
+
+    def prometheus_text(self, prefix='alpaca'):
+        """
+        Returns metrics in Prometheus text exposition format.
+
+        :param prefix: Prefix for metric names.
+        :type prefix: str
+        :return: Text ready to be served from a /metrics endpoint.
+        :rtype: str
+        """
+        metrics = self.get_metrics()
+        keys = sorted(metrics)
+
+        lines = []
+
+        name = f'{prefix}_request_duration_seconds'
+        lines.append(f'# HELP {name} Alpaca request latency.')
+        lines.append(f'# TYPE {name} histogram')
+        for key in keys:
+            m = metrics[key]
+            for le, n in m['buckets']:
+                le = '+Inf' if le == float('inf') else repr(le)
+                lines.append(f'{name}_bucket{self._labels(key, le=le)} {n}')
+            lines.append(f'{name}_sum{self._labels(key)} {m["seconds"]!r}')
+            lines.append(f'{name}_count{self._labels(key)} {m["count"]}')
+
+        name = f'{prefix}_request_errors_total'
+        lines.append(f'# HELP {name} Failed Alpaca requests.')
+        lines.append(f'# TYPE {name} counter')
+        for key in keys:
+            for kind, n in sorted(metrics[key]['errors'].items()):
+                lines.append(f'{name}{self._labels(key, kind=kind)} {n}')
+
+        for field, help_text in (('wire_bytes', 'Bytes received over the '
+                                                'network.'),
+                                 ('decoded_bytes', 'Bytes of response body '
+                                                   'after decompression.')):
+            name = f'{prefix}_response_{field}_total'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for key in keys:
+                lines.append(f'{name}{self._labels(key)} {metrics[key][field]}')
+
+        name = f'{prefix}_requests_in_flight'
+        lines.append(f'# HELP {name} Alpaca requests waiting for a response.')
+        lines.append(f'# TYPE {name} gauge')
+        for key in keys:
+            lines.append(f'{name}{self._labels(key)} '
+                         f'{metrics[key]["in_flight"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
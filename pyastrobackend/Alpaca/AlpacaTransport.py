@@ -0,0 +1,781 @@
+#
+# Alpaca HTTP transport
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Pooled keep-alive HTTP transport for Alpaca requests """
+
+import math
+import time
+import random
+import logging
+from threading import Lock
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pycurl
+import requests
+from requests.adapters import HTTPAdapter
+
+# timeout classes - property reads should answer quickly, commands may
+# make a driver do some work before it replies and bulk image transfers
+# can take a long time but should never stall
+TIMEOUT_PROPERTY = 'property'
+TIMEOUT_COMMAND = 'command'
+TIMEOUT_IMAGE = 'image'
+
+# (connect, read) timeouts in seconds - for images the read timeout is
+# the longest the transfer may stall, not a limit on its total time
+DEFAULT_TIMEOUTS = {TIMEOUT_PROPERTY: (3.05, 10.0),
+                    TIMEOUT_COMMAND: (3.05, 30.0),
+                    TIMEOUT_IMAGE: (3.05, 60.0)}
+
+# curl errors which mean the server could not be reached or stopped
+# responding rather than that the transfer was aborted locally
+CURL_HOST_ERRORS = (pycurl.E_COULDNT_RESOLVE_HOST, pycurl.E_COULDNT_CONNECT,
+                    pycurl.E_OPERATION_TIMEDOUT, pycurl.E_SEND_ERROR,
+                    pycurl.E_RECV_ERROR, pycurl.E_GOT_NOTHING)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a server which has been
+    failing.
+    """
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of requests sent.
+
+    Each request adds ratio to a balance of tokens and each retry spends
+    a whole token, so when a server is struggling retries can add at most
+    that fraction to its load instead of multiplying it.  The balance
+    starts full so a client which only sends a few requests can still
+    retry a few times.
+
+    :param ratio: Retries allowed per request sent.
+    :type ratio: float
+    :param max_tokens: Most retries which can be saved up.
+    :type max_tokens: float
+    """
+
+    def __init__(self, ratio=0.1, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+
+        self._lock = Lock()
+        self._tokens = max_tokens
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        """
+        Called for each request sent.
+        """
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        Ask to send a retry.
+
+        :return: True if the retry may be sent.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._tokens < 1.0:
+                self.denied += 1
+                return False
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def get_stats(self):
+        """
+        Returns retries sent and refused.
+
+        :return: Dictionary with keys 'retries', 'denied' and 'tokens'.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'retries': self.retries, 'denied': self.denied,
+                    'tokens': self._tokens}
+
+
+class CircuitBreaker:
+    """
+    Fails requests to a server fast while it is down.
+
+    After failure_threshold requests in a row fail to reach the server
+    the circuit opens and requests are refused without being sent.  Once
+    reset_timeout seconds have passed one request is let through to probe
+    the server - if it gets a response the circuit closes again,
+    otherwise it stays open for another reset_timeout.
+
+    Only failures to get a response at all count.  A server which answers
+    with an error is up.
+
+    :param failure_threshold: Failures in a row which open the circuit.
+                              Use 0 to never open it.
+    :type failure_threshold: int
+    :param reset_timeout: Seconds before a probe request is allowed.
+    :type reset_timeout: float
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = Lock()
+        self._failures = 0
+        self._opened_at = None
+        self.trips = 0
+        self.rejected = 0
+
+    def is_open(self):
+        """
+        Test if requests are currently being refused.
+        """
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """
+        Ask to send a request.
+
+        :return: True if request may be sent.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # let this one through as a probe and hold off everyone
+                # else for another reset_timeout
+                self._opened_at = now
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info('CircuitBreaker: server responding again')
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is None and self.failure_threshold \
+               and self._failures >= self.failure_threshold:
+                logging.error(f'CircuitBreaker: {self._failures} failures in '
+                              f'a row - failing requests for '
+                              f'{self.reset_timeout} seconds')
+                self._opened_at = time.monotonic()
+                self.trips += 1
+
+    def get_stats(self):
+        """
+        Returns breaker state and counts.
+
+        :return: Dictionary with keys 'open', 'failures' (in a row),
+                 'trips' and 'rejected'.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'open': self._opened_at is not None,
+                    'failures': self._failures,
+                    'trips': self.trips,
+                    'rejected': self.rejected}
+
+
+class AlpacaSessionPool:
+    """
+    Keep-alive HTTP session shared by all devices of a backend.
+
+    Connections are kept open between requests so property polling does
+    not pay for a TCP handshake on every call.  If the pool sits idle
+    longer than idle_timeout seconds the session is dropped and a fresh one
+    is created on next use, since most servers will have closed the idle
+    sockets by then anyway.
+
+    :param pool_size: Maximum number of connections kept open per host.
+    :type pool_size: int
+    :param idle_timeout: Seconds of inactivity before session is evicted.
+                         Use 0 or None to never evict.
+    :type idle_timeout: float
+    :param accept_encoding: Value of Accept-Encoding header sent.
+    :type accept_encoding: str
+    """
+
+    def __init__(self, pool_size=4, idle_timeout=30.0,
+                 accept_encoding='identity'):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.accept_encoding = accept_encoding
+
+        self._lock = Lock()
+        self._session = None
+        self._last_used = 0
+        self._in_flight = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = self.accept_encoding
+        return session
+
+    def _acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            idle = now - self._last_used
+            if self._session is not None and self._in_flight == 0 \
+               and self.idle_timeout and idle > self.idle_timeout:
+                logging.debug(f'AlpacaSessionPool: evicting session idle '
+                              f'for {idle:.1f} seconds')
+                self._session.close()
+                self._session = None
+
+            if self._session is None:
+                self._session = self._new_session()
+
+            self._in_flight += 1
+            self._last_used = now
+            return self._session
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.monotonic()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send HTTP request using a pooled connection.
+
+        Accepts same arguments as :meth:`requests.Session.request`.
+
+        :return: Response object.
+        :rtype: :class:`requests.Response`
+        """
+        session = self._acquire()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self._release()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def set_accept_encoding(self, accept_encoding):
+        """
+        Change Accept-Encoding header sent from now on.
+        """
+        with self._lock:
+            self.accept_encoding = accept_encoding
+            if self._session is not None:
+                self._session.headers['Accept-Encoding'] = accept_encoding
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class CurlHandlePool:
+    """
+    Reusable pycurl handles for large image downloads.
+
+    A curl handle keeps its connection, DNS and TCP state alive between
+    transfers so reusing one for the next frame avoids reconnecting and
+    going through TCP slow start again.  Handles are kept per host:port
+    and each one is only ever used by one thread at a time.
+
+    :param max_idle: Maximum number of idle handles kept per host.
+    :type max_idle: int
+    :param buffer_size: Receive buffer size in bytes passed to curl - a
+                        larger buffer means fewer write callbacks.
+    :type buffer_size: int
+    :param tcp_nodelay: Disable Nagle algorithm on connections.
+    :type tcp_nodelay: bool
+    """
+
+    def __init__(self, max_idle=4, buffer_size=512*1024, tcp_nodelay=True):
+        self.max_idle = max_idle
+        self.buffer_size = buffer_size
+        self.tcp_nodelay = tcp_nodelay
+
+        self._lock = Lock()
+        self._idle = {}
+
+    def _setup_handle(self, c):
+        c.setopt(c.NOSIGNAL, 1)
+        c.setopt(c.BUFFERSIZE, self.buffer_size)
+        c.setopt(c.TCP_NODELAY, 1 if self.tcp_nodelay else 0)
+        c.setopt(c.TCP_KEEPALIVE, 1)
+
+    @contextmanager
+    def handle(self, host, port):
+        """
+        Borrow a curl handle for a transfer to host:port.
+
+        Use as a context manager - the handle is returned to the pool on
+        exit with its options reset but connections left open.
+
+        :param host: Server name or address.
+        :type host: str
+        :param port: Server port.
+        :type port: int
+        """
+        key = f'{host}:{port}'
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            c = idle.pop() if idle else None
+
+        if c is None:
+            logging.debug(f'CurlHandlePool: new handle for {key}')
+            c = pycurl.Curl()
+
+        self._setup_handle(c)
+        try:
+            yield c
+        finally:
+            # clears options and callbacks but keeps the connection cache
+            c.reset()
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(c)
+                    c = None
+            if c is not None:
+                c.close()
+
+    def close(self, host=None, port=None):
+        """
+        Close idle handles and their connections.
+
+        :param host: If given only close handles for host:port.
+        :type host: str
+        :param port: Server port.
+        :type port: int
+        """
+        with self._lock:
+            if host is None:
+                keys = list(self._idle.keys())
+            else:
+                keys = [f'{host}:{port}']
+
+            for key in keys:
+                for c in self._idle.pop(key, []):
+                    c.close()
+
+
+class TransferStats:
+    """
+    Totals of bytes received and time taken for requests to a server.
+
+    Wire bytes are what was actually received and decoded bytes what the
+    body decompressed to, so their ratio shows how much HTTP compression
+    is saving.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.seconds = 0.0
+
+    def record(self, wire_bytes, decoded_bytes, seconds):
+        with self._lock:
+            self.requests += 1
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+            self.seconds += seconds
+
+    def get_stats(self):
+        """
+        Returns transfer totals.
+
+        :return: Dictionary with keys 'requests', 'wire_bytes',
+                 'decoded_bytes', 'ratio' (decoded / wire) and 'seconds'.
+        :rtype: dict
+        """
+        with self._lock:
+            ratio = self.decoded_bytes / self.wire_bytes \
+                if self.wire_bytes else 1.0
+            return {'requests': self.requests,
+                    'wire_bytes': self.wire_bytes,
+                    'decoded_bytes': self.decoded_bytes,
+                    'ratio': ratio,
+                    'seconds': self.seconds}
+
+
+class SingleFlight:
+    """
+    Coalesces identical reads issued at the same time.
+
+    If a read of a device property is already in flight when another
+    thread asks for the same property the second thread waits for the
+    first request and shares its result instead of sending its own.
+
+    Writes act as barriers - :meth:`barrier` is called before and after a
+    write so a read started on one side of the write is never answered
+    with a result from the other side.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+
+        # maps (device, prop, generation) to Future of read in flight
+        self._in_flight = {}
+
+        # maps device to count of writes started and finished on it
+        self._generations = {}
+
+        self.requests = 0
+        self.shared = 0
+
+    def barrier(self, device):
+        """
+        Stop reads of device started from now on joining reads already
+        in flight.
+
+        :param device: Key identifying device.
+        :type device: tuple
+        """
+        with self._lock:
+            self._generations[device] = self._generations.get(device, 0) + 1
+
+    def do(self, device, prop, fn, *args, **kwargs):
+        """
+        Call fn to read prop of device unless the same read is already in
+        flight, in which case wait for it and return its result.
+
+        :param device: Key identifying device.
+        :type device: tuple
+        :param prop: Property being read.
+        :type prop: str
+        :return: Result of fn.
+        """
+        with self._lock:
+            key = (device, prop, self._generations.get(device, 0))
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.shared += 1
+                leader = False
+            else:
+                self.requests += 1
+                future = Future()
+                self._in_flight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+        return result
+
+    def get_stats(self):
+        """
+        Returns count of requests sent and reads answered by sharing one.
+
+        :return: Dictionary with keys 'requests' and 'shared'.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'requests': self.requests, 'shared': self.shared}
+
+
+class AlpacaHostTransport:
+    """
+    All connection resources used to talk to one Alpaca server.
+
+    Each server gets its own HTTP session pool and worker threads so a
+    slow or hung server can only tie up connections and threads of its
+    own and never delays requests to other servers.
+
+    :param host: Server name or address.
+    :type host: str
+    :param port: Server port.
+    :type port: int
+    :param pool_size: Maximum number of HTTP connections and concurrent
+                      worker threads for this server.
+    :type pool_size: int
+    :param idle_timeout: Seconds of inactivity before HTTP session is evicted.
+    :type idle_timeout: float
+    :param curl_pool: Curl handle pool to borrow image transfer handles from.
+    :type curl_pool: :class:`CurlHandlePool`
+    :param compression: Ask server to gzip/deflate responses.  Worth it
+                        on slow links but only costs CPU on a LAN.
+    :type compression: bool
+    :param timeouts: Dictionary mapping timeout class to (connect, read)
+                     timeouts in seconds, overriding DEFAULT_TIMEOUTS.
+    :type timeouts: dict
+    :param max_retries: Most times a failed idempotent request is retried.
+    :type max_retries: int
+    :param retry_budget: Limit on retries to this server.
+    :type retry_budget: :class:`RetryBudget`
+    :param circuit_breaker: Breaker for this server.
+    :type circuit_breaker: :class:`CircuitBreaker`
+    """
+
+    # first retry waits about this long in seconds, later ones longer
+    retry_backoff = 0.05
+
+    def __init__(self, host, port, pool_size=4, idle_timeout=30.0,
+                 curl_pool=None, compression=False, timeouts={},
+                 max_retries=2, retry_budget=None, circuit_breaker=None):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.compression = compression
+
+        self.timeouts = {**DEFAULT_TIMEOUTS, **timeouts}
+        self.max_retries = max_retries
+
+        if retry_budget is None:
+            retry_budget = RetryBudget()
+        self.retry_budget = retry_budget
+
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+
+        self.session_pool = AlpacaSessionPool(
+                                pool_size=pool_size,
+                                idle_timeout=idle_timeout,
+                                accept_encoding=self.accept_encoding())
+
+        self.transfer_stats = TransferStats()
+
+        if curl_pool is None:
+            curl_pool = CurlHandlePool(max_idle=pool_size)
+        self.curl_pool = curl_pool
+
+        # concurrent reads of the same property share one request
+        self.single_flight = SingleFlight()
+
+        # how this server sends ImageArray - None until first image
+        self.image_transfer_mode = None
+
+        self._executor = None
+        self._executor_lock = Lock()
+
+    def url(self, path):
+        """
+        Returns full URL for path on this server.
+        """
+        return f'http://{self.host}:{self.port}/{path}'
+
+    def accept_encoding(self):
+        """
+        Returns Accept-Encoding header value to send to this server.
+        """
+        return 'gzip, deflate' if self.compression else 'identity'
+
+    def set_compression(self, compression):
+        """
+        Turn HTTP compression on or off for requests to this server.
+
+        :param compression: True to ask for compressed responses.
+        :type compression: bool
+        """
+        self.compression = compression
+        self.session_pool.set_accept_encoding(self.accept_encoding())
+
+    def _check_circuit(self):
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError(f'Alpaca server {self.host}:{self.port} '
+                                   'is not responding')
+
+    def request(self, method, url, timeout_class=TIMEOUT_PROPERTY,
+                retry=False, **kwargs):
+        """
+        Send HTTP request with the timeouts of timeout_class.
+
+        If retry is True and the request could not connect or timed out
+        it is sent again, up to max_retries times if the retry budget
+        allows.  Only use for idempotent requests.
+
+        Accepts same other arguments as :meth:`requests.Session.request`.
+
+        :return: Response object.
+        :rtype: :class:`requests.Response`
+        :raises CircuitOpenError: If server has been failing.
+        :raises requests.exceptions.RequestException: If request failed.
+        """
+        self._check_circuit()
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                resp = self.session_pool.request(
+                                method, url,
+                                timeout=self.timeouts[timeout_class],
+                                **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as err:
+                self.circuit_breaker.record_failure()
+                if not retry or attempt >= self.max_retries \
+                   or self.circuit_breaker.is_open() \
+                   or not self.retry_budget.withdraw():
+                    raise
+                attempt += 1
+                logging.warning(f'{method} {url} failed ({err}) - retry '
+                                f'{attempt} of {self.max_retries}')
+                # jitter so clients that failed together do not retry
+                # together
+                time.sleep(self.retry_backoff * 2**(attempt-1)
+                           * random.uniform(0.5, 1.5))
+                continue
+
+            self.circuit_breaker.record_success()
+            return resp
+
+    @contextmanager
+    def curl_handle(self, timeout_class=TIMEOUT_IMAGE):
+        """
+        Borrow a curl handle for this server - see
+        :meth:`CurlHandlePool.handle`.
+
+        If compression is enabled the handle asks for a compressed
+        response and curl decompresses it as it arrives, so the write
+        callback always sees the decoded body.
+
+        The connect timeout of timeout_class is applied and the transfer
+        is aborted if it stalls for longer than its read timeout.  Use
+        :meth:`perform` to run the transfer.
+
+        :raises CircuitOpenError: If server has been failing.
+        """
+        self._check_circuit()
+
+        connect_timeout, read_timeout = self.timeouts[timeout_class]
+        with self.curl_pool.handle(self.host, self.port) as c:
+            c.setopt(c.ACCEPT_ENCODING, self.accept_encoding())
+            c.setopt(c.CONNECTTIMEOUT_MS, int(connect_timeout * 1000))
+            c.setopt(c.LOW_SPEED_LIMIT, 1)
+            c.setopt(c.LOW_SPEED_TIME, max(1, math.ceil(read_timeout)))
+            yield c
+
+    def perform(self, c):
+        """
+        Run transfer on curl handle from :meth:`curl_handle` and note
+        whether the server responded.
+
+        :raises pycurl.error: If transfer failed.
+        """
+        try:
+            c.perform()
+        except pycurl.error as err:
+            if err.args[0] in CURL_HOST_ERRORS:
+                self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+
+    def record_curl_transfer(self, c, decoded_bytes, req):
+        """
+        Record size and time of a completed curl transfer.
+
+        :param c: Curl handle used for the transfer.
+        :type c: :class:`pycurl.Curl`
+        :param decoded_bytes: Size of the decoded response body.
+        :type decoded_bytes: int
+        :param req: URL requested, for logging.
+        :type req: str
+        :return: Tuple of wire and decoded bytes.
+        :rtype: (int, int)
+        """
+        wire_bytes = c.getinfo(c.SIZE_DOWNLOAD_T)
+        seconds = c.getinfo(c.TOTAL_TIME)
+        self.transfer_stats.record(wire_bytes, decoded_bytes, seconds)
+
+        ratio = decoded_bytes / wire_bytes if wire_bytes else 1.0
+        logging.debug(f'{req}: {decoded_bytes} bytes received as '
+                      f'{wire_bytes} (ratio {ratio:.2f}) in '
+                      f'{seconds:.3f} seconds')
+
+        return wire_bytes, decoded_bytes
+
+    def record_response(self, resp):
+        """
+        Record size and time of a completed requests response.
+
+        :param resp: Response with body already read.
+        :type resp: :class:`requests.Response`
+        :return: Tuple of wire and decoded bytes.
+        :rtype: (int, int)
+        """
+        # raw.tell() counts bytes before decompression
+        wire_bytes = resp.raw.tell()
+        decoded_bytes = len(resp.content)
+        self.transfer_stats.record(wire_bytes, decoded_bytes,
+                                   resp.elapsed.total_seconds())
+        return wire_bytes, decoded_bytes
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn on one of the worker threads for this server.
+
+        :return: Future for result of fn.
+        :rtype: :class:`concurrent.futures.Future`
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                                    max_workers=self.pool_size,
+                                    thread_name_prefix=f'Alpaca-{self.host}:'
+                                                       f'{self.port}')
+            return self._executor.submit(fn, *args, **kwargs)
+
+    def close(self):
+        """
+        Close connections and stop worker threads.
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+        self.session_pool.close()
+        self.curl_pool.close(self.host, self.port)
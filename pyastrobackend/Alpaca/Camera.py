@@ -18,22 +18,189 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import time
-import base64
 import logging
-import numpy as np
+from threading import Lock
 
 from pyastrobackend.BaseBackend import BaseCamera
 from pyastrobackend.Alpaca.AlpacaDevice import AlpacaDevice
+from pyastrobackend.Alpaca.AlpacaDevice import PROP_CACHE_STATIC
+from pyastrobackend.Alpaca.AlpacaImage import IMAGEBYTES_MIME_TYPE
+from pyastrobackend.Alpaca.AlpacaImage import Base64StreamDecoder
+from pyastrobackend.Alpaca.AlpacaImage import JsonImageStreamDecoder
+from pyastrobackend.Alpaca.AlpacaImage import ImageArrayWriter
+from pyastrobackend.Alpaca.AlpacaImage import check_image_metadata
+from pyastrobackend.Alpaca.AlpacaImage import image_output_dtype
+from pyastrobackend.Alpaca.AlpacaImage import decode_imagebytes
+from pyastrobackend.Alpaca.AlpacaImage import decode_json_image
+from pyastrobackend.Alpaca.AlpacaImage import is_json_image_array
+from pyastrobackend.Alpaca.AlpacaImage import decode_base64json_image
+from pyastrobackend.Alpaca.AlpacaImage import fast_json
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_HEADERS
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_IMAGEBYTES
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64JSON
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64HANDOFF
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_JSON
+
+# camerastate value reported after a failed exposure
+CAMERA_STATE_ERROR = 5
+
+# parameter name used to write each binning and frame property
+GEOMETRY_PARAMS = {
+    'binx': 'BinX',
+    'biny': 'BinY',
+    'startx': 'StartX',
+    'starty': 'StartY',
+    'numx': 'NumX',
+    'numy': 'NumY'
+}
+FRAME_PROPS = ('startx', 'starty', 'numx', 'numy')
+
+# wait_for_image() gives up after this many polls in a row get no answer
+MAX_FAILED_IMAGE_POLLS = 10
+
+
+def image_poll_delay(time_left, poll_interval=0.1, max_poll_interval=1.0):
+    """
+    Returns how long to wait before next check if an image is ready.
+
+    Polls get closer together approaching the expected end of the
+    exposure and then back off again if readout takes a while.
+
+    :param time_left: Seconds until exposure should end - negative once
+                      it should have ended.
+    :type time_left: float
+    :param poll_interval: Shortest time in seconds between polls.
+    :type poll_interval: float
+    :param max_poll_interval: Longest time in seconds between polls.
+    :type max_poll_interval: float
+    :return: Delay in seconds.
+    :rtype: float
+    """
+    return min(max_poll_interval, max(poll_interval, abs(time_left) / 2))
+
+
+def image_wait_lead(duration, poll_interval=0.1):
+    """
+    Returns how many seconds before the expected end of an exposure to
+    start polling.
+
+    :param duration: Exposure duration in seconds.
+    :type duration: float
+    :return: Seconds.
+    :rtype: float
+    """
+    return max(poll_interval, min(1.0, 0.1 * duration))
+
 
 class Camera(AlpacaDevice, BaseCamera):
 
+    prop_cache_policy = {
+        'name': PROP_CACHE_STATIC,
+        'description': PROP_CACHE_STATIC,
+        'driverinfo': PROP_CACHE_STATIC,
+        'driverversion': PROP_CACHE_STATIC,
+        'pixelsizex': PROP_CACHE_STATIC,
+        'pixelsizey': PROP_CACHE_STATIC,
+        'cameraxsize': PROP_CACHE_STATIC,
+        'cameraysize': PROP_CACHE_STATIC,
+        'maxadu': PROP_CACHE_STATIC,
+        'maxbinx': PROP_CACHE_STATIC,
+        'maxbiny': PROP_CACHE_STATIC,
+        'exposuremin': PROP_CACHE_STATIC,
+        'exposuremax': PROP_CACHE_STATIC,
+        'electronsperadu': PROP_CACHE_STATIC,
+        'ccdtemperature': 1.0,
+        'coolerpower': 1.0
+    }
+
+    device_state_props = ('camerastate', 'ccdtemperature', 'coolerpower',
+                          'heatsinktemperature', 'imageready',
+                          'ispulseguiding', 'percentcompleted')
+
     def __init__(self, backend):
         # FIXME call initializer for AlpacaDevice mixin) - is this sensible way
         self._initialize_device_attr()
         self.camera_has_progress = None
         self.backend = backend
+
+        # monotonic time and duration of last exposure started
+        self.exposure_start = None
+        self.exposure_duration = None
+
+        # binning and frame values known to be set on camera - see
+        # configure()
+        self._geometry = {}
+        self._geometry_lock = Lock()
+
         logging.info(f'alapaca camera setting backend to {backend}')
 
+    def clear_prop_cache(self):
+        super().clear_prop_cache()
+        with self._geometry_lock:
+            self._geometry = {}
+
+    def _update_geometry(self, vals):
+        # remember values read back from camera
+        with self._geometry_lock:
+            for prop, value in vals.items():
+                if value is not None:
+                    self._geometry[prop] = value
+
+    def _write_geometry(self, wanted):
+        changes = {p: v for p, v in wanted.items()
+                   if self._geometry.get(p) != v}
+        if not changes:
+            return True
+
+        logging.debug(f'configure: writing {changes}')
+        results = self.set_props({p: {GEOMETRY_PARAMS[p]: v}
+                                  for p, v in changes.items()})
+
+        rc = True
+        for prop, ok in results.items():
+            if ok:
+                self._geometry[prop] = changes[prop]
+            else:
+                self._geometry.pop(prop, None)
+                rc = False
+
+        return rc
+
+    def configure(self, binning=None, roi=None):
+        """
+        Set binning and frame, only writing the values that differ from
+        what the camera is known to be set to already.
+
+        Binning is written first since drivers may adjust the frame to
+        suit it, then the frame values which all go out at once.  If
+        nothing changed since the last call no requests are sent at all.
+
+        :param binning: Tuple of (binx, biny) or None to leave unchanged.
+        :type binning: tuple
+        :param roi: Tuple of (minx, miny, width, height) in binned pixels
+                    or None to leave unchanged.
+        :type roi: tuple
+        :return: True on success.
+        :rtype: bool
+        """
+        with self._geometry_lock:
+            if binning is not None:
+                wanted = {'binx': int(binning[0]), 'biny': int(binning[1])}
+                changed = any(self._geometry.get(p) != v
+                              for p, v in wanted.items())
+                if not self._write_geometry(wanted):
+                    return False
+                if changed:
+                    for prop in FRAME_PROPS:
+                        self._geometry.pop(prop, None)
+
+            if roi is not None:
+                wanted = dict(zip(FRAME_PROPS, (int(v) for v in roi)))
+                if not self._write_geometry(wanted):
+                    return False
+
+        return True
+
     def get_camera_name(self):
         return self.get_prop('name')
 
@@ -47,19 +214,31 @@ class Camera(AlpacaDevice, BaseCamera):
         return self.get_prop('driverversion')
 
     def get_settings(self):
+        # read everything at once instead of one round trip per property
+        vals = self.get_props(['binx', 'biny', 'cameraxsize', 'cameraysize',
+                               'pixelsizex', 'pixelsizey', 'electronsperadu',
+                               'gain', 'ccdtemperature', 'setccdtemperature',
+                               'cooleron', 'coolerpower',
+                               'startx', 'starty', 'numx', 'numy'])
+
+        cooler_power = vals['coolerpower']
+        if cooler_power is None:
+            cooler_power = 0
+
         setdict = {}
-        setdict['binning'] = self.get_binning()
-        setdict['framesize'] = self.get_size()
-        setdict['pixelsize'] = self.get_pixelsize()
-        setdict['egain'] = self.get_egain()
-        setdict['camera_gain'] = self.get_camera_gain()
+        setdict['binning'] = (vals['binx'], vals['biny'])
+        setdict['framesize'] = (vals['cameraxsize'], vals['cameraysize'])
+        setdict['pixelsize'] = (vals['pixelsizex'], vals['pixelsizey'])
+        setdict['egain'] = vals['electronsperadu']
+        setdict['camera_gain'] = vals['gain']
         setdict['camera_offset'] = self.get_camera_offset()
         setdict['camera_usbbandwidth'] = self.get_camera_usbbandwidth()
-        setdict['camera_current_temperature'] = self.get_current_temperature()
-        setdict['camera_target_temperature'] = self.get_target_temperature()
-        setdict['cooler_state'] = self.get_cooler_state()
-        setdict['cooler_power'] = self.get_cooler_power()
-        setdict['roi'] = self.get_frame()
+        setdict['camera_current_temperature'] = vals['ccdtemperature']
+        setdict['camera_target_temperature'] = vals['setccdtemperature']
+        setdict['cooler_state'] = vals['cooleron']
+        setdict['cooler_power'] = cooler_power
+        setdict['roi'] = (vals['startx'], vals['starty'],
+                          vals['numx'], vals['numy'])
 
         return setdict
 
@@ -70,7 +249,11 @@ class Camera(AlpacaDevice, BaseCamera):
         logging.debug(f'Exposing image for {expos} seconds')
 
         params = {'Duration': expos, 'Light': True}
-        return self.set_prop('startexposure', params)
+        rc = self.set_prop('startexposure', params)
+        if rc:
+            self.exposure_start = time.monotonic()
+            self.exposure_duration = expos
+        return rc
 
     def stop_exposure(self):
         return self.set_prop('stopexposure', {})
@@ -78,6 +261,76 @@ class Camera(AlpacaDevice, BaseCamera):
     def check_exposure(self):
         return self.get_prop('imageready')
 
+    def _get_exposure_state(self):
+        # always read fresh values - a snapshot up to device_state_max_age
+        # old would delay noticing the image is ready
+        state = self.get_device_state()
+        if state is None or 'imageready' not in state:
+            state = self.get_props(['imageready', 'camerastate'])
+        return state
+
+    def wait_for_image(self, timeout=None, poll_interval=0.1,
+                       max_poll_interval=1.0,
+                       max_failed_polls=MAX_FAILED_IMAGE_POLLS):
+        """
+        Wait for the exposure started by :meth:`start_exposure` to complete.
+
+        Sleeps through most of the exposure without touching the server,
+        then polls imageready and camerastate more often as the expected
+        end approaches, backing off again if readout takes a while.
+
+        :param timeout: Seconds to wait after the exposure should have
+                        ended or None to wait forever.
+        :type timeout: float
+        :param poll_interval: Shortest time in seconds between polls.
+        :type poll_interval: float
+        :param max_poll_interval: Longest time in seconds between polls.
+        :type max_poll_interval: float
+        :param max_failed_polls: Give up after this many polls in a row
+                                 where the server could not be read.
+        :type max_failed_polls: int
+        :return: True if image is ready, False on error or timeout.
+        :rtype: bool
+        """
+        if self.exposure_start is None:
+            logging.error('wait_for_image called without an exposure '
+                          'having been started!')
+            return False
+
+        end_time = self.exposure_start + self.exposure_duration
+        lead = image_wait_lead(self.exposure_duration, poll_interval)
+        time_left = end_time - time.monotonic()
+        if time_left > lead:
+            time.sleep(time_left - lead)
+
+        failed_polls = 0
+        while True:
+            state = self._get_exposure_state()
+            if state.get('imageready'):
+                return True
+
+            if state.get('camerastate') == CAMERA_STATE_ERROR:
+                logging.error('Camera reported an error during exposure!')
+                return False
+
+            if state.get('imageready') is None:
+                failed_polls += 1
+                if failed_polls >= max_failed_polls:
+                    logging.error(f'Unable to read camera state {failed_polls} '
+                                  'times in a row waiting for image!')
+                    return False
+            else:
+                failed_polls = 0
+
+            time_left = end_time - time.monotonic()
+            if timeout is not None and -time_left > timeout:
+                logging.error(f'Timed out waiting {timeout} seconds for '
+                              'image!')
+                return False
+
+            time.sleep(image_poll_delay(time_left, poll_interval,
+                                        max_poll_interval))
+
     def check_exposure_success(self):
         # return True if exposure successful
         # only valid if check_exposure() returns True
@@ -105,91 +358,151 @@ class Camera(AlpacaDevice, BaseCamera):
         Returns
         -------
         image_data : numpy array
-            Data is in row-major format!
+            Data is in row-major format and C-contiguous - shape is
+            (height, width) or (height, width, planes) for color images!
         """
-        # FIXME Is this best way to determine data type from camera??
+        # image is returned in smallest type holding maxadu - if camera
+        # does not report it the type sent by the server is used
         maxadu = self.get_prop('maxadu')
-        if maxadu == 65535:
-            out_dtype = np.dtype(np.uint16)
-        else:
-            logging.error(f'Unknown MAXADU {maxadu} in getImageData!!')
-            return None
+        if not isinstance(maxadu, int):
+            logging.warning(f'Camera returned MAXADU {maxadu} - using '
+                            'image type sent by server')
+            maxadu = None
+
+        # use the transfer mode found to work for this server before or
+        # if not known yet ask for all of them - depending on what the
+        # server supports it will send ImageBytes, base64json, the base64
+        # handoff metadata or the plain JSON array which tells us what to
+        # do next time
+        transport = self.backend.get_transport(self.server)
+        mode = transport.image_transfer_mode
 
-        # Transpose to get into row-major
-        #image_data = np.array(self.cam.ImageArray, dtype=out_dtype).T
+        mts = time.time()
+        if mode == IMAGE_MODE_JSON:
+            image_data = self._get_json_stream_image(maxadu)
+            if image_data is not None:
+                logging.debug(f'image_data shape is {image_data.shape}')
+            mte = time.time()
+            logging.debug(f'Total time getting image data = {mte-mts} seconds')
+            return image_data
 
-        #resp = self.get_prop('imagearray', returndict=True)
-        resp = self.backend.get_request(self.device_type,
+        ts = time.time()
+        content_type, body = self.backend.get_image_request(
+                                        self.device_type,
                                         self.device_number,
                                         'imagearray',
-                                        extraparams={},
-                                        extraheaders={'base64handoff': 'true'})
-
-        logging.debug(f'imagearray resp = {resp}')
+                                        extraheaders=IMAGE_MODE_HEADERS[mode],
+                                        server=self.server)
 
-#        f=open('imagejson.json', 'w')
-#        f.write(repr(resp))
-#        f.close()
+        te = time.time()
+        logging.debug(f'imagearray request took {te-ts} seconds')
 
-        # check rank and type
-        imgrank = resp.get('Rank')
-        imgtype = resp.get('Type')
+        if body is None:
+            logging.error('Failed to download image data!')
+            return None
 
-        logging.debug(f'ImageArray Rank = {imgrank} Type = {imgtype}')
+        if content_type == IMAGEBYTES_MIME_TYPE:
+            transport.image_transfer_mode = IMAGE_MODE_IMAGEBYTES
+            image_data = decode_imagebytes(body, maxadu)
+        elif is_json_image_array(body):
+            # server ignored every header asked for so only sends JSON -
+            # parse the array without building a Python list for every pixel
+            transport.image_transfer_mode = IMAGE_MODE_JSON
+            image_data = decode_json_image(body, maxadu)
+        else:
+            ts = time.time()
+            try:
+                resp = fast_json.loads(bytes(body))
+            except ValueError:
+                logging.error('imagearray resp json parse error!')
+                return None
+            del body
+
+            te = time.time()
+            logging.debug(f'imagearray json parse took {te-ts} seconds')
+
+            error_num = resp.get('ErrorNumber', 0)
+            if error_num != 0:
+                logging.error(f'imagearray request returned error number '
+                              f'{error_num} error message '
+                              f'"{resp.get("ErrorMessage", "Unknown")}"')
+                return None
+
+            value = resp.get('Value')
+            if value is None:
+                transport.image_transfer_mode = IMAGE_MODE_BASE64HANDOFF
+                image_data = self._get_base64_handoff_image(resp, maxadu)
+            elif isinstance(value, str):
+                transport.image_transfer_mode = IMAGE_MODE_BASE64JSON
+                image_data = decode_base64json_image(resp, maxadu)
+            else:
+                logging.error(f'imagearray response Value has unexpected '
+                              f'type {type(value)}!')
+                return None
+
+        if transport.image_transfer_mode != mode:
+            logging.info(f'Alpaca server {transport.host}:{transport.port} '
+                         'image transfer mode is '
+                         f'{transport.image_transfer_mode}')
+
+        if image_data is not None:
+            logging.debug(f'image_data shape is {image_data.shape}')
 
-        dim0 = resp.get('Dimension0Length')
-        dim1 = resp.get('Dimension1Length')
-        dim2 = resp.get('Dimension2Length')
+        mte = time.time()
+        logging.debug(f'Total time getting image data = {mte-mts} seconds')
 
-        logging.debug(f'Dimension0Length: {dim0} '
-                      f'Dimension1Length: {dim1} '
-                      f'Dimension2Length: {dim2} ')
+        return image_data
 
-        if imgrank != 2 or imgtype != 2:
-            logging.error('ImageArray returned a Rank or Type != 2!')
+    def _get_json_stream_image(self, maxadu):
+        # server only sends plain JSON so parse the array as it downloads
+        # rather than building a Python list for every pixel - the frame
+        # size lets the image be preallocated
+        vals = self.get_props(['numx', 'numy'])
+        try:
+            dims = (int(vals['numx']), int(vals['numy']))
+        except (TypeError, ValueError):
+            dims = None
+
+        decoder = JsonImageStreamDecoder(maxadu, dims)
+        rc = self.backend.get_stream(self.device_type, self.device_number,
+                                     'imagearray', decoder.write,
+                                     extraheaders=IMAGE_MODE_HEADERS[IMAGE_MODE_JSON],
+                                     server=self.server)
+        if not rc:
+            logging.error('Failed to download JSON image data!')
             return None
 
-        if dim2 != 0:
-            logging.error('ImageArray returns Dimension2Length != 0!')
+        return decoder.finish()
+
+    def _get_base64_handoff_image(self, resp, maxadu):
+        logging.debug(f'imagearray resp = {resp}')
+
+        metadata = check_image_metadata(resp)
+        if metadata is None:
             return None
 
+        element_dtype, dims = metadata
+
         # now get image data
         # use pycurl as it is significantly faster than requests for big data
-        mts = time.time()
+        # and decode as it downloads so only one copy of frame is in memory
         ts = time.time()
-        body = self.backend.get_base64(self.device_type, self.device_number,
-                                       'imagearraybase64')
-
-        te = time.time()
-        logging.debug(f'Download took {te-ts} seconds')
+        writer = ImageArrayWriter(dims, image_output_dtype(element_dtype,
+                                                           maxadu))
+        decoder = Base64StreamDecoder(writer, element_dtype)
+        rc = self.backend.get_stream(self.device_type, self.device_number,
+                                     'imagearraybase64', decoder.write,
+                                     extraheaders=['Content-Type: text/plain'],
+                                     server=self.server)
+
+        if not rc or not decoder.finish():
+            logging.error('Failed to download base64 image data!')
+            return None
 
-        ts = time.time()
-        decoded = base64.b64decode(body)
-        read_img = np.frombuffer(decoded, dtype=np.int32)
         te = time.time()
-        logging.debug(f'Base64 conversion took {te-ts} seconds')
-
-        # convert to int16
-        out_dtype = np.dtype(np.uint16)
-
-        image_data = read_img.astype(out_dtype)
-
-        logging.debug(f'image_data shape is {image_data.shape}')
+        logging.debug(f'Download and base64 conversion took {te-ts} seconds')
 
-        logging.debug(f'reshaping to numx = {dim0} numy = {dim1}')
-
-        # remember array has Y as first axis!!
-        image_data = np.reshape(image_data, (dim0, -1))
-
-        logging.debug(f'image_data shape is {image_data.shape}')
-
-        # then transpose so X is first
-        image_data = image_data.T
-
-        mte = time.time()
-        logging.debug(f'Total time getting image data = {mte-mts} seconds')
-
-        return image_data
+        return writer.image
 
     def supports_saveimage(self):
         return False
@@ -199,9 +512,8 @@ class Camera(AlpacaDevice, BaseCamera):
         return False
 
     def get_pixelsize(self):
-        pix_x = self.get_prop('pixelsizex')
-        pix_y = self.get_prop('pixelsizey')
-        return pix_x, pix_y
+        vals = self.get_props(['pixelsizex', 'pixelsizey'])
+        return vals['pixelsizex'], vals['pixelsizey']
 
     def get_egain(self):
         return self.get_prop('electronsperadu')
@@ -245,9 +557,9 @@ class Camera(AlpacaDevice, BaseCamera):
         return self.get_prop('cooleron')
 
     def get_binning(self):
-        bin_x = self.get_prop('binx')
-        bin_y = self.get_prop('biny')
-        return bin_x, bin_y
+        vals = self.get_props(['binx', 'biny'])
+        self._update_geometry(vals)
+        return vals['binx'], vals['biny']
 
     def get_cooler_power(self):
         power = self.get_prop('coolerpower')
@@ -256,44 +568,24 @@ class Camera(AlpacaDevice, BaseCamera):
         return power
 
     def set_binning(self, binx, biny):
-        param_x = {'binx': binx}
-        param_y = {'biny': biny}
-        rc = self.set_prop('binx', param_x)
-        if not rc:
-            return rc
-        rc = self.set_prop('biny', param_y)
-        return rc
+        return self.configure(binning=(binx, biny))
 
     def get_max_binning(self):
         # FIXME Assumes max binning is same in X and Y!
         return self.get_prop('maxbinx')
 
     def get_size(self):
-        cam_x = self.get_prop('cameraxsize')
-        cam_y = self.get_prop('cameraysize')
-        return cam_x, cam_y
+        vals = self.get_props(['cameraxsize', 'cameraysize'])
+        return vals['cameraxsize'], vals['cameraysize']
 
     def get_frame(self):
-        sx = self.get_prop('startx')
-        sy = self.get_prop('starty')
-        numx = self.get_prop('numx')
-        numy = self.get_prop('numy')
-        return(sx, sy, numx, numy)
+        vals = self.get_props(['startx', 'starty', 'numx', 'numy'])
+        self._update_geometry(vals)
+        return (vals['startx'], vals['starty'], vals['numx'], vals['numy'])
 
     def set_frame(self, minx, miny, width, height):
-        rc = self.set_prop('startx', {'StartX': int(minx)})
-        if not rc:
-            return rc
-        rc = self.set_prop('starty', {'StartY': int(miny)})
-        if not rc:
-            return rc
-        rc = self.set_prop('numx', {'NumX': int(width)})
-        if not rc:
-            return rc
-        rc = self.set_prop('numy', {'NumY': int(height)})
-        return rc
+        return self.configure(roi=(minx, miny, width, height))
 
     def get_min_max_exposure(self):
-        exp_min = self.get_prop('exposuremin')
-        exp_max = self.get_prop('exposuremax')
-        return exp_min, exp_max
+        vals = self.get_props(['exposuremin', 'exposuremax'])
+        return vals['exposuremin'], vals['exposuremax']
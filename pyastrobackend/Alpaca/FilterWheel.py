@@ -21,9 +21,16 @@ import logging
 
 from pyastrobackend.BaseBackend import BaseFilterWheel
 from pyastrobackend.Alpaca.AlpacaDevice import AlpacaDevice
+from pyastrobackend.Alpaca.AlpacaDevice import PROP_CACHE_STATIC
 
 class FilterWheel(AlpacaDevice, BaseFilterWheel):
 
+    prop_cache_policy = {
+        'names': PROP_CACHE_STATIC
+    }
+
+    device_state_props = ('position',)
+
     def __init__(self, backend):
         # FIXME call initializer for AlpacaDevice mixin) - is this sensible way
         self._initialize_device_attr()
@@ -21,9 +21,17 @@ import logging
 
 from pyastrobackend.BaseBackend import BaseFocuser
 from pyastrobackend.Alpaca.AlpacaDevice import AlpacaDevice
+from pyastrobackend.Alpaca.AlpacaDevice import PROP_CACHE_STATIC
 
 class Focuser(AlpacaDevice, BaseFocuser):
 
+    prop_cache_policy = {
+        'maxstep': PROP_CACHE_STATIC,
+        'temperature': 5.0
+    }
+
+    device_state_props = ('ismoving', 'position', 'temperature')
+
     def __init__(self, backend):
         # FIXME call initializer for AlpacaDevice mixin) - is this sensible way
         self._initialize_device_attr()
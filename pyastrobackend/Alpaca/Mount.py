@@ -21,12 +21,21 @@ import logging
 
 from pyastrobackend.BaseBackend import BaseMount
 from pyastrobackend.Alpaca.AlpacaDevice import AlpacaDevice
+from pyastrobackend.Alpaca.AlpacaDevice import PROP_CACHE_STATIC
 
 PIEREAST = 0
 PIERWEST = 1
 
 class Mount(AlpacaDevice, BaseMount):
 
+    prop_cache_policy = {
+        'canpark': PROP_CACHE_STATIC
+    }
+
+    device_state_props = ('altitude', 'athome', 'atpark', 'azimuth',
+                          'declination', 'ispulseguiding', 'rightascension',
+                          'sideofpier', 'siderealtime', 'slewing', 'tracking')
+
     def __init__(self, backend):
         # FIXME call initializer for AlpacaDevice mixin) - is this sensible way
         self._initialize_device_attr()
@@ -41,15 +50,13 @@ class Mount(AlpacaDevice, BaseMount):
 
     def get_position_altaz(self):
         """Returns tuple of (alt, az) in degrees"""
-        alt = self.get_prop('altitude')
-        az = self.get_prop('azimuth')
-        return (alt, az)
+        vals = self.get_props(['altitude', 'azimuth'])
+        return (vals['altitude'], vals['azimuth'])
 
     def get_position_radec(self):
         """Returns tuple of (ra, dec) with ra in decimal hours and dec in degrees"""
-        ra = self.get_prop('rightascension')
-        dec = self.get_prop('declination')
-        return (ra, dec)
+        vals = self.get_props(['rightascension', 'declination'])
+        return (vals['rightascension'], vals['declination'])
 
     def get_pier_side(self):
         side = self.get_prop('sideofpier')
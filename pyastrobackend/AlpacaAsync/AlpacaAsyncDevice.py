@@ -0,0 +1,145 @@
+#
+# Alpaca asyncio device base
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from pyastrobackend.Alpaca.AlpacaDevice import AlpacaDevice
+
+class AlpacaAsyncDevice(AlpacaDevice):
+    """
+    Base for Alpaca devices used from an asyncio event loop.
+
+    Device spec parsing, the property cache and devicestate snapshots
+    are shared with :class:`pyastrobackend.Alpaca.AlpacaDevice.AlpacaDevice`
+    - only the methods which talk to the server are replaced by
+    coroutines.
+    """
+
+    async def connect(self, name):
+        return super().connect(name)
+
+    async def disconnect(self):
+        return super().disconnect()
+
+    async def is_connected(self):
+        # return False if device attributes not initialized
+        if None in [self.device_type, self.device_number]:
+            return False
+
+        return await self.get_prop('connected')
+
+    async def get_device_state(self):
+        """
+        Read all operational state properties of device in one request
+        using the devicestate endpoint.
+
+        :return: Dictionary of property values or None if the server or
+                 driver does not support devicestate.
+        :rtype: dict
+        """
+        if self.device_state_supported is False:
+            return None
+
+        generation = self._get_write_generation()
+        vals = await self.backend.get_device_state(self.device_type,
+                                                   self.device_number,
+                                                   server=self.server)
+
+        return self._store_device_state(vals, generation)
+
+    async def _get_device_state_snapshot(self):
+        state = self._get_fresh_device_state()
+        if state is None:
+            state = await self.get_device_state()
+
+        return state
+
+    async def get_prop(self, prop, params={}, returndict=False):
+        # only plain reads can be served from cache
+        if params or returndict:
+            return await self.backend.get_prop(self.device_type,
+                                               self.device_number,
+                                               prop, params, returndict,
+                                               server=self.server)
+
+        found, value = self._get_cached_prop(prop)
+        if found:
+            return value
+
+        if prop in self.device_state_props:
+            state = await self._get_device_state_snapshot()
+            if state is not None and prop in state:
+                return state[prop]
+
+        generation = self._get_write_generation()
+        value = await self.backend.get_prop(self.device_type,
+                                            self.device_number,
+                                            prop, params, returndict,
+                                            server=self.server)
+        self._set_cached_prop(prop, value, generation)
+        return value
+
+    async def get_props(self, props):
+        vals = {}
+        missing = []
+        for prop in props:
+            found, value = self._get_cached_prop(prop)
+            if found:
+                vals[prop] = value
+            else:
+                missing.append(prop)
+
+        if any(prop in self.device_state_props for prop in missing):
+            state = await self._get_device_state_snapshot()
+            if state is not None:
+                for prop in list(missing):
+                    if prop in state:
+                        vals[prop] = state[prop]
+                        missing.remove(prop)
+
+        if missing:
+            generation = self._get_write_generation()
+            fetched = await self.backend.get_props(self.device_type,
+                                                   self.device_number,
+                                                   missing,
+                                                   server=self.server)
+            for prop, value in fetched.items():
+                self._set_cached_prop(prop, value, generation)
+            vals.update(fetched)
+
+        return vals
+
+    async def set_prop(self, prop, params={}):
+        self._invalidate_after_write((prop,))
+        try:
+            return await self.backend.set_prop(self.device_type,
+                                               self.device_number,
+                                               prop, params,
+                                               server=self.server)
+        finally:
+            self._invalidate_after_write((prop,))
+
+    async def set_props(self, prop_params):
+        props = tuple(prop_params)
+        self._invalidate_after_write(props)
+        try:
+            return await self.backend.set_props(self.device_type,
+                                                self.device_number,
+                                                prop_params,
+                                                server=self.server)
+        finally:
+            self._invalidate_after_write(props)
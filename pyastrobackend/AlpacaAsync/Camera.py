@@ -0,0 +1,519 @@
+#
+# Alpaca asyncio camera device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+import asyncio
+import logging
+
+import aiohttp
+
+from pyastrobackend.Alpaca.Camera import Camera as AlpacaCamera
+from pyastrobackend.Alpaca.Camera import CAMERA_STATE_ERROR
+from pyastrobackend.Alpaca.Camera import FRAME_PROPS
+from pyastrobackend.Alpaca.Camera import MAX_FAILED_IMAGE_POLLS
+from pyastrobackend.Alpaca.Camera import GEOMETRY_PARAMS
+from pyastrobackend.Alpaca.Camera import image_poll_delay
+from pyastrobackend.Alpaca.Camera import image_wait_lead
+from pyastrobackend.AlpacaAsync.AlpacaAsyncDevice import AlpacaAsyncDevice
+from pyastrobackend.Alpaca.AlpacaImage import IMAGEBYTES_MIME_TYPE
+from pyastrobackend.Alpaca.AlpacaImage import Base64StreamDecoder
+from pyastrobackend.Alpaca.AlpacaImage import ImageBytesStreamDecoder
+from pyastrobackend.Alpaca.AlpacaImage import JsonImageStreamDecoder
+from pyastrobackend.Alpaca.AlpacaImage import ImageArrayWriter
+from pyastrobackend.Alpaca.AlpacaImage import check_image_metadata
+from pyastrobackend.Alpaca.AlpacaImage import image_output_dtype
+from pyastrobackend.Alpaca.AlpacaImage import decode_json_image
+from pyastrobackend.Alpaca.AlpacaImage import is_json_image_array
+from pyastrobackend.Alpaca.AlpacaImage import decode_base64json_image
+from pyastrobackend.Alpaca.AlpacaImage import fast_json
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_HEADERS
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_IMAGEBYTES
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64JSON
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64HANDOFF
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_JSON
+
+class Camera(AlpacaAsyncDevice):
+    """
+    Alpaca camera for use from an asyncio event loop.
+
+    Has the same methods as :class:`pyastrobackend.Alpaca.Camera.Camera`
+    but every method which talks to the server is a coroutine.
+    """
+
+    prop_cache_policy = AlpacaCamera.prop_cache_policy
+    device_state_props = AlpacaCamera.device_state_props
+
+    # size of chunks image downloads are decoded in
+    image_chunk_size = 256*1024
+
+    def __init__(self, backend):
+        self._initialize_device_attr()
+        self.camera_has_progress = None
+        self.backend = backend
+
+        # monotonic time and duration of last exposure started
+        self.exposure_start = None
+        self.exposure_duration = None
+
+        # binning and frame values known to be set on camera
+        self._geometry = {}
+
+        # made on first use so it belongs to the loop the camera is used
+        # from - on Python 3.7 a lock binds to the loop current when it
+        # is created
+        self._geometry_lock = None
+
+        logging.info(f'alpaca async camera setting backend to {backend}')
+
+    def clear_prop_cache(self):
+        super().clear_prop_cache()
+        self._geometry = {}
+
+    def _update_geometry(self, vals):
+        for prop, value in vals.items():
+            if value is not None:
+                self._geometry[prop] = value
+
+    async def _write_geometry(self, wanted):
+        changes = {p: v for p, v in wanted.items()
+                   if self._geometry.get(p) != v}
+        if not changes:
+            return True
+
+        logging.debug(f'configure: writing {changes}')
+        results = await self.set_props({p: {GEOMETRY_PARAMS[p]: v}
+                                        for p, v in changes.items()})
+
+        rc = True
+        for prop, ok in results.items():
+            if ok:
+                self._geometry[prop] = changes[prop]
+            else:
+                self._geometry.pop(prop, None)
+                rc = False
+
+        return rc
+
+    async def configure(self, binning=None, roi=None):
+        """
+        Set binning and frame, only writing the values that differ from
+        what the camera is known to be set to already - see
+        :meth:`pyastrobackend.Alpaca.Camera.Camera.configure`.
+
+        :return: True on success.
+        :rtype: bool
+        """
+        if self._geometry_lock is None:
+            self._geometry_lock = asyncio.Lock()
+
+        async with self._geometry_lock:
+            if binning is not None:
+                wanted = {'binx': int(binning[0]), 'biny': int(binning[1])}
+                changed = any(self._geometry.get(p) != v
+                              for p, v in wanted.items())
+                if not await self._write_geometry(wanted):
+                    return False
+                if changed:
+                    for prop in FRAME_PROPS:
+                        self._geometry.pop(prop, None)
+
+            if roi is not None:
+                wanted = dict(zip(FRAME_PROPS, (int(v) for v in roi)))
+                if not await self._write_geometry(wanted):
+                    return False
+
+        return True
+
+    async def get_camera_name(self):
+        return await self.get_prop('name')
+
+    async def get_camera_description(self):
+        return await self.get_prop('description')
+
+    async def get_driver_info(self):
+        return await self.get_prop('driverinfo')
+
+    async def get_driver_version(self):
+        return await self.get_prop('driverversion')
+
+    async def get_settings(self):
+        vals = await self.get_props(['binx', 'biny', 'cameraxsize',
+                                     'cameraysize', 'pixelsizex',
+                                     'pixelsizey', 'electronsperadu',
+                                     'gain', 'ccdtemperature',
+                                     'setccdtemperature', 'cooleron',
+                                     'coolerpower', 'startx', 'starty',
+                                     'numx', 'numy'])
+
+        cooler_power = vals['coolerpower']
+        if cooler_power is None:
+            cooler_power = 0
+
+        setdict = {}
+        setdict['binning'] = (vals['binx'], vals['biny'])
+        setdict['framesize'] = (vals['cameraxsize'], vals['cameraysize'])
+        setdict['pixelsize'] = (vals['pixelsizex'], vals['pixelsizey'])
+        setdict['egain'] = vals['electronsperadu']
+        setdict['camera_gain'] = vals['gain']
+        setdict['camera_offset'] = self.get_camera_offset()
+        setdict['camera_usbbandwidth'] = self.get_camera_usbbandwidth()
+        setdict['camera_current_temperature'] = vals['ccdtemperature']
+        setdict['camera_target_temperature'] = vals['setccdtemperature']
+        setdict['cooler_state'] = vals['cooleron']
+        setdict['cooler_power'] = cooler_power
+        setdict['roi'] = (vals['startx'], vals['starty'],
+                          vals['numx'], vals['numy'])
+
+        return setdict
+
+    async def get_state(self):
+        return await self.get_prop('camerastate')
+
+    async def start_exposure(self, expos):
+        logging.debug(f'Exposing image for {expos} seconds')
+
+        params = {'Duration': expos, 'Light': True}
+        rc = await self.set_prop('startexposure', params)
+        if rc:
+            self.exposure_start = time.monotonic()
+            self.exposure_duration = expos
+        return rc
+
+    async def stop_exposure(self):
+        return await self.set_prop('stopexposure', {})
+
+    async def check_exposure(self):
+        return await self.get_prop('imageready')
+
+    def check_exposure_success(self):
+        # return True if exposure successful
+        # only valid if check_exposure() returns True
+        # FIXME Need to handle errors and set a success flag
+        return True
+
+    async def _get_exposure_state(self):
+        # always read fresh values - see Alpaca.Camera.wait_for_image()
+        state = await self.get_device_state()
+        if state is None or 'imageready' not in state:
+            state = await self.get_props(['imageready', 'camerastate'])
+        return state
+
+    async def wait_for_image(self, timeout=None, poll_interval=0.1,
+                             max_poll_interval=1.0,
+                             max_failed_polls=MAX_FAILED_IMAGE_POLLS):
+        """
+        Wait for the exposure started by :meth:`start_exposure` to complete.
+
+        Same as :meth:`pyastrobackend.Alpaca.Camera.Camera.wait_for_image`
+        but other tasks keep running while waiting.
+
+        :return: True if image is ready, False on error or timeout.
+        :rtype: bool
+        """
+        if self.exposure_start is None:
+            logging.error('wait_for_image called without an exposure '
+                          'having been started!')
+            return False
+
+        end_time = self.exposure_start + self.exposure_duration
+        lead = image_wait_lead(self.exposure_duration, poll_interval)
+        time_left = end_time - time.monotonic()
+        if time_left > lead:
+            await asyncio.sleep(time_left - lead)
+
+        failed_polls = 0
+        while True:
+            state = await self._get_exposure_state()
+            if state.get('imageready'):
+                return True
+
+            if state.get('camerastate') == CAMERA_STATE_ERROR:
+                logging.error('Camera reported an error during exposure!')
+                return False
+
+            if state.get('imageready') is None:
+                failed_polls += 1
+                if failed_polls >= max_failed_polls:
+                    logging.error(f'Unable to read camera state {failed_polls} '
+                                  'times in a row waiting for image!')
+                    return False
+            else:
+                failed_polls = 0
+
+            time_left = end_time - time.monotonic()
+            if timeout is not None and -time_left > timeout:
+                logging.error(f'Timed out waiting {timeout} seconds for '
+                              'image!')
+                return False
+
+            await asyncio.sleep(image_poll_delay(time_left, poll_interval,
+                                                 max_poll_interval))
+
+    async def supports_progress(self):
+        if self.camera_has_progress is None:
+            self.camera_has_progress = \
+                await self.get_exposure_progress() != -1
+        return self.camera_has_progress
+
+    async def get_exposure_progress(self):
+        if not self.camera_has_progress:
+            return -1
+
+        return await self.get_prop('percentcompleted')
+
+    async def get_image_data(self):
+        """ Get image data from camera
+
+        The image is decoded as it downloads so other devices keep being
+        serviced while a large frame is transferred.  Responses which have
+        to be read whole are decoded in the default executor.
+
+        Returns
+        -------
+        image_data : numpy array
+            Data is in row-major format and C-contiguous - shape is
+            (height, width) or (height, width, planes) for color images!
+        """
+        # image is returned in smallest type holding maxadu - if camera
+        # does not report it the type sent by the server is used
+        maxadu = await self.get_prop('maxadu')
+        if not isinstance(maxadu, int):
+            logging.warning(f'Camera returned MAXADU {maxadu} - using '
+                            'image type sent by server')
+            maxadu = None
+
+        # see Alpaca.Camera.get_image_data() for how mode is chosen
+        server = self.backend._server(self.server)
+        mode = self.backend.image_transfer_modes.get(server)
+        headers = dict(h.split(': ', 1) for h in IMAGE_MODE_HEADERS[mode])
+
+        # frame size lets a plain JSON image be preallocated
+        json_dims = None
+        if mode == IMAGE_MODE_JSON:
+            vals = await self.get_props(['numx', 'numy'])
+            try:
+                json_dims = (int(vals['numx']), int(vals['numy']))
+            except (TypeError, ValueError):
+                pass
+
+        # decoding a whole frame takes long enough to hold up every other
+        # coroutine so it is done in a worker thread
+        loop = asyncio.get_running_loop()
+
+        ts = time.time()
+        try:
+            async with self.backend.image_request(self.device_type,
+                                                  self.device_number,
+                                                  'imagearray',
+                                                  extraheaders=headers,
+                                                  server=self.server) as resp:
+                if resp.status != 200:
+                    logging.error(f'imagearray request failed with HTTP '
+                                  f'status {resp.status}!')
+                    return None
+
+                content_type = resp.content_type.lower()
+                if content_type == IMAGEBYTES_MIME_TYPE:
+                    new_mode = IMAGE_MODE_IMAGEBYTES
+                    decoder = ImageBytesStreamDecoder(maxadu)
+                    async for chunk in resp.content.iter_chunked(
+                                                    self.image_chunk_size):
+                        if decoder.write(chunk) != len(chunk):
+                            break
+                    image_data = await loop.run_in_executor(None,
+                                                            decoder.finish)
+                    body = None
+                elif mode == IMAGE_MODE_JSON:
+                    # parse the array as it downloads rather than building
+                    # a Python list for every pixel
+                    new_mode = IMAGE_MODE_JSON
+                    decoder = JsonImageStreamDecoder(maxadu, json_dims)
+                    async for chunk in resp.content.iter_chunked(
+                                                    self.image_chunk_size):
+                        if decoder.write(chunk) != len(chunk):
+                            break
+                    image_data = await loop.run_in_executor(None,
+                                                            decoder.finish)
+                    body = None
+                else:
+                    body = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logging.error(f'imagearray request failed: {err}')
+            return None
+
+        te = time.time()
+        logging.debug(f'imagearray request took {te-ts} seconds')
+
+        if body is not None and is_json_image_array(body):
+            # server ignored every header asked for so only sends JSON
+            new_mode = IMAGE_MODE_JSON
+            image_data = await loop.run_in_executor(None, decode_json_image,
+                                                    body, maxadu)
+        elif body is not None:
+            try:
+                resp = await loop.run_in_executor(None, fast_json.loads, body)
+            except ValueError:
+                logging.error('imagearray resp json parse error!')
+                return None
+            del body
+
+            error_num = resp.get('ErrorNumber', 0)
+            if error_num != 0:
+                logging.error(f'imagearray request returned error number '
+                              f'{error_num} error message '
+                              f'"{resp.get("ErrorMessage", "Unknown")}"')
+                return None
+
+            value = resp.get('Value')
+            if value is None:
+                new_mode = IMAGE_MODE_BASE64HANDOFF
+                image_data = await self._get_base64_handoff_image(resp,
+                                                                  maxadu)
+            elif isinstance(value, str):
+                new_mode = IMAGE_MODE_BASE64JSON
+                image_data = await loop.run_in_executor(
+                                 None, decode_base64json_image, resp, maxadu)
+            else:
+                logging.error(f'imagearray response Value has unexpected '
+                              f'type {type(value)}!')
+                return None
+
+        if new_mode != mode:
+            self.backend.image_transfer_modes[server] = new_mode
+            logging.info(f'Alpaca server {server[0]}:{server[1]} image '
+                         f'transfer mode is {new_mode}')
+
+        if image_data is not None:
+            logging.debug(f'image_data shape is {image_data.shape}')
+
+        return image_data
+
+    async def _get_base64_handoff_image(self, resp, maxadu):
+        metadata = check_image_metadata(resp)
+        if metadata is None:
+            return None
+
+        element_dtype, dims = metadata
+
+        writer = ImageArrayWriter(dims, image_output_dtype(element_dtype,
+                                                           maxadu))
+        decoder = Base64StreamDecoder(writer, element_dtype)
+        try:
+            async with self.backend.image_request(
+                                    self.device_type, self.device_number,
+                                    'imagearraybase64',
+                                    extraheaders={'Content-Type': 'text/plain'},
+                                    server=self.server) as resp:
+                if resp.status != 200:
+                    logging.error(f'imagearraybase64 request failed with '
+                                  f'HTTP status {resp.status}!')
+                    return None
+
+                async for chunk in resp.content.iter_chunked(
+                                                    self.image_chunk_size):
+                    if decoder.write(chunk) != len(chunk):
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logging.error(f'imagearraybase64 request failed: {err}')
+            return None
+
+        if not decoder.finish():
+            logging.error('Failed to download base64 image data!')
+            return None
+
+        return writer.image
+
+    def supports_saveimage(self):
+        return False
+
+    def save_image_data(self, path, overwrite=False):
+        logging.warning('camera.save_image_data() NOT IMPLEMENTED FOR Alpaca CAMERA!')
+        return False
+
+    async def get_pixelsize(self):
+        vals = await self.get_props(['pixelsizex', 'pixelsizey'])
+        return vals['pixelsizex'], vals['pixelsizey']
+
+    async def get_egain(self):
+        return await self.get_prop('electronsperadu')
+
+    async def get_camera_gain(self):
+        return await self.get_prop('gain')
+
+    async def set_camera_gain(self, ccd_gain):
+        # disabled for same reason as Alpaca.Camera.set_camera_gain()
+        logging.warning('Alpaca set_camera_gain DISABLED for now')
+        return False
+
+    def get_camera_offset(self):
+        return None
+
+    def get_camera_usbbandwidth(self):
+        return None
+
+    async def get_current_temperature(self):
+        return await self.get_prop('ccdtemperature')
+
+    async def get_target_temperature(self):
+        return await self.get_prop('setccdtemperature')
+
+    async def set_target_temperature(self, temp_c):
+        params = {'SetCCDTemperature': temp_c}
+        return await self.set_prop('setccdtemperature', params)
+
+    async def set_cooler_state(self, onoff):
+        params = {'CoolerOn': onoff}
+        return await self.set_prop('cooleron', params)
+
+    async def get_cooler_state(self):
+        return await self.get_prop('cooleron')
+
+    async def get_cooler_power(self):
+        power = await self.get_prop('coolerpower')
+        if power is None:
+            power = 0
+        return power
+
+    async def get_binning(self):
+        vals = await self.get_props(['binx', 'biny'])
+        self._update_geometry(vals)
+        return vals['binx'], vals['biny']
+
+    async def set_binning(self, binx, biny):
+        return await self.configure(binning=(binx, biny))
+
+    async def get_max_binning(self):
+        # FIXME Assumes max binning is same in X and Y!
+        return await self.get_prop('maxbinx')
+
+    async def get_size(self):
+        vals = await self.get_props(['cameraxsize', 'cameraysize'])
+        return vals['cameraxsize'], vals['cameraysize']
+
+    async def get_frame(self):
+        vals = await self.get_props(['startx', 'starty', 'numx', 'numy'])
+        self._update_geometry(vals)
+        return (vals['startx'], vals['starty'], vals['numx'], vals['numy'])
+
+    async def set_frame(self, minx, miny, width, height):
+        return await self.configure(roi=(minx, miny, width, height))
+
+    async def get_min_max_exposure(self):
+        vals = await self.get_props(['exposuremin', 'exposuremax'])
+        return vals['exposuremin'], vals['exposuremax']
@@ -0,0 +1,86 @@
+#
+# Alpaca asyncio filterwheel device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.Alpaca.FilterWheel import FilterWheel as AlpacaFilterWheel
+from pyastrobackend.AlpacaAsync.AlpacaAsyncDevice import AlpacaAsyncDevice
+
+class FilterWheel(AlpacaAsyncDevice):
+    """
+    Alpaca filter wheel for use from an asyncio event loop.
+    """
+
+    prop_cache_policy = AlpacaFilterWheel.prop_cache_policy
+    device_state_props = AlpacaFilterWheel.device_state_props
+
+    def __init__(self, backend):
+        self._initialize_device_attr()
+        self.backend = backend
+        logging.info(f'alpaca async filterwheel setting backend to {backend}')
+
+    async def get_position(self):
+        return await self.get_prop('position')
+
+    async def get_position_name(self):
+        names = await self.get_names()
+        pos = await self.get_position()
+        if names is None or pos is None or not 0 <= pos < len(names):
+            return None
+        return names[pos]
+
+    async def set_position(self, pos):
+        """Sends request to driver to move filter wheel position
+
+        This DOES NOT wait for filter to move into position!
+
+        Use is_moving() method to check if its done.
+        """
+        if pos < await self.get_num_positions():
+            params = {'Position': pos}
+            return await self.set_prop('position', params)
+        else:
+            return False
+
+    async def set_position_name(self, name):
+        """Sends request to driver to move filter wheel position
+
+        This DOES NOT wait for filter to move into position!
+
+        Use is_moving() method to check if its done.
+        """
+        names = await self.get_names()
+        try:
+            newpos = names.index(name)
+        except ValueError:
+            return False
+
+        await self.set_position(newpos)
+        return True
+
+    async def is_moving(self):
+        # ASCOM API defines position of -1 as wheel in motion
+        return await self.get_position() == -1
+
+    async def get_names(self):
+        # names are setup in the 'Setup' dialog for the filter wheel
+        return await self.get_prop('names')
+
+    async def get_num_positions(self):
+        return len(await self.get_names())
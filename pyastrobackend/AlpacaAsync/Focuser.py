@@ -0,0 +1,55 @@
+#
+# Alpaca asyncio focuser device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.Alpaca.Focuser import Focuser as AlpacaFocuser
+from pyastrobackend.AlpacaAsync.AlpacaAsyncDevice import AlpacaAsyncDevice
+
+class Focuser(AlpacaAsyncDevice):
+    """
+    Alpaca focuser for use from an asyncio event loop.
+    """
+
+    prop_cache_policy = AlpacaFocuser.prop_cache_policy
+    device_state_props = AlpacaFocuser.device_state_props
+
+    def __init__(self, backend):
+        self._initialize_device_attr()
+        self.backend = backend
+        logging.info(f'alpaca async focuser setting backend to {backend}')
+
+    async def get_absolute_position(self):
+        return await self.get_prop('position')
+
+    async def move_absolute_position(self, abspos):
+        params = {'Position': abspos}
+        return await self.set_prop('move', params)
+
+    async def get_max_absolute_position(self):
+        return await self.get_prop('maxstep')
+
+    async def get_current_temperature(self):
+        return await self.get_prop('temperature')
+
+    async def stop(self):
+        return await self.set_prop('halt', {})
+
+    async def is_moving(self):
+        return await self.get_prop('ismoving')
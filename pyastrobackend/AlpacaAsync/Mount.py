@@ -0,0 +1,103 @@
+#
+# Alpaca asyncio mount device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.Alpaca.Mount import Mount as AlpacaMount
+from pyastrobackend.Alpaca.Mount import PIEREAST, PIERWEST
+from pyastrobackend.AlpacaAsync.AlpacaAsyncDevice import AlpacaAsyncDevice
+
+class Mount(AlpacaAsyncDevice):
+    """
+    Alpaca mount for use from an asyncio event loop.
+    """
+
+    prop_cache_policy = AlpacaMount.prop_cache_policy
+    device_state_props = AlpacaMount.device_state_props
+
+    def __init__(self, backend):
+        self._initialize_device_attr()
+        self.backend = backend
+        logging.info(f'alpaca async mount setting backend to {backend}')
+
+    async def can_park(self):
+        return await self.get_prop('canpark')
+
+    async def is_parked(self):
+        return await self.get_prop('atpark')
+
+    async def get_position_altaz(self):
+        """Returns tuple of (alt, az) in degrees"""
+        vals = await self.get_props(['altitude', 'azimuth'])
+        return (vals['altitude'], vals['azimuth'])
+
+    async def get_position_radec(self):
+        """Returns tuple of (ra, dec) with ra in decimal hours and dec in degrees"""
+        vals = await self.get_props(['rightascension', 'declination'])
+        return (vals['rightascension'], vals['declination'])
+
+    async def get_pier_side(self):
+        side = await self.get_prop('sideofpier')
+
+        # 0 = pierEast, 1 = pierWest, -1 = pierUnknown
+        if side == PIEREAST:
+            return 'EAST'
+        elif side == PIERWEST:
+            return 'WEST'
+        else:
+            return None
+
+    def get_side_physical(self):
+        logging.warning('Mount.get_side_physical() is not implemented for Alpaca!')
+        return None
+
+    def get_side_pointing(self):
+        logging.warning('Mount.get_side_pointing() is not implemented for Alpaca!')
+        return None
+
+    async def is_slewing(self):
+        return await self.get_prop('slewing')
+
+    async def abort_slew(self):
+        return await self.set_prop('abortslew', {})
+
+    async def park(self):
+        return await self.set_prop('park', {})
+
+    async def slew(self, ra, dec):
+        """Slew to ra/dec with ra in decimal hours and dec in degrees"""
+        params = {'RightAscension': ra, 'Declination': dec}
+        return await self.set_prop('slewtocoordinatesasync', params)
+
+    async def sync(self, ra, dec):
+        """Sync to ra/dec with ra in decimal hours and dec in degrees"""
+        params = {'RightAscension': ra, 'Declination': dec}
+        return await self.set_prop('synctocoordinates', params)
+
+    async def unpark(self):
+        return await self.set_prop('unpark', {})
+
+    async def set_tracking(self, onoff):
+        logging.debug(f'set_tracking: setting to {onoff}')
+        params = {'Tracking': onoff}
+        await self.set_prop('tracking', params)
+        return await self.get_prop('tracking') == onoff
+
+    async def get_tracking(self):
+        return await self.get_prop('tracking')
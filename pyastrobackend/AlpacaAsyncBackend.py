@@ -0,0 +1,368 @@
+#
+# Alpaca asyncio device backend
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" Pure Alpaca solution using asyncio """
+
+import asyncio
+import logging
+
+import aiohttp
+
+from pyastrobackend.Alpaca.AlpacaTransport import DEFAULT_TIMEOUTS
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_PROPERTY
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_COMMAND
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_IMAGE
+from pyastrobackend.Alpaca.AlpacaDevice import DEVICE_STATE_UNSUPPORTED
+from pyastrobackend.Alpaca.AlpacaDevice import is_not_implemented
+from pyastrobackend.Alpaca.AlpacaDiscovery import AlpacaDeviceDirectory
+from pyastrobackend.Alpaca.AlpacaDiscovery import get_device_specs
+from pyastrobackend.AlpacaAsync.Camera import Camera
+from pyastrobackend.AlpacaAsync.Focuser import Focuser
+from pyastrobackend.AlpacaAsync.FilterWheel import FilterWheel
+from pyastrobackend.AlpacaAsync.Mount import Mount
+
+class DeviceBackend:
+    """
+    Alpaca backend for use from an asyncio event loop.
+
+    Same interface as :class:`pyastrobackend.AlpacaBackend.DeviceBackend`
+    except every method which talks to a server is a coroutine.  All
+    requests share one non-blocking HTTP session with keep-alive
+    connections so a single event loop can drive many devices on many
+    servers without a thread per device.
+
+    Device specs are the same as for the blocking backend, either
+    "ALPACA:<device type>:<device number>" for the default server or
+    "ALPACA:<host>:<port>:<device type>:<device number>".
+
+    HTTP compression is configured as for the blocking backend with
+    compression and compression_hosts.
+
+    Requests use the same timeout classes as the blocking backend and
+    timeouts overrides them the same way.
+
+    Devices are listed by :meth:`getDevicesByClass` from the management
+    API of the servers the same way, with discovery and servers
+    configured as for the blocking backend.  The queries are made with
+    :class:`pyastrobackend.Alpaca.AlpacaDiscovery.AlpacaDeviceDirectory`
+    in the default executor.
+
+    Unlike the blocking backend failed requests are not retried, there is
+    no circuit breaker to stop requests to a server which keeps failing
+    and no request metrics are kept - an error is returned to the caller
+    as soon as a request fails.
+
+    Requires the optional aiohttp package.
+    """
+
+    def __init__(self, ip='127.0.0.1', port=11111, pool_size=4,
+                 idle_timeout=30.0, discovery=False,
+                 discovery_refresh_interval=60.0, discovery_timeout=1.0,
+                 servers=[], compression=False, compression_hosts={},
+                 timeouts={}):
+
+        self.server_ip = ip
+        self.server_port = port
+
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+
+        self.compression = compression
+        self.compression_hosts = dict(compression_hosts)
+
+        self.timeouts = {**DEFAULT_TIMEOUTS, **timeouts}
+
+        self.request_id = 1
+
+        self.api_version = 1
+
+        # devices reported by management API of server(s)
+        self.device_directory = AlpacaDeviceDirectory(
+                                    servers=[(ip, port), *servers],
+                                    discovery=discovery,
+                                    refresh_interval=discovery_refresh_interval,
+                                    timeout=discovery_timeout)
+
+        # how each server sends ImageArray - see Camera.get_image_data()
+        self.image_transfer_modes = {}
+
+        self._session = None
+
+        self.connected = False
+
+    def name(self):
+        return 'ALPACA'
+
+    async def connect(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size,
+                                             keepalive_timeout=self.idle_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        self.connected = True
+        return True
+
+    async def disconnect(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.connected = False
+        return True
+
+    def isConnected(self):
+        return self.connected
+
+    def newCamera(self):
+        return Camera(self)
+
+    def newFocuser(self):
+        return Focuser(self)
+
+    def newFilterWheel(self):
+        return FilterWheel(self)
+
+    def newMount(self):
+        return Mount(self)
+
+    async def getDevicesByClass(self, device_class):
+        # directory queries servers with blocking requests
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, get_device_specs,
+                                          self.device_directory, device_class,
+                                          (self.server_ip, self.server_port))
+
+    def _get_session(self):
+        if self._session is None:
+            raise RuntimeError('Alpaca async backend used before connect()!')
+        return self._session
+
+    def _server(self, server):
+        if server is None:
+            return (self.server_ip, self.server_port)
+        return server
+
+    def set_compression(self, compression, server=None):
+        """
+        Turn HTTP compression on or off for a server.
+
+        :param compression: True to ask for compressed responses.
+        :type compression: bool
+        :param server: Tuple of (host, port) or None for default server.
+        :type server: tuple
+        """
+        self.compression_hosts[self._server(server)] = compression
+
+    def _headers(self, server, extraheaders={}):
+        # aiohttp asks for and undoes compression by default
+        compression = self.compression_hosts.get(self._server(server),
+                                                 self.compression)
+        if compression:
+            return {'Accept-Encoding': 'gzip, deflate', **extraheaders}
+        return {'Accept-Encoding': 'identity', **extraheaders}
+
+    def _timeout(self, timeout_class):
+        connect_timeout, read_timeout = self.timeouts[timeout_class]
+        return aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                     sock_read=read_timeout)
+
+    def _base_url(self, device_type, device_number, server=None):
+        host, port = self._server(server)
+        return f'http://{host}:{port}/' \
+               + f'api/v{self.api_version}/' \
+               + f'{device_type}/{device_number}/'
+
+    def _client_params(self, params={}):
+        # only ever touched from the event loop thread so no lock needed
+        params = {**params, 'ClientID': 1,
+                  'ClientTransactionID': self.request_id}
+        self.request_id += 1
+        return params
+
+    @staticmethod
+    def _check_error(resp_dict, req):
+        error_num = resp_dict.get('ErrorNumber', None)
+        if error_num is None:
+            logging.error(f'No error number returned for request {req}!')
+            return False
+
+        if error_num != 0:
+            error_msg = resp_dict.get('ErrorMessage', 'Unknown')
+            logging.error(f'{req} returned error number '
+                          f'{error_num} error message "{error_msg}"')
+            return False
+
+        return True
+
+    async def get_prop(self, device_type, device_number, prop, params={},
+                       returndict=False, server=None):
+        params = self._client_params(params)
+        req = self._base_url(device_type, device_number, server) + prop
+
+        try:
+            async with self._get_session().get(
+                               req, params=params,
+                               headers=self._headers(server),
+                               timeout=self._timeout(TIMEOUT_PROPERTY)) \
+                    as resp:
+                if resp.status != 200:
+                    logging.error(f'get_prop {req} failed with HTTP status '
+                                  f'{resp.status}!')
+                    return None
+                resp_json = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            logging.error(f'get_prop {req} failed: {err}')
+            return None
+
+        if not self._check_error(resp_json, req):
+            return None
+
+        if 'Value' not in resp_json:
+            logging.error('get_prop request response had no Value!')
+            return None
+
+        if not returndict:
+            return resp_json['Value']
+        else:
+            return resp_json
+
+    async def get_device_state(self, device_type, device_number,
+                               server=None):
+        """
+        Read devicestate of a device.
+
+        Unlike :meth:`get_prop` a server which does not implement
+        devicestate can be told apart from a request which failed.
+
+        :return: List of Name/Value dictionaries, DEVICE_STATE_UNSUPPORTED
+                 if server says devicestate is not implemented or None if
+                 the request failed.
+        :rtype: list
+        """
+        params = self._client_params()
+        req = self._base_url(device_type, device_number, server) \
+            + 'devicestate'
+
+        try:
+            async with self._get_session().get(
+                               req, params=params,
+                               headers=self._headers(server),
+                               timeout=self._timeout(TIMEOUT_PROPERTY)) \
+                    as resp:
+                try:
+                    resp_json = await resp.json(content_type=None)
+                except ValueError:
+                    resp_json = None
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logging.error(f'get_device_state {req} failed: {err}')
+            return None
+
+        if is_not_implemented(status, resp_json):
+            return DEVICE_STATE_UNSUPPORTED
+
+        if status != 200 or not isinstance(resp_json, dict):
+            logging.error(f'get_device_state {req} failed with HTTP status '
+                          f'{status}!')
+            return None
+
+        if not self._check_error(resp_json, req):
+            return None
+
+        if 'Value' not in resp_json:
+            logging.error('get_device_state response had no Value!')
+            return None
+
+        return resp_json['Value']
+
+    async def get_props(self, device_type, device_number, props, server=None):
+        """
+        Read several properties of a device concurrently.
+
+        :param props: Names of properties to read.
+        :type props: list
+        :return: Dictionary mapping each property name to its value, which
+                 is None if the read failed.
+        :rtype: dict
+        """
+        props = list(dict.fromkeys(props))
+        vals = await asyncio.gather(*[self.get_prop(device_type,
+                                                    device_number, p,
+                                                    server=server)
+                                      for p in props])
+        return dict(zip(props, vals))
+
+    async def set_prop(self, device_type, device_number, prop, params={},
+                       server=None):
+        params = self._client_params(params)
+        req = self._base_url(device_type, device_number, server) + prop
+        logging.debug(f'Sending PUT req {req} params {params}')
+
+        try:
+            async with self._get_session().put(
+                               req, data=params,
+                               headers=self._headers(server),
+                               timeout=self._timeout(TIMEOUT_COMMAND)) \
+                    as resp:
+                if resp.status != 200:
+                    logging.error(f'set_prop {req} failed with HTTP status '
+                                  f'{resp.status}!')
+                    return False
+                resp_json = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            logging.error(f'set_prop {req} failed: {err}')
+            return False
+
+        return self._check_error(resp_json, req)
+
+    async def set_props(self, device_type, device_number, prop_params,
+                        server=None):
+        """
+        Write several properties of a device concurrently.
+
+        :param prop_params: Dictionary mapping each property name to the
+                            parameters for its write.
+        :type prop_params: dict
+        :return: Dictionary mapping each property name to True if its
+                 write succeeded.
+        :rtype: dict
+        """
+        props = list(prop_params)
+        results = await asyncio.gather(*[self.set_prop(device_type,
+                                                       device_number, p,
+                                                       prop_params[p],
+                                                       server=server)
+                                         for p in props])
+        return dict(zip(props, results))
+
+    def image_request(self, device_type, device_number, prop, extraheaders={},
+                      server=None):
+        """
+        Start GET request for image data.
+
+        Use as an async context manager - the response body can then be
+        read as a whole or streamed in chunks.
+
+        :return: Response context manager.
+        :rtype: :class:`aiohttp.ClientResponse`
+        """
+        params = self._client_params()
+        req = self._base_url(device_type, device_number, server) + prop
+        return self._get_session().get(req, params=params,
+                                       headers=self._headers(server,
+                                                             extraheaders),
+                                       timeout=self._timeout(TIMEOUT_IMAGE))
@@ -21,13 +21,32 @@
 
 import json
 import logging
+from threading import Lock
+
 import requests
 
 # for base64/imagearray big transfers
 import pycurl
 from io import BytesIO
+from urllib.parse import urlencode
 
 from pyastrobackend.BaseBackend import BaseDeviceBackend
+from pyastrobackend.Alpaca.AlpacaTransport import AlpacaHostTransport
+from pyastrobackend.Alpaca.AlpacaTransport import CurlHandlePool
+from pyastrobackend.Alpaca.AlpacaTransport import RetryBudget, CircuitBreaker
+from pyastrobackend.Alpaca.AlpacaTransport import CircuitOpenError
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_PROPERTY
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_COMMAND
+from pyastrobackend.Alpaca.AlpacaTransport import TIMEOUT_IMAGE
+from pyastrobackend.Alpaca.AlpacaDiscovery import AlpacaDeviceDirectory
+from pyastrobackend.Alpaca.AlpacaDiscovery import get_device_specs
+from pyastrobackend.Alpaca.AlpacaMetrics import AlpacaMetrics
+from pyastrobackend.Alpaca.AlpacaMetrics import ERROR_HTTP, ERROR_PARSE
+from pyastrobackend.Alpaca.AlpacaMetrics import ERROR_ALPACA, ERROR_TRANSPORT
+from pyastrobackend.Alpaca.AlpacaMetrics import ERROR_TIMEOUT
+from pyastrobackend.Alpaca.AlpacaMetrics import ERROR_CIRCUIT_OPEN
+from pyastrobackend.Alpaca.AlpacaDevice import DEVICE_STATE_UNSUPPORTED
+from pyastrobackend.Alpaca.AlpacaDevice import is_not_implemented
 
 from pyastrobackend.Alpaca.Camera import Camera
 from pyastrobackend.Alpaca.Focuser import Focuser
@@ -35,16 +54,93 @@ from pyastrobackend.Alpaca.FilterWheel import FilterWheel
 from pyastrobackend.Alpaca.Mount import Mount
 
 class DeviceBackend(BaseDeviceBackend):
-
-    def __init__(self, ip='127.0.0.1', port=11111):
+    """
+    Alpaca backend.
+
+    Devices are normally on the server given by ip and port but a device
+    spec of the form "ALPACA:<host>:<port>:<device type>:<device number>"
+    addresses a device on any server.  Each server gets its own pooled
+    connections so one slow server does not hold up the others.
+
+    Additional servers listed in servers, and any found by UDP discovery
+    if enabled, are included by :meth:`getDevicesByClass`.
+
+    If coalesce_reads is True threads reading the same property of a
+    device at the same time share a single request.
+
+    HTTP compression of responses is requested from servers if
+    compression is True.  It can be set per server with
+    compression_hosts, a dictionary mapping (host, port) to True or
+    False, so servers across a slow link can use it while LAN servers
+    skip the CPU cost.
+
+    Latency, bytes, errors and in flight counts of every request are
+    recorded per server, device and property unless metrics is False -
+    see :meth:`get_metrics` and :meth:`get_metrics_text`.
+
+    No request can block forever.  timeouts maps each timeout class -
+    'property' for reads, 'command' for writes and 'image' for image
+    downloads - to (connect, read) timeouts in seconds, see
+    :data:`AlpacaTransport.DEFAULT_TIMEOUTS`.  Reads which fail to get a
+    response are retried up to max_retries times, but retries to a server
+    are limited to retry_ratio of its requests.  Once
+    circuit_failure_threshold requests in a row to a server get no
+    response all requests to it fail at once, without waiting on a
+    timeout, until a probe every circuit_reset_timeout seconds succeeds.
+    A failed request is logged and returns None (False for writes) as for
+    any other error.
+    """
+
+    def __init__(self, ip='127.0.0.1', port=11111, pool_size=4,
+                 idle_timeout=30.0, curl_buffer_size=512*1024,
+                 tcp_nodelay=True, discovery=False,
+                 discovery_refresh_interval=60.0, discovery_timeout=1.0,
+                 servers=[], coalesce_reads=True, compression=False,
+                 compression_hosts={}, metrics=True, timeouts={},
+                 max_retries=2, retry_ratio=0.1, circuit_failure_threshold=5,
+                 circuit_reset_timeout=10.0):
 
         self.server_ip = ip
         self.server_port = port
 
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+
+        # warm curl handles for big image transfers - kept per server
+        self.curl_pool = CurlHandlePool(max_idle=pool_size,
+                                        buffer_size=curl_buffer_size,
+                                        tcp_nodelay=tcp_nodelay)
+
+        # keep-alive connections for each server shared by all devices
+        # using this backend
+        self._transports = {}
+        self._transports_lock = Lock()
+
+        self.coalesce_reads = coalesce_reads
+
+        self.compression = compression
+        self.compression_hosts = dict(compression_hosts)
+
+        self.metrics = AlpacaMetrics(enabled=metrics)
+
+        self.timeouts = dict(timeouts)
+        self.max_retries = max_retries
+        self.retry_ratio = retry_ratio
+        self.circuit_failure_threshold = circuit_failure_threshold
+        self.circuit_reset_timeout = circuit_reset_timeout
+
         self.request_id = 1
+        self._request_id_lock = Lock()
 
         self.api_version = 1
 
+        # devices reported by management API of server(s)
+        self.device_directory = AlpacaDeviceDirectory(
+                                    servers=[(ip, port), *servers],
+                                    discovery=discovery,
+                                    refresh_interval=discovery_refresh_interval,
+                                    timeout=discovery_timeout)
+
         self.connected = False
 
     def name(self):
@@ -55,6 +151,11 @@ class DeviceBackend(BaseDeviceBackend):
         return True
 
     def disconnect(self):
+        with self._transports_lock:
+            for transport in self._transports.values():
+                transport.close()
+            self._transports = {}
+        self.curl_pool.close()
         self.connected = False
         return True
 
@@ -74,32 +175,131 @@ class DeviceBackend(BaseDeviceBackend):
         return Mount(self)
 
     def getDevicesByClass(self, device_class):
-        # for now just return "0" to "3" for the device number on remote server
-        # class should be 'camera', 'focuser', 'filterwheel', or 'telescope'
-        # CASE MATTERS
-        if device_class not in ['camera', 'ccd', 'focuser', 'filterwheel',
-                                'mount', 'telescope']:
-            logging.error('Alpaca getDevicesbyClass: device_class '
-                          f'{device_class} not "camera", "ccd", "focuser", '
-                          '"filterwheel", "mount" or "telescope"')
-            return []
-
-        # accept either 'ccd' or 'camera' for camera class
-        # but alpaca wants 'camera'
-        if device_class == 'ccd':
-            device_class = 'camera'
-        elif device_class == 'mount':
-            device_class = 'telescope'
-
-        vals = []
-        for d in ["0", "1", "2", "3"]:
-            vals.append(f'ALPACA:{device_class}:{d}')
-        return vals
+        return get_device_specs(self.device_directory, device_class,
+                                (self.server_ip, self.server_port))
+
+    def get_transport(self, server=None):
+        """
+        Returns connection pools for a server.
+
+        :param server: Tuple of (host, port) or None for default server.
+        :type server: tuple
+        :return: Transport for server.
+        :rtype: :class:`AlpacaHostTransport`
+        """
+        if server is None:
+            server = (self.server_ip, self.server_port)
+
+        with self._transports_lock:
+            transport = self._transports.get(server)
+            if transport is None:
+                logging.debug(f'Creating Alpaca transport for {server}')
+                compression = self.compression_hosts.get(server,
+                                                         self.compression)
+                breaker = CircuitBreaker(
+                              failure_threshold=self.circuit_failure_threshold,
+                              reset_timeout=self.circuit_reset_timeout)
+                transport = AlpacaHostTransport(*server,
+                                                pool_size=self.pool_size,
+                                                idle_timeout=self.idle_timeout,
+                                                curl_pool=self.curl_pool,
+                                                compression=compression,
+                                                timeouts=self.timeouts,
+                                                max_retries=self.max_retries,
+                                                retry_budget=RetryBudget(
+                                                    ratio=self.retry_ratio),
+                                                circuit_breaker=breaker)
+                self._transports[server] = transport
+
+        return transport
+
+    def set_compression(self, compression, server=None):
+        """
+        Turn HTTP compression on or off for a server.
+
+        :param compression: True to ask for compressed responses.
+        :type compression: bool
+        :param server: Tuple of (host, port) or None for default server.
+        :type server: tuple
+        """
+        if server is None:
+            server = (self.server_ip, self.server_port)
+
+        self.compression_hosts[server] = compression
+        self.get_transport(server).set_compression(compression)
+
+    def get_transfer_stats(self, server=None):
+        """
+        Returns bytes received and time taken for requests to a server.
+
+        :param server: Tuple of (host, port) or None for default server.
+        :type server: tuple
+        :return: See :meth:`AlpacaTransport.TransferStats.get_stats`.
+        :rtype: dict
+        """
+        return self.get_transport(server).transfer_stats.get_stats()
+
+    def get_reliability_stats(self, server=None):
+        """
+        Returns retry and circuit breaker counts for a server.
+
+        :param server: Tuple of (host, port) or None for default server.
+        :type server: tuple
+        :return: Dictionary with key 'retries' for
+                 :meth:`AlpacaTransport.RetryBudget.get_stats` and 'circuit'
+                 for :meth:`AlpacaTransport.CircuitBreaker.get_stats`.
+        :rtype: dict
+        """
+        transport = self.get_transport(server)
+        return {'retries': transport.retry_budget.get_stats(),
+                'circuit': transport.circuit_breaker.get_stats()}
+
+    def get_metrics(self):
+        """
+        Returns latency histogram and counters for each device property
+        requested.
+
+        :return: See :meth:`AlpacaMetrics.AlpacaMetrics.get_metrics`.
+        :rtype: dict
+        """
+        return self.metrics.get_metrics()
+
+    def get_metrics_text(self):
+        """
+        Returns request metrics in Prometheus text exposition format.
+
+        :return: Metrics text.
+        :rtype: str
+        """
+        return self.metrics.prometheus_text()
+
+    def _track(self, transport, device_type, device_number, prop, method):
+        return self.metrics.track((transport.host, transport.port),
+                                  device_type, device_number, prop, method)
 
-    def _base_url(self, device_type, device_number):
-        return f'http://{self.server_ip}:{self.server_port}/' \
-               + f'api/v{self.api_version}/' \
-               + f'{device_type}/{device_number}/'
+    @staticmethod
+    def _error_kind(resp):
+        return ERROR_HTTP if resp.status_code != 200 else ERROR_ALPACA
+
+    @staticmethod
+    def _request_error_kind(err):
+        if isinstance(err, CircuitOpenError):
+            return ERROR_CIRCUIT_OPEN
+        if isinstance(err, requests.exceptions.Timeout) \
+           or (isinstance(err, pycurl.error)
+               and err.args[0] == pycurl.E_OPERATION_TIMEDOUT):
+            return ERROR_TIMEOUT
+        return ERROR_TRANSPORT
+
+    def _next_request_id(self):
+        with self._request_id_lock:
+            request_id = self.request_id
+            self.request_id += 1
+        return request_id
+
+    def _base_url(self, device_type, device_number, server=None):
+        return self.get_transport(server).url(f'api/v{self.api_version}/'
+                                              f'{device_type}/{device_number}/')
 
     # FIXME Do I really want to make this a static method?
     @staticmethod
@@ -129,41 +329,187 @@ class DeviceBackend(BaseDeviceBackend):
 
         return True
 
-    def get_prop(self, device_type, device_number, prop, params={}, returndict=False):
+    def get_prop(self, device_type, device_number, prop, params={}, returndict=False,
+                 server=None):
+        # only plain reads can be shared
+        if not self.coalesce_reads or params or returndict:
+            return self._get_prop(device_type, device_number, prop, params,
+                                  returndict, server)
+
+        transport = self.get_transport(server)
+        return transport.single_flight.do((device_type, device_number), prop,
+                                          self._get_prop, device_type,
+                                          device_number, prop, server=server)
+
+    def _get_prop(self, device_type, device_number, prop, params={},
+                  returndict=False, server=None):
+        # copy so the shared default dict is never modified - get_props()
+        # calls this from several threads at once
+        params = dict(params)
         params['ClientID'] = 1
-        params['ClientTransactionID'] = self.request_id
-        self.request_id += 1
-        req = self._base_url(device_type, device_number) + prop
+        params['ClientTransactionID'] = self._next_request_id()
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) + prop
 
 #        logging.debug(f'Sending GET req {req} params {params}')
 
-        resp = requests.get(url=req, params=params)
-        try:
-            resp_json = resp.json()
-        except json.decoder.JSONDecodeError:
-            logging.error('resp json parse error!')
-            logging.debug(f'Sent GET req {req} params {params}')
-            logging.debug(f'Response was {resp}')
-            return None
-
-#        logging.debug(f'Response was {resp}')
-#        logging.debug(f'Response JSON = {repr(resp_json)[:200]}')
-
-        if not DeviceBackend._verify_response(resp):
-            return None
+        with self._track(transport, device_type, device_number, prop,
+                         'GET') as tracker:
+            try:
+                resp = transport.request('GET', req, TIMEOUT_PROPERTY,
+                                         retry=True, params=params)
+            except requests.exceptions.RequestException as err:
+                tracker.error(self._request_error_kind(err))
+                logging.error(f'get_prop {req} failed: {err}')
+                return None
+            tracker.transferred(*transport.record_response(resp))
+            try:
+                resp_json = resp.json()
+            except json.decoder.JSONDecodeError:
+                tracker.error(ERROR_HTTP if resp.status_code != 200
+                              else ERROR_PARSE)
+                logging.error('resp json parse error!')
+                logging.debug(f'Sent GET req {req} params {params}')
+                logging.debug(f'Response was {resp}')
+                return None
+
+#            logging.debug(f'Response was {resp}')
+#            logging.debug(f'Response JSON = {repr(resp_json)[:200]}')
+
+            if not DeviceBackend._verify_response(resp):
+                tracker.error(self._error_kind(resp))
+                return None
 
         if not returndict:
             return resp_json['Value']
         else:
             return resp_json
 
-    def set_prop(self, device_type, device_number, prop, params={}):
+    def get_device_state(self, device_type, device_number, server=None):
+        """
+        Read devicestate of a device.
+
+        Unlike :meth:`get_prop` a server which does not implement
+        devicestate can be told apart from a request which failed.
+
+        :return: List of Name/Value dictionaries, DEVICE_STATE_UNSUPPORTED
+                 if server says devicestate is not implemented or None if
+                 the request failed.
+        :rtype: list
+        """
+        if not self.coalesce_reads:
+            return self._get_device_state(device_type, device_number, server)
+
+        transport = self.get_transport(server)
+        return transport.single_flight.do((device_type, device_number),
+                                          'devicestate',
+                                          self._get_device_state,
+                                          device_type, device_number, server)
+
+    def _get_device_state(self, device_type, device_number, server=None):
+        params = {'ClientID': 1,
+                  'ClientTransactionID': self._next_request_id()}
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) \
+            + 'devicestate'
+
+        with self._track(transport, device_type, device_number,
+                         'devicestate', 'GET') as tracker:
+            try:
+                resp = transport.request('GET', req, TIMEOUT_PROPERTY,
+                                         retry=True, params=params)
+            except requests.exceptions.RequestException as err:
+                tracker.error(self._request_error_kind(err))
+                logging.error(f'get_device_state {req} failed: {err}')
+                return None
+            tracker.transferred(*transport.record_response(resp))
+            try:
+                resp_json = resp.json()
+            except json.decoder.JSONDecodeError:
+                resp_json = None
+
+            if is_not_implemented(resp.status_code, resp_json):
+                tracker.error(self._error_kind(resp))
+                return DEVICE_STATE_UNSUPPORTED
+
+            if resp_json is None:
+                tracker.error(ERROR_HTTP if resp.status_code != 200
+                              else ERROR_PARSE)
+                logging.error('resp json parse error!')
+                return None
+
+            if not DeviceBackend._verify_response(resp):
+                tracker.error(self._error_kind(resp))
+                return None
+
+        return resp_json['Value']
+
+    def get_props(self, device_type, device_number, props, server=None):
+        """
+        Read several properties of a device concurrently.
+
+        :param props: Names of properties to read.
+        :type props: list
+        :return: Dictionary mapping each property name to its value, which
+                 is None if the read failed.
+        :rtype: dict
+        """
+        props = list(dict.fromkeys(props))
+        if len(props) < 2:
+            return {p: self.get_prop(device_type, device_number, p,
+                                     server=server)
+                    for p in props}
+
+        transport = self.get_transport(server)
+        futures = {p: transport.submit(self.get_prop, device_type,
+                                       device_number, p, server=server)
+                   for p in props}
+
+        vals = {}
+        for p, future in futures.items():
+            try:
+                vals[p] = future.result()
+            except Exception:
+                logging.error(f'get_props: error reading {p}', exc_info=True)
+                vals[p] = None
+
+        return vals
+
+    def set_prop(self, device_type, device_number, prop, params={},
+                 server=None):
+        params = dict(params)
         params['ClientID'] = 1
-        params['ClientTransactionID'] = self.request_id
-        self.request_id += 1
-        req = self._base_url(device_type, device_number) + prop
+        params['ClientTransactionID'] = self._next_request_id()
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) + prop
         logging.debug(f'Sending POST req {req} params {params}')
-        resp = requests.put(url=req, data=params)
+
+        # reads started after this write must not share reads from before
+        # it and reads started during it must not be shared after it
+        transport.single_flight.barrier((device_type, device_number))
+        try:
+            with self._track(transport, device_type, device_number, prop,
+                             'PUT') as tracker:
+                try:
+                    # not retried - a write which timed out may still
+                    # have happened
+                    resp = transport.request('PUT', req, TIMEOUT_COMMAND,
+                                             data=params)
+                except requests.exceptions.RequestException as err:
+                    tracker.error(self._request_error_kind(err))
+                    logging.error(f'set_prop {req} failed: {err}')
+                    return False
+                tracker.transferred(*transport.record_response(resp))
+                ok = self._check_put_response(resp)
+                if not ok:
+                    tracker.error(self._error_kind(resp))
+        finally:
+            transport.single_flight.barrier((device_type, device_number))
+
+        return ok
+
+    @staticmethod
+    def _check_put_response(resp):
         #logging.debug(f'Response was {resp} {resp.json()}')
 
         # test if request successful
@@ -186,37 +532,171 @@ class DeviceBackend(BaseDeviceBackend):
 
         return True
 
-    def get_base64(self, device_type, device_number, prop):
+    def set_props(self, device_type, device_number, prop_params, server=None):
+        """
+        Write several properties of a device concurrently.
+
+        Only use for properties whose writes do not depend on each other
+        since the order they reach the server in is not defined.
+
+        :param prop_params: Dictionary mapping each property name to the
+                            parameters for its write.
+        :type prop_params: dict
+        :return: Dictionary mapping each property name to True if its
+                 write succeeded.
+        :rtype: dict
+        """
+        if len(prop_params) < 2:
+            return {p: self.set_prop(device_type, device_number, p, params,
+                                     server=server)
+                    for p, params in prop_params.items()}
+
+        transport = self.get_transport(server)
+        futures = {p: transport.submit(self.set_prop, device_type,
+                                       device_number, p, params,
+                                       server=server)
+                   for p, params in prop_params.items()}
+
+        results = {}
+        for p, future in futures.items():
+            try:
+                results[p] = future.result()
+            except Exception:
+                logging.error(f'set_props: error writing {p}', exc_info=True)
+                results[p] = False
+
+        return results
+
+    def get_stream(self, device_type, device_number, prop, write_function,
+                   extraheaders=[], server=None):
+        """
+        GET request using pycurl which passes the response body to
+        write_function as it arrives instead of buffering it.
+
+        :param write_function: Called with each chunk of the body.  Must
+                               return None or the length of the chunk.
+        :type write_function: callable
+        :return: True on success.
+        :rtype: bool
+        """
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) + prop
+
+        # any compression is undone by curl before write_function sees it
+        decoded_bytes = 0
+
+        def counting_write(chunk):
+            nonlocal decoded_bytes
+            decoded_bytes += len(chunk)
+            return write_function(chunk)
+
+        with self._track(transport, device_type, device_number, prop,
+                         'GET') as tracker:
+            try:
+                with transport.curl_handle(TIMEOUT_IMAGE) as c:
+                    c.setopt(c.URL, req)
+                    c.setopt(c.WRITEFUNCTION, counting_write)
+                    c.setopt(c.HTTPHEADER, extraheaders)
+                    transport.perform(c)
+                    status = c.getinfo(c.RESPONSE_CODE)
+                    tracker.transferred(*transport.record_curl_transfer(
+                                             c, decoded_bytes, req))
+                    if status != 200:
+                        tracker.error(ERROR_HTTP)
+            except (pycurl.error, CircuitOpenError) as err:
+                tracker.error(self._request_error_kind(err))
+                logging.error(f'get_stream {req} failed: {err}')
+                return False
+
+        if status != 200:
+            logging.error(f'get_stream {req} returned HTTP status {status}!')
+            return False
+
+        return True
+
+    def get_image_request(self, device_type, device_number, prop,
+                          extraheaders=[], server=None):
+        """
+        GET request for image data using pycurl.
+
+        Unlike :meth:`get_request` the body is not parsed since depending
+        on the headers sent the server may respond with JSON or with binary
+        ImageBytes data.
+
+        :return: Tuple of content type and response body.  Body is None if
+                 the request failed.
+        :rtype: (str, memoryview)
+        """
+        params = {'ClientID': 1,
+                  'ClientTransactionID': self._next_request_id()}
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) + prop \
+            + '?' + urlencode(params)
+
+        headers = {}
+
+        def header_function(header_line):
+            header_line = header_line.decode('iso-8859-1')
+            if ':' not in header_line:
+                return
+            name, value = header_line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
         buffer = BytesIO()
-        c = pycurl.Curl()
-        req = self._base_url(device_type, device_number) + prop
-        ctype = 'Content-Type: image/tiff'
-        #logging.debug(f'get_base64: req = {req}')
-        #logging.debug('Using {ctype} for http header')
-        c.setopt(c.URL, req)
-        c.setopt(c.WRITEDATA, buffer)
-        c.setopt(c.HTTPHEADER, [ctype])
-        c.perform()
-        c.close()
-
-        body = buffer.getvalue()
-        return body
+        with self._track(transport, device_type, device_number, prop,
+                         'GET') as tracker:
+            try:
+                with transport.curl_handle(TIMEOUT_IMAGE) as c:
+                    c.setopt(c.URL, req)
+                    c.setopt(c.WRITEDATA, buffer)
+                    c.setopt(c.HEADERFUNCTION, header_function)
+                    c.setopt(c.HTTPHEADER, extraheaders)
+                    transport.perform(c)
+                    tracker.transferred(*transport.record_curl_transfer(
+                                             c, buffer.tell(), req))
+                    if c.getinfo(c.RESPONSE_CODE) != 200:
+                        tracker.error(ERROR_HTTP)
+            except (pycurl.error, CircuitOpenError) as err:
+                tracker.error(self._request_error_kind(err))
+                logging.error(f'get_image_request {req} failed: {err}')
+                return None, None
+
+        content_type = headers.get('content-type', '')
+        content_type = content_type.split(';')[0].strip().lower()
+
+        # hand back view of buffer so image data can be used without copy
+        return content_type, buffer.getbuffer()
 
     def get_request(self, device_type, device_number, prop, extraparams={},
-                    extraheaders={}):
+                    extraheaders={}, server=None):
         params = {}
         params['ClientID'] = 1
-        params['ClientTransactionID'] = self.request_id
+        params['ClientTransactionID'] = self._next_request_id()
         params = {**params, **extraparams}
-        self.request_id += 1
-        req = self._base_url(device_type, device_number) + prop
+        transport = self.get_transport(server)
+        req = self._base_url(device_type, device_number, server) + prop
         #logging.debug(f'Sending GET req {req} params {params}')
-        resp = requests.get(url=req, params=params, headers=extraheaders)
-        try:
-            resp_json = resp.json()
-        except json.decoder.JSONDecodeError:
-            logging.error('resp json parse error!')
-            return None
+        with self._track(transport, device_type, device_number, prop,
+                         'GET') as tracker:
+            try:
+                resp = transport.request('GET', req, TIMEOUT_PROPERTY,
+                                         retry=True, params=params,
+                                         headers=extraheaders)
+            except requests.exceptions.RequestException as err:
+                tracker.error(self._request_error_kind(err))
+                logging.error(f'get_request {req} failed: {err}')
+                return None
+            tracker.transferred(*transport.record_response(resp))
+            try:
+                resp_json = resp.json()
+            except json.decoder.JSONDecodeError:
+                tracker.error(ERROR_HTTP if resp.status_code != 200
+                              else ERROR_PARSE)
+                logging.error('resp json parse error!')
+                return None
+            if isinstance(resp_json, dict) \
+               and resp_json.get('ErrorNumber', 0) != 0:
+                tracker.error(ERROR_ALPACA)
 
         #logging.debug(f'Response was {resp}')
         #logging.debug(f'Response JSON = {repr(resp_json)[:200]}')
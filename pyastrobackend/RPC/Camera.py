@@ -19,19 +19,13 @@
 #
 """ RPC Camera solution """
 import sys
-import time
 import logging
 
 from ..BaseBackend import BaseCamera
 
-from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, RPCDevice
+from pyastrobackend.RPC.RPCDeviceBase import RPCDevice
 
 
-# not sure we need to do this but leaving it as be for now
-class RPCCameraThread(RPCDeviceThread):
-    def __init__(self, port, user_data, *args, **kwargs):
-        super().__init__(port, user_data, *args, **kwargs)
-
 class Camera(RPCDevice, BaseCamera):
     def __init__(self, backend=None):
         super().__init__(backend)
@@ -49,9 +43,6 @@ class Camera(RPCDevice, BaseCamera):
         self.frame_height = None
         self.camera_gain = None
 
-        self.rpc_manager = RPCCameraThread(8800, None)
-        self.rpc_manager.event_callbacks.append(self.event_callback)
-
     def event_callback(self, event, *args):
         #logging.debug(f'Camera event_callback: {event} {args})')
         if event == 'Connection':
@@ -177,20 +168,12 @@ class Camera(RPCDevice, BaseCamera):
 
         reqid = rc
 
-        # FIXME this shouldn't be a problem unless RPC Server dies
-        # FIXME add timeout
         # block until we get answer
-        resp = None
-        while True:
-            #logging.debug('waiting...')
-            resp = self.rpc_manager.check_rpc_command_status(reqid)
-            if resp is not None:
-                break
-            time.sleep(0.1)
+        resp = self.wait_for_response(reqid)
 
         if resp is None:
             logging.error('RPC get_settings: resp is None!')
-            sys.exit(1)
+            return None
 
         # FIXME parse out status?
         status = 'result' in resp
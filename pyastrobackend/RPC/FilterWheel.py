@@ -2,7 +2,7 @@
 
 from ..BaseBackend import BaseFilterWheel
 
-from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, RPCDevice
+from pyastrobackend.RPC.RPCDeviceBase import RPCDevice
 
 #
 # RPC filterwheel device
@@ -24,18 +24,11 @@ from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, RPCDevice
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-class RPCFilterWheelThread(RPCDeviceThread):
-    def __init__(self, port, user_data, *args, **kwargs):
-        super().__init__(port, user_data, *args, **kwargs)
-
 
 class FilterWheel(RPCDevice, BaseFilterWheel):
     def __init__(self, backend=None):
         super().__init__(backend)
 
-        self.rpc_manager = RPCFilterWheelThread(8800, None)
-        self.rpc_manager.event_callbacks.append(self.event_callback)
-
     def event_callback(self, event, *args):
         #        logging.debug(f'Focsuer event_callback: {event} {args})')
         if event == 'Connection':
@@ -21,21 +21,13 @@
 
 from ..BaseBackend import BaseFocuser
 
-from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, RPCDevice
-
-
-class RPCFocuserThread(RPCDeviceThread):
-    def __init__(self, port, user_data, *args, **kwargs):
-        super().__init__(port, user_data, *args, **kwargs)
+from pyastrobackend.RPC.RPCDeviceBase import RPCDevice
 
 
 class Focuser(RPCDevice, BaseFocuser):
     def __init__(self, backend=None):
         super().__init__(backend)
 
-        self.rpc_manager = RPCFocuserThread(8800, None)
-        self.rpc_manager.event_callbacks.append(self.event_callback)
-
     def event_callback(self, event, *args):
         #        logging.debug(f'Focsuer event_callback: {event} {args})')
         if event == 'Connection':
@@ -19,27 +19,17 @@
 #
 """ RPC Mount solution """
 
-import sys
-import time
 import logging
 
 from ..BaseBackend import BaseMount
 
-from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, RPCDevice
-
-
-class RPCMountThread(RPCDeviceThread):
-    def __init__(self, port, user_data, *args, **kwargs):
-        super().__init__(port, user_data, *args, **kwargs)
+from pyastrobackend.RPC.RPCDeviceBase import RPCDevice
 
 
 class Mount(RPCDevice, BaseMount):
     def __init__(self, backend=None):
         super().__init__(backend)
 
-        self.rpc_manager = RPCMountThread(8800, None)
-        self.rpc_manager.event_callbacks.append(self.event_callback)
-
     def event_callback(self, event, *args):
         if event == 'Connection':
             self.connected = True
@@ -66,20 +56,12 @@ class Mount(RPCDevice, BaseMount):
 
         reqid = rc
 
-        # FIXME this shouldn't be a problem unless RPC Server dies
-        # FIXME add timeout
         # block until we get answer
-        resp = None
-        while True:
-            #logging.debug('waiting...')
-            resp = self.rpc_manager.check_rpc_command_status(reqid)
-            if resp is not None:
-                break
-            time.sleep(0.1)
+        resp = self.wait_for_response(reqid)
 
         if resp is None:
             logging.error('RPC get_position_altaz: resp is None!')
-            sys.exit(1)
+            return None
 
         # FIXME parse out status?
         status = 'result' in resp
@@ -106,20 +88,12 @@ class Mount(RPCDevice, BaseMount):
 
         reqid = rc
 
-        # FIXME this shouldn't be a problem unless RPC Server dies
-        # FIXME add timeout
         # block until we get answer
-        resp = None
-        while True:
-            #logging.debug('waiting...')
-            resp = self.rpc_manager.check_rpc_command_status(reqid)
-            if resp is not None:
-                break
-            time.sleep(0.1)
+        resp = self.wait_for_response(reqid)
 
         if resp is None:
             logging.error('RPC get_position_radec: resp is None!')
-            sys.exit(1)
+            return None
 
         # FIXME parse out status?
         status = 'result' in resp
@@ -6,8 +6,11 @@ import queue
 import select
 import socket
 import logging
+import itertools
 
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 #
 # RPC device backend
@@ -31,47 +34,120 @@ from threading import Thread, Lock
 # 0 = none, higher shows more
 LOG_SERVER_TRAFFIC = 1
 
+# bytes asked for per recv() - a burst of responses is usually read in
+# one call
+DEFAULT_RECV_SIZE = 65536
+
+# frames at least this long are decoded without copying them first
+MEMORYVIEW_MIN_FRAME = 4096
+
 
 class RPCDeviceThread(Thread):
-    def __init__(self, port, user_data, *args, **kwargs):
+    def __init__(self, port, user_data, *args, recv_size=DEFAULT_RECV_SIZE,
+                 request_ids=None, host='127.0.0.1', **kwargs):
         super().__init__(*args, **kwargs)
+        self.host = host
         self.port = port
         self.user_data = user_data
 
+        # source of request ids - shared by every thread a connection
+        # manager makes so ids are never reused
+        if request_ids is None:
+            request_ids = itertools.count(1)
+        self._request_ids = request_ids
+
+        # set while connected to the server and it has said hello
+        self.server_connected = Event()
+
+        # set by close() to make the thread exit
+        self.stopping = False
+        self.rpc_socket = None
+
+        # scratch buffer data is received into before being appended to
+        # self.buffer
+        self.recv_size = recv_size
+        self._recv_buffer = bytearray(recv_size)
+        self._recv_view = memoryview(self._recv_buffer)
+
         # this make the thread die when sys.exit() called
         self.daemon = True
+
+        # queue_rpc_command() writes a byte here to wake the thread out of
+        # select() so commands go out at once
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+
         self.initialize()
 
     def initialize(self):
         self.daemon = True
-        self.socket = None
-        self.buffer = ''
-
-        self.rpc_request_id = 0
+        self.reset_buffer()
 
         self._lock = Lock()
         self.command_queue = queue.Queue()
         self.event_queue = queue.Queue()
-        self.responses = []
+
+        # maps request id to Future completed with the response dict when
+        # it arrives - entries are removed once the response is collected
+        # or the wait for it times out
+        self.requests = {}
+
+        # maps request id to callback of the device that sent it so the
+        # 'Response' event only goes to that device
+        self.request_callbacks = {}
 
         # FIXME need weakrefs?
         self.event_callbacks = []
 
     def close(self):
-        if self.socket is not None:
-            self.socket.close()
-            self.initialize()
+        """
+        Stop thread and drop connection to server.  Anyone waiting on a
+        response gets None.
+        """
+        self.stopping = True
+        if self.is_alive():
+            self.wakeup()
+        else:
+            self.fail_pending_requests()
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
+
+    def wakeup(self):
+        """
+        Wake thread out of select().
+        """
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # socket buffer full so a wakeup is already pending
+            pass
+        except OSError:
+            # thread has exited and closed it
+            pass
+
+    def wait_connected(self, timeout=None):
+        """
+        Wait until connected to the server.
+
+        :param timeout: Maximum seconds to wait or None to wait forever.
+        :type timeout: float
+        :return: True if connected.
+        :rtype: bool
+        """
+        return self.server_connected.wait(timeout)
 
     def emit(self, event, *args):
         #logging.debug(f'emit: {self.event_callbacks}')
-        for cb in self.event_callbacks:
+        # copy as devices can be added and removed from other threads
+        for cb in list(self.event_callbacks):
             #logging.debug(f'emit: {cb} {event} {args}')
             cb(event, *args)
 
     def run(self):
         logging.info(f'{self.__class__.__name__} started!')
 
-        while True:
+        while not self.stopping:
             # clear out event queue
             while True:
                 try:
@@ -80,19 +156,26 @@ class RPCDeviceThread(Thread):
                     break
 
             logging.info('Connecting to server')
-            while True:
+            while not self.stopping:
                 try:
                     self.rpc_socket = socket.socket(socket.AF_INET,
                                                     socket.SOCK_STREAM)
                     logging.info('Attempting connect')
-                    self.rpc_socket.connect(('127.0.0.1', self.port))
+                    self.rpc_socket.connect((self.host, self.port))
                     logging.info('Success!')
                     break
                 except ConnectionRefusedError:
                     logging.error('Failed to connect to RPC Server')
                     self.rpc_socket.close()
 
-                time.sleep(5)
+                # wait before trying again unless told to stop
+                select.select([self._wakeup_recv], [], [], 5)
+                self.drain_wakeup()
+
+            if self.stopping:
+                if self.rpc_socket is not None:
+                    self.rpc_socket.close()
+                break
 
             logging.debug('Sending connect event to queue')
             cdict = {'Event': 'Connected'}
@@ -101,6 +184,9 @@ class RPCDeviceThread(Thread):
             logging.debug('Waiting on data')
             quit = False
             while not quit:
+                if self.stopping:
+                    break
+
                 #logging.debug('A')
 
                 # check if time for status update request
@@ -111,12 +197,15 @@ class RPCDeviceThread(Thread):
                         # self.queue_rpc_command('getstatus', {})
                         # self.last_status_request_timestamp = time.time()
 
-                read_list = [self.rpc_socket]
+                read_list = [self.rpc_socket, self._wakeup_recv]
                 readable, writable, errored = select.select(read_list, [], [], 0.5)
                 #logging.debug('B')
 
+                if self._wakeup_recv in readable:
+                    self.drain_wakeup()
+
                 # read in new data
-                if len(readable) > 0:
+                if self.rpc_socket in readable:
                     #logging.debug(f'reading data readable={readable}')
 
                     try:
@@ -143,7 +232,7 @@ class RPCDeviceThread(Thread):
                         jdict = json.loads(j)
                     except json.decoder.JSONDecodeError:
                         logging.error(f'Error decoding {j}!', exc_info=True)
-                        break
+                        continue
 
                     event = jdict.get('Event', None)
                     req_id = jdict.get('id', None)
@@ -155,40 +244,25 @@ class RPCDeviceThread(Thread):
                             #logging.debug(f'Received response {repr(jdict)[:60]}')
                             #logging.debug('appending response to list')
 
-                        # FIXME MSF SHOULD I REMOVE FOR NORMAL OPS?
-                        # don't save duplicate ids
-                        already = False
-                        for resp in self.responses:
-                            if resp.get('id', None) == req_id:
-                                already = True
-                        if not already:
-                            self.responses.append(jdict)
+                        # wakes up anyone waiting on this id
+                        self.complete_request(req_id, jdict)
                         if LOG_SERVER_TRAFFIC > 2:
                             logging.debug(f'req_id = {req_id}')
-                        self.emit('Response', req_id)
+                        self.route_response(req_id)
                     elif event is not None:
                         if LOG_SERVER_TRAFFIC > 0:
                             logging.debug(f'Received event {event}')
                         if event == 'Connection':
                             #logging.debug('Recv Connection event')
+                            self.server_connected.set()
                             self.emit(event)
                     else:
                         logging.warning(f'RPCClient: received JSON {jdict} '
                                         'with no event or id!')
 
-                # send any commands
-                try:
-                    rpccmd = self.command_queue.get(block=False)
-                except queue.Empty:
-                    rpccmd = None
-
-                if rpccmd is not None:
-                    if LOG_SERVER_TRAFFIC > 0:
-                        logging.debug(f'Recvd command from queue {rpccmd}')
-                    cmd, edict = rpccmd
-                    cdict = {'method': cmd}
-                    jdict = {**cdict, **edict}
-                    jmsg = str.encode(json.dumps(jdict) + '\n')
+                # send all queued commands in one go
+                jmsg = self.get_queued_commands()
+                if jmsg:
                     if LOG_SERVER_TRAFFIC > 0:
                         logging.debug(f'Sending json rpc = {jmsg}')
                     try:
@@ -205,16 +279,57 @@ class RPCDeviceThread(Thread):
 
             # fell out so close socket and try to reconnect
             logging.debug('RPCClient: Fell out of main loop closing socket')
+            self.server_connected.clear()
             try:
                 self.rpc_socket.close()
             except:
                 logging.error(f'RPCClient: Error closing rpc_socket={self.rpc_socket}',
                               exc_info=True)
 
+        logging.info(f'{self.__class__.__name__} stopped')
+        self.fail_pending_requests()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def drain_wakeup(self):
+        while True:
+            try:
+                if not self._wakeup_recv.recv(4096):
+                    break
+            except (BlockingIOError, InterruptedError):
+                break
+
+    def get_queued_commands(self):
+        """
+        Take every command off the command queue.
+
+        :return: Newline terminated JSON requests for all commands.
+        :rtype: bytes
+        """
+        msgs = []
+        while True:
+            try:
+                cmd, edict = self.command_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if LOG_SERVER_TRAFFIC > 0:
+                logging.debug(f'Recvd command from queue {(cmd, edict)}')
+            jdict = {'method': cmd, **edict}
+            msgs.append(json.dumps(jdict) + '\n')
+
+        return str.encode(''.join(msgs))
+
     def server_disconnected(self):
         logging.error('RPCClient: server disconnection!')
+        self.server_connected.clear()
         self.rpc_socket.close()
-        self.buffer = ''
+        self.fail_pending_requests()
+        self.reset_buffer()
+
+        # waiters were just told these failed so do not send them to the
+        # next connection
+        self.get_queued_commands()
         self.latest_status = ''
         self.latest_status_timestamp = 0
         cdict = {'Event': 'Disconnected'}
@@ -228,90 +343,285 @@ class RPCDeviceThread(Thread):
         #self.rpc_socket.sendall(str.encode(json.dumps(poll_cmd)+'\n'))
         self.queue_rpc_command('polling', {})
 
+    def reset_buffer(self):
+        """
+        Throw away any received data.
+        """
+        # received bytes - frames before self._read_pos have been handled
+        # and no newline has been found from self._read_pos up to
+        # self._scan_pos
+        self.buffer = bytearray()
+        self._read_pos = 0
+        self._scan_pos = 0
+
     def populate_buffer(self):
         """
         Read in any new data into buffer.
         """
-
-        self.rpc_socket.settimeout(0.05)
         got_data = False
         while True:
-            #try:
-            if True:
-                try:
-                    data = self.rpc_socket.recv(4096)
-                except socket.timeout:
-                    data = b''
-
-                logging.debug(f'populate_buffer(): len(data) = {len(data)} '
-                              f'data = |{data}|')
-
-                if len(data) < 1:
-                    # if we've received NOTHING this pass means socket closed
-                    if not got_data:
-                        raise BrokenPipeError('recv returned 0 bytes - '
-                                              'connection lost!')
-                    break
+            nbytes = self.rpc_socket.recv_into(self._recv_buffer)
+
+            if LOG_SERVER_TRAFFIC > 2:
+                logging.debug(f'populate_buffer(): received {nbytes} bytes')
+
+            if nbytes < 1:
+                # if we've received NOTHING this pass means socket closed
+                if not got_data:
+                    raise BrokenPipeError('recv returned 0 bytes - '
+                                          'connection lost!')
+                break
+
+            got_data = True
+            self.buffer += self._recv_view[:nbytes]
 
-                got_data = True
-                data = data.decode()
-                self.buffer += data
-                logging.debug(f'self.buffer = |{self.buffer}|')
+            # a full read means more is probably waiting - only read again
+            # if it is so this never blocks
+            if nbytes < self.recv_size:
+                break
+            readable, _, _ = select.select([self.rpc_socket], [], [], 0)
+            if not readable:
+                break
 
     def read_next_json_block(self):
         """ read \n terminated JSON blocks """
 
-        # find first '{' and '\n' and see if in between contains a valid json block
-        #logging.debug(f'after read buffer = |{self.buffer}|')
-        try:
-            json_start = self.buffer.index('{')
-        except ValueError:
-            return None
-
-        try:
-            json_end = self.buffer[json_start:].index('\n')
-        except ValueError:
-            return None
+        while True:
+            # only look at bytes not already scanned for a newline
+            json_end = self.buffer.find(b'\n', self._scan_pos)
+            if json_end < 0:
+                # no complete frame left so drop handled ones - done once
+                # per read rather than once per frame
+                if self._read_pos > 0:
+                    del self.buffer[:self._read_pos]
+                    self._read_pos = 0
+                self._scan_pos = len(self.buffer)
+                return None
+
+            # skip anything before the start of the JSON block
+            json_start = self.buffer.find(b'{', self._read_pos, json_end)
+            self._read_pos = self._scan_pos = json_end + 1
+            if json_start >= 0:
+                break
 
-        #print('json start/end = ', json_start, json_start + json_end)
+        # only decode the frame itself - large frames are decoded through a
+        # view to save a copy but setting one up costs more than copying a
+        # small frame
+        if json_end - json_start < MEMORYVIEW_MIN_FRAME:
+            ret = self.buffer[json_start:json_end].decode('utf-8', 'replace')
+        else:
+            with memoryview(self.buffer) as view:
+                ret = str(view[json_start:json_end], 'utf-8', 'replace')
 
-        ret = self.buffer[json_start:json_start + json_end]
-        logging.debug(f'json message      -> {ret} <-')
-        self.buffer = self.buffer[json_start + json_end:]
-        logging.debug(f'final read buffer -> {self.buffer} <-')
+        if LOG_SERVER_TRAFFIC > 2:
+            logging.debug(f'json message      -> {ret} <-')
 
         return ret
 
-    def queue_rpc_command(self, cmd, argsdict):
+    def queue_rpc_command(self, cmd, argsdict, callback=None):
         """
         Accept rpc command and dictionary of arguments and creates the json
         request dictionary and submits to command queue for rpc client thread.
+
+        :param callback: Called with ('Response', req_id) when the response
+                         arrives.  If None every event callback is.
+        :type callback: callable
         """
 
-        #FIXME This works for our simple case but seems unclear if 'OK'
-        self.rpc_request_id += 1
-        jdict = {'id': self.rpc_request_id, **argsdict}
+        # register before queueing so the response can never arrive
+        # before there is an entry for it
+        with self._lock:
+            req_id = next(self._request_ids)
+            self.requests[req_id] = Future()
+            if callback is not None:
+                self.request_callbacks[req_id] = callback
+
+        jdict = {'id': req_id, **argsdict}
         self.command_queue.put((cmd, jdict))
 
-        return self.rpc_request_id
+        self.wakeup()
+
+        return req_id
+
+    def route_response(self, req_id):
+        """
+        Tell the device which sent request id req_id its response is in.
+        """
+        with self._lock:
+            callback = self.request_callbacks.pop(req_id, None)
+
+        if callback is not None:
+            callback('Response', req_id)
+        else:
+            self.emit('Response', req_id)
+
+    def complete_request(self, req_id, resp):
+        """
+        Store response for request id req_id and wake anyone waiting on it.
+        """
+        with self._lock:
+            future = self.requests.get(req_id)
+
+        if future is None:
+            # nobody waiting - most likely the wait timed out
+            logging.warning(f'RPCClient: dropping response for unknown '
+                            f'request id {req_id}')
+            return
+
+        if future.done():
+            logging.warning(f'RPCClient: dropping duplicate response for '
+                            f'request id {req_id}')
+            return
+
+        future.set_result(resp)
+
+    def fail_pending_requests(self):
+        """
+        Wake anyone waiting on a response with None since the connection
+        the requests went out on is gone.
+        """
+        with self._lock:
+            requests = self.requests
+            self.requests = {}
+            self.request_callbacks = {}
+
+        for future in requests.values():
+            if not future.done():
+                future.set_result(None)
+
+    def wait_for_rpc_response(self, req_id, timeout=None):
+        """
+        Block until response for request id req_id arrives and returns it.
+        Removes request from table.
+
+        :param timeout: Maximum seconds to wait or None to wait forever.
+        :type timeout: float
+        :return: Response dict or None on timeout or if connection lost.
+        :rtype: dict
+        """
+        with self._lock:
+            future = self.requests.get(req_id)
+
+        if future is None:
+            logging.error(f'wait_for_rpc_response: unknown request id '
+                          f'{req_id}!')
+            return None
+
+        try:
+            resp = future.result(timeout)
+        except FutureTimeoutError:
+            resp = None
+
+        with self._lock:
+            if self.requests.get(req_id) is future:
+                del self.requests[req_id]
+                self.request_callbacks.pop(req_id, None)
+
+        return resp
 
     def check_rpc_command_status(self, req_id):
         """
         See if response available for request id req_id and returns it.
-        Removes from list of requests.
+        Removes from table of requests if it is.
         """
-        if len(self.responses) > 0:
-            logging.debug(f'check_rpc_command_status: req_id = {req_id}')
-            logging.debug(f'check_rpc_command_status: '
-                          f'self.responses={self.responses}')
-        for resp in self.responses:
-            logging.debug(f'check_rpc_command_status: checking resp={resp}')
-            if resp.get('id', None) == req_id:
-                logging.debug(f'Found response for request id {req_id} = {resp}')
-                self.responses.remove(resp)
-                return resp
+        with self._lock:
+            future = self.requests.get(req_id)
+            if future is None or not future.done():
+                return None
+            del self.requests[req_id]
+
+        resp = future.result()
+        logging.debug(f'Found response for request id {req_id} = {resp}')
+        return resp
 
-        return None
+
+class RPCConnectionManager:
+    """
+    One connection to the RPC server shared by several devices.
+
+    The first device to call :meth:`acquire` starts a
+    :class:`RPCDeviceThread` and the last to call :meth:`release` stops
+    it so there is only ever one socket and one thread however many
+    devices are in use.  Request ids come from one counter so they are
+    unique across all devices and reconnects.  Events go to every device
+    and responses only to the device that sent the request.
+
+    :param port: Port of RPC server.
+    :type port: int
+    :param host: Address of RPC server.
+    :type host: str
+    """
+
+    def __init__(self, port=8800, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+        self.thread = None
+
+        # maps device to the callback registered for it
+        self.devices = {}
+
+        self._lock = Lock()
+        self._request_ids = itertools.count(1)
+
+    def acquire(self, device):
+        """
+        Add device to connection and start connecting if it is the first.
+
+        :param device: Device - its event_callback() is called for events.
+        :type device: RPCDevice
+        :return: Thread handling the connection.
+        :rtype: RPCDeviceThread
+        """
+        with self._lock:
+            if self.thread is None:
+                logging.info(f'Starting RPC connection thread for '
+                             f'{self.host}:{self.port}')
+                self.thread = RPCDeviceThread(self.port, None,
+                                              request_ids=self._request_ids,
+                                              host=self.host)
+                self.thread.start()
+
+            if device not in self.devices:
+                self.devices[device] = device.event_callback
+                self.thread.event_callbacks.append(device.event_callback)
+
+            return self.thread
+
+    def release(self, device):
+        """
+        Remove device from connection and close it if it was the last.
+
+        :param device: Device previously passed to :meth:`acquire`.
+        :type device: RPCDevice
+        """
+        with self._lock:
+            if device not in self.devices:
+                return
+
+            callback = self.devices.pop(device)
+            self.thread.event_callbacks.remove(callback)
+            if self.devices:
+                return
+
+            thread = self.thread
+            self.thread = None
+
+        logging.info('Last RPC device released - closing connection')
+        thread.close()
+
+    def close(self):
+        """
+        Disconnect all devices and close connection.
+        """
+        with self._lock:
+            devices = list(self.devices)
+
+        for device in devices:
+            device.disconnect()
+
+    def get_device_count(self):
+        with self._lock:
+            return len(self.devices)
 
 
 class RPCDevice:
@@ -320,12 +630,14 @@ class RPCDevice:
 
         self.connected = False
         self.rpc_manager = None
-        self.port = 8800
 
-        # need to have code like this to setup the thread that talks to RPC server
-        # and point to event handler
-        #self.rpc_manager = RPCDeviceThread(8800, None)
-        #self.rpc_manager.event_callbacks.append(self.event_callback)
+        # devices from a backend share its connection - otherwise each
+        # device has a connection of its own
+        if backend is not None:
+            self.rpc_connection = backend.rpc_connection
+        else:
+            self.rpc_connection = RPCConnectionManager()
+        self.port = self.rpc_connection.port
 
     def has_chooser(self):
         return False
@@ -336,27 +648,34 @@ class RPCDevice:
 
     # name is currently ignored
     def connect(self, name):
-        if self.rpc_manager is not None and self.rpc_manager.is_alive():
-            logging.error('RPCDevice.connect(): rpc_manager is not None! and running')
+        if self.rpc_manager is not None:
+            logging.error('RPCDevice.connect(): already connected!')
             return False
 
         logging.info('RPC Device connect: Connecting to RPCServer '
-                     f'127.0.0.1:{self.port}')
-
-        logging.info('Starting RPC Device manager thread')
-        self.rpc_manager.start()
-
-        while True:
+                     f'{self.rpc_connection.host}:{self.port}')
+
+        rpc_manager = self.rpc_connection.acquire(self)
+        self.rpc_manager = rpc_manager
+
+        # connection may already be up if another device is using it
+        while not rpc_manager.wait_connected(1):
+            if rpc_manager.stopping:
+                logging.error('RPCDevice.connect(): connection closed!')
+                # let go of connection so connect() can be tried again
+                self.rpc_connection.release(self)
+                self.rpc_manager = None
+                return False
             logging.info('Waiting on connection')
-            if self.connected:
-                logging.info('Connection made!')
-                break
-            time.sleep(1)
 
+        logging.info('Connection made!')
+        self.connected = True
         return True
 
     def disconnect(self):
-        self.rpc_manager.close()
+        if self.rpc_manager is not None:
+            self.rpc_connection.release(self)
+            self.rpc_manager = None
         self.connected = False
 
     def is_connected(self):
@@ -371,22 +690,20 @@ class RPCDevice:
         if paramsdict is None:
             paramsdict = {}
 
-        rc = self.rpc_manager.queue_rpc_command(req, paramsdict)
+        if self.rpc_manager is None:
+            logging.error(f'send_server_request: {req} - not connected!')
+            return False
+
+        rc = self.rpc_manager.queue_rpc_command(req, paramsdict,
+                                                self.event_callback)
         #logging.debug(f'send_server_req: queue_rpc_command returned {rc}')
         return rc
 
     def wait_for_response(self, reqid, timeout=90):
         logging.debug('wait_for_response: waiting for '
                       f'reqid={reqid} timeout={timeout}')
-        resp = None
         waited = time.time()
-        while (time.time() - waited) < timeout:
-            #logging.debug('waiting...')
-            resp = self.rpc_manager.check_rpc_command_status(reqid)
-            if resp is not None:
-                logging.debug(f'wait_for_response: Found resp={resp}')
-                break
-            time.sleep(0.05)  # was 1s
+        resp = self.rpc_manager.wait_for_rpc_response(reqid, timeout)
 
         if resp is None:
             logging.error(f'RPC wait for serverreq_id={reqid}  '
@@ -0,0 +1,260 @@
+#
+# RPC asyncio camera device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import asyncio
+import logging
+
+from pyastrobackend.RPCAsync.RPCAsyncDevice import RPCAsyncDevice
+
+class Camera(RPCAsyncDevice):
+    """
+    RPC camera for use from an asyncio event loop.
+
+    Has the same methods as :class:`pyastrobackend.RPC.Camera.Camera`
+    but every method which talks to the server is a coroutine.
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+
+        # set when exposure it going on
+        self.exposure_task = None
+        self.exposure_complete = False
+        self.exposure_success = False
+
+        self.roi = None
+        self.binning = 1
+        self.frame_width = None
+        self.frame_height = None
+        self.camera_gain = None
+
+        logging.info(f'rpc async camera setting backend to {backend}')
+
+    async def get_camera_name(self):
+        return 'RPC'
+
+    async def get_camera_description(self):
+        return 'RPC Camera Driver'
+
+    async def get_driver_info(self):
+        return 'RPC Camera Driver'
+
+    async def get_driver_version(self):
+        return 'V 0.1'
+
+    async def get_state(self):
+        logging.warning('RPC Camera get_state() not implemented')
+        return None
+
+    async def start_exposure(self, expos):
+        paramdict = {'params': {'exposure': expos,
+                                'binning': self.binning,
+                                'roi': self.roi}}
+
+        # gain left out for same reason as RPC.Camera.start_exposure()
+
+        reqid = await self.backend.send_request('take_image', paramdict)
+        if reqid is None:
+            logging.error('RPC:start_exposure - error')
+            return False
+
+        self.exposure_complete = False
+        self.exposure_success = False
+
+        # server responds once exposure is done
+        self.exposure_task = asyncio.ensure_future(
+                                 self._wait_for_exposure(reqid))
+
+        return True
+
+    async def _wait_for_exposure(self, reqid):
+        resp = await self.backend.wait_for_response(reqid, None)
+
+        if resp is None:
+            logging.error(f'No response for exposure req_id = {reqid}!')
+            self.exposure_success = False
+        elif resp.get('result', None) is not None:
+            status = resp['result'].get('complete', None)
+            if status is None:
+                logging.error('exposure completion status is None!')
+            self.exposure_success = bool(status)
+        else:
+            logging.error(f'Error during exposure req_id = {reqid}!')
+            self.exposure_success = False
+
+        self.exposure_complete = True
+
+    async def stop_exposure(self):
+        return await self.send_command('abort_image', {})
+
+    async def check_exposure(self):
+        return self.exposure_complete
+
+    def check_exposure_success(self):
+        # return True if exposure successful
+        # only valid if check_exposure() returns True
+        return self.exposure_success
+
+    async def wait_for_image(self, timeout=None):
+        """
+        Wait for the exposure started by :meth:`start_exposure` to complete.
+
+        :return: True if image is ready, False on error or timeout.
+        :rtype: bool
+        """
+        if self.exposure_task is None:
+            logging.error('wait_for_image called without an exposure '
+                          'having been started!')
+            return False
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self.exposure_task),
+                                   timeout)
+        except asyncio.TimeoutError:
+            logging.error(f'Timed out waiting {timeout} seconds for image!')
+            return False
+
+        return self.exposure_success
+
+    async def supports_progress(self):
+        return False
+
+    async def get_exposure_progress(self):
+        return -1
+
+    def supports_saveimage(self):
+        return True
+
+    async def save_image_data(self, path, overwrite=False):
+        params = {'filename': path,
+                  'overwrite': overwrite}
+        return await self.send_command('save_image', params)
+
+    async def get_settings(self):
+        result = await self.request('get_camera_info')
+        if result is None:
+            logging.warning('RPC:get_settings() - error getting settings!')
+            return None
+
+        if 'framesize' in result:
+            w, h = result['framesize']
+            self.frame_width = w
+            self.frame_height = h
+        if 'binning' in result:
+            await self.set_binning(*result['binning'])
+        if 'roi' in result:
+            self.roi = result['roi']
+        if 'camera_gain' in result:
+            gain = result['camera_gain']
+            if gain is not None:
+                self.camera_gain = gain
+
+        return result
+
+    async def get_image_data(self):
+        logging.warning('RPC Camera get_image_data() not implemented!')
+
+    async def get_pixelsize(self):
+        valx, valy = await asyncio.gather(
+                         self.get_scalar_value('get_camera_x_pixelsize',
+                                               'camera_x_pixelsize',
+                                               (float, )),
+                         self.get_scalar_value('get_camera_y_pixelsize',
+                                               'camera_y_pixelsize',
+                                               (float, )))
+        return valx, valy
+
+    async def get_egain(self):
+        return await self.get_scalar_value('get_camera_egain', 'camera_egain',
+                                           (float, ))
+
+    async def get_camera_gain(self):
+        gain = await self.get_scalar_value('get_camera_gain', 'camera_gain',
+                                           (int, float))
+        if gain is not None:
+            self.camera_gain = gain
+        return gain
+
+    async def set_camera_gain(self, gain):
+        # disabled for same reason as RPC.Camera.set_camera_gain()
+        logging.warning('RPC set_camera_gain DISABLED for now')
+        self.camera_gain = None
+        return False
+
+    async def get_current_temperature(self):
+        return await self.get_scalar_value('get_current_temperature',
+                                           'current_temperature', (float, ))
+
+    async def get_target_temperature(self):
+        return await self.get_scalar_value('get_target_temperature',
+                                           'target_temperature', (float, ))
+
+    async def set_target_temperature(self, temp_c):
+        return await self.set_scalar_value('set_target_temperature',
+                                           'target_temperature', temp_c)
+
+    async def set_cooler_state(self, onoff):
+        return await self.set_scalar_value('set_cooler_state',
+                                           'cooler_state', onoff)
+
+    async def get_cooler_state(self):
+        return await self.get_scalar_value('get_cooler_state',
+                                           'cooler_state', (bool, ))
+
+    async def get_cooler_power(self):
+        return await self.get_scalar_value('get_cooler_power',
+                                           'cooler_power', (float, ))
+
+    async def get_binning(self):
+        return (self.binning, self.binning)
+
+    async def set_binning(self, binx, biny):
+        # just ignore biny
+        # cache for when we are going to take an exposure
+        self.binning = binx
+
+        if not self.frame_width or not self.frame_height:
+            if await self.get_settings() is None:
+                logging.error('RPC:set_binning - unable to get camera settings!')
+                return False
+
+        self.roi = (0, 0,
+                    self.frame_width / self.binning,
+                    self.frame_height / self.binning)
+
+        return True
+
+    async def get_max_binning(self):
+        return await self.get_scalar_value('get_max_binning', 'max_binning',
+                                           (int, ))
+
+    async def get_size(self):
+        if not self.frame_width or not self.frame_height:
+            if await self.get_settings() is None:
+                logging.error('RPC:get_size - unable to get camera settings!')
+                return None
+
+        return (self.frame_width, self.frame_height)
+
+    async def get_frame(self):
+        return self.roi
+
+    async def set_frame(self, minx, miny, width, height):
+        self.roi = (minx, miny, width, height)
+        return True
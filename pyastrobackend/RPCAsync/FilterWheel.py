@@ -0,0 +1,85 @@
+#
+# RPC asyncio filterwheel device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.RPCAsync.RPCAsyncDevice import RPCAsyncDevice
+
+class FilterWheel(RPCAsyncDevice):
+    """
+    RPC filter wheel for use from an asyncio event loop.
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        logging.info(f'rpc async filterwheel setting backend to {backend}')
+
+    async def get_position(self):
+        return await self.get_scalar_value('filterwheel_get_position',
+                                           'filter_position',
+                                           (float, int))
+
+    async def get_position_name(self):
+        names = await self.get_names()
+        pos = await self.get_position()
+        if names is None or pos is None or not 0 <= pos < len(names):
+            return None
+        return names[pos]
+
+    async def set_position(self, pos):
+        """Sends request to driver to move filter wheel position
+
+        This DOES NOT wait for filter to move into position!
+
+        Use is_moving() method to check if its done.
+        """
+        num_positions = await self.get_num_positions()
+        if num_positions is None or pos >= num_positions:
+            return False
+
+        return await self.set_scalar_value('filterwheel_move_position',
+                                           'filter_position', pos)
+
+    async def set_position_name(self, name):
+        """Sends request to driver to move filter wheel position
+
+        This DOES NOT wait for filter to move into position!
+
+        Use is_moving() method to check if its done.
+        """
+        names = await self.get_names()
+        if names is None or name not in names:
+            return False
+
+        return await self.set_position(names.index(name))
+
+    async def is_moving(self):
+        # ASCOM API defines position of -1 as wheel in motion
+        return await self.get_position() == -1
+
+    async def get_names(self):
+        # names are setup in the 'Setup' dialog for the filter wheel
+        return await self.get_list_value('filterwheel_get_filter_names',
+                                         'filter_names')
+
+    async def get_num_positions(self):
+        names = await self.get_names()
+        if names is None:
+            return None
+        return len(names)
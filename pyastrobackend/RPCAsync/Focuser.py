@@ -0,0 +1,58 @@
+#
+# RPC asyncio focuser device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.RPCAsync.RPCAsyncDevice import RPCAsyncDevice
+
+class Focuser(RPCAsyncDevice):
+    """
+    RPC focuser for use from an asyncio event loop.
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        logging.info(f'rpc async focuser setting backend to {backend}')
+
+    async def get_absolute_position(self):
+        return await self.get_scalar_value('focuser_get_absolute_position',
+                                           'absolute_position',
+                                           (float, int))
+
+    async def get_max_absolute_position(self):
+        return await self.get_scalar_value('focuser_get_max_absolute_position',
+                                           'max_absolute_position',
+                                           (float, int))
+
+    async def get_current_temperature(self):
+        return await self.get_scalar_value('focuser_get_current_temperature',
+                                           'current_temperature',
+                                           (float, int))
+
+    async def is_moving(self):
+        return await self.get_scalar_value('focuser_is_moving', 'is_moving',
+                                           (bool, ))
+
+    async def stop(self):
+        return await self.send_command('focuser_stop', {})
+
+    async def move_absolute_position(self, abspos):
+        return await self.set_scalar_value('focuser_move_absolute_position',
+                                           'absolute_position',
+                                           abspos)
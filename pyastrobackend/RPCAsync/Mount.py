@@ -0,0 +1,106 @@
+#
+# RPC asyncio mount device
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from pyastrobackend.RPCAsync.RPCAsyncDevice import RPCAsyncDevice
+
+class Mount(RPCAsyncDevice):
+    """
+    RPC mount for use from an asyncio event loop.
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        logging.info(f'rpc async mount setting backend to {backend}')
+
+    async def send_radec_command(self, cmd, ra, dec):
+        params = {'ra': ra, 'dec': dec}
+        return await self.send_command(cmd, params)
+
+    async def can_park(self):
+        return await self.get_scalar_value('mount_can_park', 'can_park',
+                                           (bool,))
+
+    async def is_parked(self):
+        return await self.get_scalar_value('mount_at_park', 'at_park',
+                                           (bool,))
+
+    async def get_position_altaz(self):
+        """Returns tuple of (alt, az) in degrees"""
+        result = await self.request('mount_get_altaz')
+        if result is None:
+            return None
+
+        return result.get('alt', None), result.get('az', None)
+
+    async def get_position_radec(self):
+        """Returns tuple of (ra, dec) with ra in decimal hours and dec in degrees"""
+        result = await self.request('mount_get_radec')
+        if result is None:
+            return None
+
+        return result.get('ra', None), result.get('dec', None)
+
+    async def get_pier_side(self):
+        return await self.get_scalar_value('mount_pier_side', 'pier_side',
+                                           (str,))
+
+    async def get_side_physical(self):
+        logging.warning('Mount.get_side_physical() is not implemented for RPC!')
+        return None
+
+    async def get_side_pointing(self):
+        logging.warning('Mount.get_side_pointing() is not implemented for RPC!')
+        return None
+
+    async def is_slewing(self):
+        return await self.get_scalar_value('mount_is_slewing', 'is_slewing',
+                                           (bool,))
+
+    async def abort_slew(self):
+        return await self.send_command('mount_abort_slew', {})
+
+    async def park(self):
+        return await self.send_command('mount_park', {})
+
+    async def slew(self, ra, dec):
+        """Slew to ra/dec with ra in decimal hours and dec in degrees"""
+        return await self.send_radec_command('mount_slew_radec', ra, dec)
+
+    async def sync(self, ra, dec):
+        """Sync to ra/dec with ra in decimal hours and dec in degrees"""
+        return await self.send_radec_command('mount_sync_radec', ra, dec)
+
+    async def unpark(self):
+        return await self.send_command('mount_unpark', {})
+
+    async def set_tracking(self, onoff):
+        logging.debug(f'set_tracking: setting to {onoff}')
+        await self.set_scalar_value('mount_set_tracking', 'tracking', onoff)
+
+        # check
+        val = await self.get_tracking()
+        rc = val == onoff
+        logging.debug(f'set_tracking: Tracking = {val} rc = {rc}')
+        return rc
+
+    async def get_tracking(self):
+        return await self.get_scalar_value('mount_get_tracking', 'tracking',
+                                           (bool,))
@@ -0,0 +1,115 @@
+#
+# RPC asyncio device base
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+
+class RPCAsyncDevice:
+    """
+    Base for RPC devices used from an asyncio event loop.
+
+    Same as :class:`pyastrobackend.RPC.RPCDeviceBase.RPCDevice` but
+    requests go through the connection of a
+    :class:`pyastrobackend.RPCAsyncBackend.DeviceBackend` and every method
+    which talks to the server is a coroutine.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.connected = False
+
+    def has_chooser(self):
+        return False
+
+    def show_chooser(self, last_choice):
+        logging.warning('RPC Device Backend: no show_chooser()!')
+        return None
+
+    # name is currently ignored
+    async def connect(self, name):
+        self.connected = await self.backend.connect()
+        return self.connected
+
+    async def disconnect(self):
+        # connection is shared so is closed by the backend
+        self.connected = False
+
+    async def is_connected(self):
+        return self.connected and self.backend.isConnected()
+
+    def events(self):
+        """
+        Events sent by the server.
+
+        Use as an async iterator - see
+        :meth:`pyastrobackend.RPCAsyncBackend.DeviceBackend.events`.
+        """
+        return self.backend.events()
+
+    async def request(self, method, paramsdict=None, timeout=-1):
+        """
+        Send request to server and wait for the result.
+
+        :return: Result dict or None on error.
+        :rtype: dict
+        """
+        resp = await self.backend.request(method, paramsdict, timeout)
+
+        if resp is None:
+            logging.error(f'RPC {method}: resp is None!')
+            return None
+
+        # FIXME parse out status?
+        if 'result' not in resp:
+            logging.error(f'RPC {method}: error in response {resp}!')
+            return None
+
+        return resp['result']
+
+    async def get_scalar_value(self, value_method, value_key, value_types):
+        result = await self.request(value_method)
+        if result is None:
+            return None
+
+        result_value = result.get(value_key, None)
+
+        if not isinstance(result_value, tuple(value_types)):
+            logging.error(f'get_scalar_type: {value_method} {value_key}: '
+                          f'expected one of {value_types} got {result_value} '
+                          f'type {type(result_value)}')
+            return None
+
+        return result_value
+
+    async def set_scalar_value(self, value_method, value_key, value):
+        paramdict = {}
+        if value_key is not None:
+            paramdict['params'] = {value_key: value}
+
+        #FIXME need to look at result code
+        return await self.request(value_method, paramdict) is not None
+
+    async def send_command(self, command, params={}):
+        paramdict = {'params': dict(params)}
+
+        #FIXME need to look at result code
+        return await self.request(command, paramdict) is not None
+
+    async def get_list_value(self, value_method, value_key):
+        return await self.get_scalar_value(value_method, value_key, (list,))
@@ -0,0 +1,341 @@
+#
+# RPC asyncio device backend
+#
+# Copyright 2020 Michael Fulbright
+#
+#
+#    pyastrobackend is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+""" RPC solution using asyncio """
+
+import json
+import asyncio
+import logging
+import itertools
+
+from pyastrobackend.RPCAsync.Camera import Camera
+from pyastrobackend.RPCAsync.Focuser import Focuser
+from pyastrobackend.RPCAsync.FilterWheel import FilterWheel
+from pyastrobackend.RPCAsync.Mount import Mount
+
+# longest JSON message accepted from the server
+DEFAULT_MAX_MESSAGE_SIZE = 16*1024*1024
+
+# event sent to event iterators when the connection to the server is lost
+EVENT_DISCONNECTED = {'Event': 'Disconnected'}
+
+
+class DeviceBackend:
+    """
+    RPC backend for use from an asyncio event loop.
+
+    Same interface as :class:`pyastrobackend.RPCBackend.DeviceBackend`
+    except every method which talks to the server is a coroutine.  All
+    devices share one stream connection to the server.  Each request waits
+    on a future of its own so any number can be outstanding without a
+    thread per request, and it can run in the same event loop as other
+    asyncio code.
+
+    If the connection is lost everyone waiting on a response gets None and
+    the backend keeps trying to reconnect until :meth:`disconnect` is
+    called.
+
+    :param host: Address of RPC server.
+    :type host: str
+    :param port: Port of RPC server.
+    :type port: int
+    :param response_timeout: Default seconds to wait for a response.
+    :type response_timeout: float
+    :param reconnect_interval: Seconds between attempts to connect.
+    :type reconnect_interval: float
+    :param max_message_size: Longest JSON message accepted from server.
+    :type max_message_size: int
+    """
+
+    def __init__(self, host='127.0.0.1', port=8800, response_timeout=90,
+                 reconnect_interval=5, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+
+        self.host = host
+        self.port = port
+        self.response_timeout = response_timeout
+        self.reconnect_interval = reconnect_interval
+        self.max_message_size = max_message_size
+
+        self._request_ids = itertools.count(1)
+
+        # maps request id to future completed with response dict
+        self._requests = {}
+
+        # one queue per event iterator
+        self._event_queues = []
+
+        self._writer = None
+        self._task = None
+        self._server_connected = None
+
+        self.connected = False
+
+    def name(self):
+        return 'RPC'
+
+    async def connect(self, timeout=None):
+        """
+        Start connecting to server and wait until connected.
+
+        :param timeout: Maximum seconds to wait or None to wait forever.
+        :type timeout: float
+        :return: True if connected.
+        :rtype: bool
+        """
+        if self._task is None:
+            self._server_connected = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+        self.connected = await self.wait_connected(timeout)
+        return self.connected
+
+    async def disconnect(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # tell event iterators there will be no more events
+        for queue in self._event_queues:
+            queue.put_nowait(None)
+
+        self.connected = False
+        return True
+
+    def isConnected(self):
+        return self.connected
+
+    async def wait_connected(self, timeout=None):
+        """
+        Wait until connected to the server.
+
+        :param timeout: Maximum seconds to wait or None to wait forever.
+        :type timeout: float
+        :return: True if connected.
+        :rtype: bool
+        """
+        if self._server_connected is None:
+            logging.error('RPC async backend used before connect()!')
+            return False
+
+        try:
+            await asyncio.wait_for(self._server_connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f'Timed out connecting to RPC server '
+                          f'{self.host}:{self.port}')
+            return False
+
+        return True
+
+    def newCamera(self):
+        return Camera(self)
+
+    def newFocuser(self):
+        return Focuser(self)
+
+    def newFilterWheel(self):
+        return FilterWheel(self)
+
+    def newMount(self):
+        return Mount(self)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(
+                                           self.host, self.port,
+                                           limit=self.max_message_size)
+            except OSError as err:
+                logging.error(f'Failed to connect to RPC server '
+                              f'{self.host}:{self.port}: {err}')
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            logging.info(f'Connected to RPC server {self.host}:{self.port}')
+
+            try:
+                await self._read_messages(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as err:
+                # ValueError is raised if a message is over max_message_size
+                logging.error(f'RPC server connection lost: {err}')
+            finally:
+                self._server_disconnected()
+
+    async def _read_messages(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                logging.error('RPC server closed connection!')
+                return
+
+            # skip anything before the start of the JSON block
+            json_start = line.find(b'{')
+            if json_start < 0:
+                continue
+
+            # if we get garbage json string dont die
+            try:
+                jdict = json.loads(line[json_start:])
+            except ValueError:
+                logging.error(f'Error decoding {line}!', exc_info=True)
+                continue
+
+            req_id = jdict.get('id', None)
+            event = jdict.get('Event', None)
+            if req_id is not None:
+                self._complete_request(req_id, jdict)
+            elif event is not None:
+                if event == 'Connection':
+                    self._server_connected.set()
+                self._emit(jdict)
+            else:
+                logging.warning(f'RPCClient: received JSON {jdict} '
+                                'with no event or id!')
+
+    def _server_disconnected(self):
+        self._server_connected.clear()
+
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        # requests went out on connection that is gone
+        requests = self._requests
+        self._requests = {}
+        for future in requests.values():
+            if not future.done():
+                future.set_result(None)
+
+        self._emit(EVENT_DISCONNECTED)
+
+    def _complete_request(self, req_id, resp):
+        future = self._requests.get(req_id)
+        if future is None or future.done():
+            # nobody waiting - most likely the wait timed out
+            logging.warning(f'RPCClient: dropping response for unknown '
+                            f'request id {req_id}')
+            return
+
+        future.set_result(resp)
+
+    def _emit(self, event):
+        for queue in self._event_queues:
+            queue.put_nowait(event)
+
+    async def events(self):
+        """
+        Events sent by the server.
+
+        Use as an async iterator - each event is the dictionary received
+        from the server.  A {'Event': 'Disconnected'} event is given when
+        the connection is lost and iteration ends when :meth:`disconnect`
+        is called.
+        """
+        queue = asyncio.Queue()
+        self._event_queues.append(queue)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self._event_queues.remove(queue)
+
+    async def send_request(self, method, paramsdict=None):
+        """
+        Send request to server without waiting for the response.
+
+        :param method: RPC method.
+        :type method: str
+        :param paramsdict: Extra keys for request such as 'params'.
+        :type paramsdict: dict
+        :return: Request id to pass to :meth:`wait_for_response` or None if
+                 not connected.
+        :rtype: int
+        """
+        if self._writer is None or not self._server_connected.is_set():
+            logging.error(f'send_request: {method} - not connected!')
+            return None
+
+        req_id = next(self._request_ids)
+        jdict = {'method': method, 'id': req_id}
+        if paramsdict is not None:
+            jdict.update(paramsdict)
+
+        # register before sending so the response can never arrive before
+        # there is an entry for it
+        self._requests[req_id] = asyncio.get_running_loop().create_future()
+
+        try:
+            self._writer.write(json.dumps(jdict).encode() + b'\n')
+            await self._writer.drain()
+        except ConnectionError as err:
+            logging.error(f'send_request: {method} failed: {err}')
+            self._requests.pop(req_id, None)
+            return None
+
+        return req_id
+
+    async def wait_for_response(self, req_id, timeout=-1):
+        """
+        Wait for response to request sent with :meth:`send_request`.
+
+        :param timeout: Maximum seconds to wait, None to wait forever or
+                        -1 for response_timeout.
+        :type timeout: float
+        :return: Response dict or None on timeout or if connection lost.
+        :rtype: dict
+        """
+        future = self._requests.get(req_id)
+        if future is None:
+            logging.error(f'wait_for_response: unknown request id '
+                          f'{req_id}!')
+            return None
+
+        if timeout == -1:
+            timeout = self.response_timeout
+
+        try:
+            # shield so a timeout does not cancel the future while it is
+            # still in the table
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f'RPC wait for request id {req_id} timed out!')
+            return None
+        finally:
+            if self._requests.get(req_id) is future:
+                del self._requests[req_id]
+
+    async def request(self, method, paramsdict=None, timeout=-1):
+        """
+        Send request to server and wait for the response.
+
+        :return: Response dict or None on error, timeout or if connection
+                 lost.
+        :rtype: dict
+        """
+        req_id = await self.send_request(method, paramsdict)
+        if req_id is None:
+            return None
+
+        return await self.wait_for_response(req_id, timeout)
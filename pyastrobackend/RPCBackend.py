@@ -25,12 +25,18 @@ from pyastrobackend.RPC.Camera import Camera as RPC_Camera
 from pyastrobackend.RPC.Focuser import Focuser as RPC_Focuser
 from pyastrobackend.RPC.Mount import Mount as RPC_Mount
 from pyastrobackend.RPC.FilterWheel import FilterWheel as RPC_FilterWheel
+from pyastrobackend.RPC.RPCDeviceBase import RPCConnectionManager
 
 class DeviceBackend(BaseDeviceBackend):
 
-    def __init__(self, mainThread=True):
+    def __init__(self, mainThread=True, port=8800, host='127.0.0.1'):
         self.connected = False
 
+        # all devices from this backend talk to the server over one
+        # connection which is opened by the first device to connect and
+        # closed when the last disconnects
+        self.rpc_connection = RPCConnectionManager(port, host)
+
     def name(self):
         return 'RPC'
 
@@ -39,7 +45,8 @@ class DeviceBackend(BaseDeviceBackend):
         return True
 
     def disconnect(self):
-        pass
+        self.rpc_connection.close()
+        self.connected = False
 
     def isConnected(self):
         return self.connected
@@ -25,6 +25,10 @@ import astropy.io.fits as pyfits
 
 from pyastrobackend.BackendConfig import get_backend_for_os, get_backend
 
+# seconds take_exposure() waits for an image after the exposure should
+# have ended before giving up
+IMAGE_READOUT_TIMEOUT = 120
+
 
 class SimpleDeviceInterface:
     def __init__(self):
@@ -297,23 +301,32 @@ class SimpleDeviceInterface:
         """
 
         # reset frame to desired roi
-        cam.set_binning(1, 1)
-
         if roi is None:
             width, height = cam.get_size()
-            cam.set_frame(0, 0, width, height)
+            roi = (0, 0, width, height)
+
+        if hasattr(cam, 'configure'):
+            # only sends what changed since last exposure
+            cam.configure(binning=(1, 1), roi=roi)
         else:
+            cam.set_binning(1, 1)
             cam.set_frame(roi[0], roi[1], roi[2], roi[3])
 
         cam.start_exposure(exposure)
 
-        elapsed = 0
-        while (exposure - elapsed > 2) or not cam.check_exposure():
-            logging.debug(f"Taking image with camera {elapsed} of {exposure} seconds")
-            time.sleep(0.25)
-            elapsed += 0.25
-            if elapsed > exposure:
-                elapsed = exposure
+        if hasattr(cam, 'wait_for_image'):
+            # camera knows how to wait efficiently
+            if not cam.wait_for_image(timeout=IMAGE_READOUT_TIMEOUT):
+                logging.error('Error waiting for exposure to complete!')
+                return False
+        else:
+            elapsed = 0
+            while (exposure - elapsed > 2) or not cam.check_exposure():
+                logging.debug(f"Taking image with camera {elapsed} of {exposure} seconds")
+                time.sleep(0.25)
+                elapsed += 0.25
+                if elapsed > exposure:
+                    elapsed = exposure
 
         logging.debug('Exposure complete')
 
@@ -59,12 +59,13 @@ setup(
                       'astropy>=3.1.0',
                       'numpy>=1.11.0',
                       'pycurl >=7.40',
+                      'requests>=2.20.0',
                       'pyindi-client>=0.2.3;platform_system=="Linux"',
                       'comtypes;platform_system=="Windows"',
                       'win32com;platform_system=="Windows"'
                      ],  # Optional
 
-    extras_require={}, # Optional
+    extras_require={'async': ['aiohttp>=3.6']}, # Optional
 
     setup_requires=[],
 
@@ -0,0 +1,213 @@
+"""
+Alpaca client throughput benchmarks.
+
+Measures property request rate, image download speed and end to end
+exposure to image array time for each ImageArray transfer mode.  Runs
+against a simulator started in process unless --host is given.
+
+    python alpaca_benchmark.py --width 4656 --height 3520 --save base.json
+    python alpaca_benchmark.py --width 4656 --height 3520 --compare base.json
+
+With --compare the exit status is 1 if any result is more than
+--tolerance worse than the saved one.
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from pyastrobackend.AlpacaBackend import DeviceBackend as Backend
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_IMAGEBYTES
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64JSON
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_BASE64HANDOFF
+from pyastrobackend.Alpaca.AlpacaImage import IMAGE_MODE_JSON
+
+from alpaca_simulator_server import AlpacaSimulatorServer
+
+IMAGE_MODES = {'imagebytes': IMAGE_MODE_IMAGEBYTES,
+               'base64json': IMAGE_MODE_BASE64JSON,
+               'base64handoff': IMAGE_MODE_BASE64HANDOFF,
+               'json': IMAGE_MODE_JSON}
+
+# properties read by the threaded request rate test - all different so
+# none are coalesced
+POLL_PROPS = ['camerastate', 'ccdtemperature', 'coolerpower',
+              'heatsinktemperature', 'imageready', 'percentcompleted',
+              'cooleron', 'gain']
+
+
+def bench_property_rate(backend, nreq, threads):
+    """
+    Returns sequential and concurrent property reads per second.
+    """
+    results = {}
+
+    ts = time.perf_counter()
+    for _ in range(nreq):
+        backend.get_prop('camera', 0, 'gain')
+    results['property_seq_per_sec'] = nreq / (time.perf_counter() - ts)
+
+    def worker(i):
+        prop = POLL_PROPS[i % len(POLL_PROPS)]
+        for _ in range(nreq // threads):
+            backend.get_prop('camera', 0, prop)
+
+    ts = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    total = (nreq // threads) * threads
+    results['property_threaded_per_sec'] = total / (time.perf_counter() - ts)
+
+    return results
+
+
+def bench_image_mode(backend, camera, mode_name, frames):
+    """
+    Returns image download MB/s and seconds per frame from start of
+    exposure to image array for one transfer mode.
+    """
+    transport = backend.get_transport()
+
+    download_times = []
+    end_to_end_times = []
+    wire_bytes = 0
+    shape = None
+    for _ in range(frames):
+        # mode is remembered per server after the first image so set it
+        # to skip the probe
+        transport.image_transfer_mode = IMAGE_MODES[mode_name]
+
+        ts = time.perf_counter()
+        if not camera.start_exposure(0) or not camera.wait_for_image(10):
+            logging.error(f'{mode_name}: exposure failed')
+            return None
+
+        stats = transport.transfer_stats.get_stats()
+        td = time.perf_counter()
+        image = camera.get_image_data()
+        te = time.perf_counter()
+        if image is None:
+            logging.error(f'{mode_name}: get_image_data failed')
+            return None
+
+        wire_bytes += transport.transfer_stats.get_stats()['wire_bytes'] \
+            - stats['wire_bytes']
+        shape = image.shape
+        download_times.append(te - td)
+        end_to_end_times.append(te - ts)
+
+    logging.info(f'{mode_name}: image shape {shape}')
+    return {f'{mode_name}_download_mb_per_sec':
+            wire_bytes / sum(download_times) / 1e6,
+            f'{mode_name}_get_image_data_sec':
+            statistics.median(download_times),
+            f'{mode_name}_end_to_end_sec':
+            statistics.median(end_to_end_times)}
+
+
+def higher_is_better(name):
+    return name.endswith('_per_sec')
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print change from baseline of each result.
+
+    :return: True if no result is worse than baseline by over tolerance.
+    :rtype: bool
+    """
+    ok = True
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (value - base) / base
+        worse = -change if higher_is_better(name) else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            ok = False
+        print(f'{name:40s} {base:12.3f} -> {value:12.3f} '
+              f'{change:+7.1%}{flag}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Alpaca client benchmarks')
+    parser.add_argument('--host', help='Use Alpaca server at this address '
+                        'instead of the simulator')
+    parser.add_argument('--port', type=int, default=11111)
+    parser.add_argument('--width', type=int, default=2048,
+                        help='Simulated camera width')
+    parser.add_argument('--height', type=int, default=1536,
+                        help='Simulated camera height')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Simulated per request latency in seconds')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Property reads per request rate test')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Threads for concurrent request rate test')
+    parser.add_argument('--frames', type=int, default=5,
+                        help='Images downloaded per transfer mode')
+    parser.add_argument('--modes', nargs='+', default=list(IMAGE_MODES),
+                        choices=list(IMAGE_MODES))
+    parser.add_argument('--save', help='Write results to JSON file')
+    parser.add_argument('--compare', help='Compare with results in JSON '
+                        'file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fraction a result may be worse than baseline')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+
+    sim = None
+    if args.host is None:
+        sim = AlpacaSimulatorServer('127.0.0.1', 0, args.width, args.height,
+                                    latency=args.latency).start()
+        host, port = sim.host, sim.port
+    else:
+        host, port = args.host, args.port
+
+    backend = Backend(host, port)
+    backend.connect()
+
+    camera = backend.newCamera()
+    if not camera.connect('ALPACA:camera:0') \
+       or not camera.set_prop('connected', {'Connected': True}):
+        logging.error('Failed to connect to camera!')
+        sys.exit(1)
+
+    results = {}
+
+    logging.info('Measuring property request rate')
+    results.update(bench_property_rate(backend, args.requests, args.threads))
+
+    for mode_name in args.modes:
+        logging.info(f'Measuring {mode_name} image transfer')
+        mode_results = bench_image_mode(backend, camera, mode_name,
+                                        args.frames)
+        if mode_results is None:
+            sys.exit(1)
+        results.update(mode_results)
+
+    backend.disconnect()
+    if sim is not None:
+        sim.stop()
+
+    for name, value in results.items():
+        print(f'{name:40s} {value:12.3f}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,729 @@
+"""
+Stand-in Alpaca server for testing and benchmarking without hardware.
+
+Serves a camera, focuser, filter wheel and telescope on the Alpaca device
+API, the management API and optionally UDP discovery.  The camera sends
+ImageArray as ImageBytes, base64json, base64 handoff or plain JSON
+depending on what the client asks for and which modes are enabled.
+
+Run directly to serve on 127.0.0.1:11111 so the other tests in this
+directory work unchanged:
+
+    python alpaca_simulator_server.py --width 4656 --height 3520
+
+or import AlpacaSimulatorServer to run one inside a test.
+"""
+import json
+import time
+import base64
+import socket
+import struct
+import logging
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+# Alpaca error numbers
+ERROR_OK = 0
+ERROR_NOT_IMPLEMENTED = 0x400
+ERROR_INVALID_VALUE = 0x401
+ERROR_VALUE_NOT_SET = 0x402
+ERROR_NOT_CONNECTED = 0x407
+ERROR_INVALID_OPERATION = 0x40B
+
+IMAGE_MODES = ('imagebytes', 'base64json', 'base64handoff', 'json')
+
+IMAGEBYTES_MIME_TYPE = 'application/imagebytes'
+
+# camera states
+CAMERA_IDLE = 0
+CAMERA_EXPOSING = 2
+
+
+class AlpacaError(Exception):
+    def __init__(self, error_number, message):
+        super().__init__(message)
+        self.error_number = error_number
+        self.message = message
+
+
+def _param(params, name, convert=str):
+    # Alpaca parameter names are case insensitive
+    for key, value in params.items():
+        if key.lower() == name.lower():
+            try:
+                if convert is bool:
+                    return value.lower() == 'true'
+                return convert(value)
+            except ValueError:
+                raise AlpacaError(ERROR_INVALID_VALUE,
+                                  f'Bad value {value} for {name}')
+    raise AlpacaError(ERROR_INVALID_VALUE, f'Missing parameter {name}')
+
+
+class SimulatedDevice:
+    device_type = None
+
+    # properties read from self.props and writable with same name
+    read_props = ()
+    write_props = {}
+
+    def __init__(self, device_number, name):
+        self.device_number = device_number
+        self.name = name
+        self.lock = threading.Lock()
+        self.connected = False
+        self.props = {}
+
+    def description(self):
+        return {'DeviceName': self.name,
+                'DeviceType': self.device_type.capitalize(),
+                'DeviceNumber': self.device_number,
+                'UniqueID': f'pyastrobackend-sim-{self.device_type}-'
+                            f'{self.device_number}'}
+
+    def get(self, prop, params):
+        if prop == 'connected':
+            return self.connected
+        if prop == 'name':
+            return self.name
+        if prop == 'description':
+            return f'Simulated {self.device_type}'
+        if prop in ('driverinfo', 'driverversion'):
+            return 'pyastrobackend simulator 1.0'
+        if prop == 'interfaceversion':
+            return 3
+        if prop == 'supportedactions':
+            return []
+
+        if not self.connected:
+            raise AlpacaError(ERROR_NOT_CONNECTED, 'Device not connected')
+
+        if prop == 'devicestate':
+            return [{'Name': k, 'Value': v}
+                    for k, v in self.device_state().items()]
+
+        getter = getattr(self, f'get_{prop}', None)
+        if getter is not None:
+            return getter(params)
+
+        if prop in self.read_props:
+            return self.props[prop]
+
+        raise AlpacaError(ERROR_NOT_IMPLEMENTED, f'{prop} not implemented')
+
+    def put(self, prop, params):
+        if prop == 'connected':
+            self.connected = _param(params, 'Connected', bool)
+            return
+
+        if not self.connected:
+            raise AlpacaError(ERROR_NOT_CONNECTED, 'Device not connected')
+
+        setter = getattr(self, f'put_{prop}', None)
+        if setter is not None:
+            return setter(params)
+
+        if prop in self.write_props:
+            name, convert = self.write_props[prop]
+            self.props[prop] = _param(params, name, convert)
+            return
+
+        raise AlpacaError(ERROR_NOT_IMPLEMENTED, f'{prop} not implemented')
+
+    def device_state(self):
+        return {'TimeStamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+class SimulatedCamera(SimulatedDevice):
+    device_type = 'camera'
+
+    read_props = ('binx', 'biny', 'startx', 'starty', 'numx', 'numy',
+                  'cameraxsize', 'cameraysize', 'maxbinx', 'maxbiny',
+                  'maxadu', 'pixelsizex', 'pixelsizey', 'gain',
+                  'electronsperadu', 'exposuremin', 'exposuremax',
+                  'cooleron', 'setccdtemperature', 'ccdtemperature',
+                  'heatsinktemperature', 'coolerpower', 'sensortype',
+                  'canabortexposure', 'canstopexposure', 'hasshutter',
+                  'ispulseguiding', 'readoutmode', 'readoutmodes')
+    write_props = {'binx': ('BinX', int), 'biny': ('BinY', int),
+                   'startx': ('StartX', int), 'starty': ('StartY', int),
+                   'numx': ('NumX', int), 'numy': ('NumY', int),
+                   'gain': ('Gain', int),
+                   'cooleron': ('CoolerOn', bool),
+                   'setccdtemperature': ('SetCCDTemperature', float),
+                   'readoutmode': ('ReadoutMode', int)}
+
+    def __init__(self, device_number, width, height, maxadu=65535):
+        super().__init__(device_number, 'Simulated Camera')
+        self.props = {'binx': 1, 'biny': 1, 'startx': 0, 'starty': 0,
+                      'numx': width, 'numy': height,
+                      'cameraxsize': width, 'cameraysize': height,
+                      'maxbinx': 4, 'maxbiny': 4, 'maxadu': maxadu,
+                      'pixelsizex': 3.76, 'pixelsizey': 3.76, 'gain': 100,
+                      'electronsperadu': 0.8, 'exposuremin': 0.0001,
+                      'exposuremax': 3600.0, 'cooleron': False,
+                      'setccdtemperature': -10.0, 'ccdtemperature': 20.0,
+                      'heatsinktemperature': 22.0, 'coolerpower': 0.0,
+                      'sensortype': 0, 'canabortexposure': True,
+                      'canstopexposure': True, 'hasshutter': False,
+                      'ispulseguiding': False, 'readoutmode': 0,
+                      'readoutmodes': ['Normal']}
+
+        self.exposure_start = None
+        self.exposure_duration = None
+
+        # image of last exposure in wire order (x first) and its encodings
+        # - every exposure of a given size returns the same frame so
+        # encodings are kept until the size changes
+        self.image = None
+        self.image_cache = {}
+
+        # noise frame per size so a new exposure costs no random numbers
+        self._frames = {}
+
+    def _frame(self, numx, numy):
+        frame = self._frames.get((numx, numy))
+        if frame is None:
+            rng = np.random.default_rng(numx * 100003 + numy)
+            maxadu = self.props['maxadu']
+            frame = rng.integers(0, min(maxadu, 2**31-1) + 1,
+                                 size=(numx, numy), dtype=np.int32)
+            self._frames = {(numx, numy): frame}
+        return frame
+
+    def _exposure_done(self):
+        if self.exposure_start is None:
+            return False
+        return time.monotonic() - self.exposure_start >= self.exposure_duration
+
+    def get_camerastate(self, params):
+        if self.exposure_start is not None and not self._exposure_done():
+            return CAMERA_EXPOSING
+        return CAMERA_IDLE
+
+    def get_imageready(self, params):
+        return self._exposure_done()
+
+    def get_percentcompleted(self, params):
+        if self.exposure_start is None:
+            return 100
+        if self.exposure_duration <= 0:
+            return 100
+        elapsed = time.monotonic() - self.exposure_start
+        return int(min(100, 100 * elapsed / self.exposure_duration))
+
+    def device_state(self):
+        return {'CameraState': self.get_camerastate(None),
+                'CCDTemperature': self.props['ccdtemperature'],
+                'CoolerPower': self.props['coolerpower'],
+                'HeatSinkTemperature': self.props['heatsinktemperature'],
+                'ImageReady': self.get_imageready(None),
+                'IsPulseGuiding': False,
+                'PercentCompleted': self.get_percentcompleted(None),
+                **super().device_state()}
+
+    def put_startexposure(self, params):
+        duration = _param(params, 'Duration', float)
+        if duration < 0:
+            raise AlpacaError(ERROR_INVALID_VALUE, 'Negative duration')
+        numx, numy = self.props['numx'], self.props['numy']
+        if self.props['startx'] + numx > self.props['cameraxsize'] \
+           // self.props['binx'] \
+           or self.props['starty'] + numy > self.props['cameraysize'] \
+           // self.props['biny']:
+            raise AlpacaError(ERROR_INVALID_VALUE, 'Frame outside sensor')
+        frame = self._frame(numx, numy)
+        if frame is not self.image:
+            self.image_cache = {}
+        self.image = frame
+        self.exposure_duration = duration
+        self.exposure_start = time.monotonic()
+
+    def put_abortexposure(self, params):
+        self.exposure_start = None
+
+    put_stopexposure = put_abortexposure
+
+    def image_metadata(self):
+        numx, numy = self.image.shape
+        return {'Type': 2, 'Rank': 2, 'Dimension0Length': numx,
+                'Dimension1Length': numy, 'Dimension2Length': 0}
+
+    def encoded_image(self, mode):
+        """
+        Returns the image encoded for transfer mode - encodings are kept
+        so repeated downloads measure the client, not the simulator.
+        """
+        if not self.get_imageready(None):
+            raise AlpacaError(ERROR_INVALID_OPERATION, 'No image available')
+
+        body = self.image_cache.get(mode)
+        if body is not None:
+            return body
+
+        image = self.image
+        if mode == 'imagebytes':
+            if self.props['maxadu'] <= 65535:
+                wire, wire_type = image.astype('<u2'), 8
+            else:
+                wire, wire_type = image.astype('<i4'), 2
+            header = struct.pack('<iiIIiiiiiii', 1, 0, 0, 0, 44, 2,
+                                 wire_type, 2, *image.shape, 0)
+            body = header + wire.tobytes()
+        elif mode == 'base64json':
+            value = base64.b64encode(image.astype('<i4').tobytes()).decode()
+            body = json.dumps({**self.image_metadata(), 'Value': value,
+                               'ErrorNumber': 0, 'ErrorMessage': ''}).encode()
+        elif mode == 'base64handoff':
+            body = json.dumps({**self.image_metadata(), 'ErrorNumber': 0,
+                               'ErrorMessage': ''}).encode()
+        elif mode == 'imagearraybase64':
+            body = base64.b64encode(image.astype('<i4').tobytes())
+        else:
+            body = json.dumps({**self.image_metadata(),
+                               'Value': image.tolist(), 'ErrorNumber': 0,
+                               'ErrorMessage': ''}).encode()
+
+        self.image_cache[mode] = body
+        return body
+
+
+class SimulatedFocuser(SimulatedDevice):
+    device_type = 'focuser'
+
+    read_props = ('maxstep', 'maxincrement', 'absolute', 'temperature',
+                  'tempcomp', 'tempcompavailable', 'stepsize')
+
+    # steps moved per second
+    speed = 5000
+
+    def __init__(self, device_number):
+        super().__init__(device_number, 'Simulated Focuser')
+        self.props = {'maxstep': 100000, 'maxincrement': 100000,
+                      'absolute': True, 'temperature': 15.0,
+                      'tempcomp': False, 'tempcompavailable': False,
+                      'stepsize': 1.0}
+        self._start_pos = 50000
+        self._target = 50000
+        self._move_start = 0
+
+    def _position(self):
+        moved = (time.monotonic() - self._move_start) * self.speed
+        if abs(self._target - self._start_pos) <= moved:
+            return self._target
+        step = moved if self._target > self._start_pos else -moved
+        return int(self._start_pos + step)
+
+    def get_position(self, params):
+        return self._position()
+
+    def get_ismoving(self, params):
+        return self._position() != self._target
+
+    def put_move(self, params):
+        target = _param(params, 'Position', int)
+        if not 0 <= target <= self.props['maxstep']:
+            raise AlpacaError(ERROR_INVALID_VALUE, 'Position out of range')
+        self._start_pos = self._position()
+        self._target = target
+        self._move_start = time.monotonic()
+
+    def put_halt(self, params):
+        self._start_pos = self._target = self._position()
+
+    def device_state(self):
+        return {'IsMoving': self.get_ismoving(None),
+                'Position': self._position(),
+                'Temperature': self.props['temperature'],
+                **super().device_state()}
+
+
+class SimulatedFilterWheel(SimulatedDevice):
+    device_type = 'filterwheel'
+
+    read_props = ('names', 'focusoffsets')
+
+    # seconds to move to a new filter
+    move_time = 0.5
+
+    def __init__(self, device_number):
+        super().__init__(device_number, 'Simulated Filter Wheel')
+        self.props = {'names': ['L', 'R', 'G', 'B', 'Ha', 'OIII', 'SII'],
+                      'focusoffsets': [0] * 7}
+        self._position = 0
+        self._move_end = 0
+
+    def get_position(self, params):
+        # Alpaca reports -1 while moving
+        if time.monotonic() < self._move_end:
+            return -1
+        return self._position
+
+    def put_position(self, params):
+        pos = _param(params, 'Position', int)
+        if not 0 <= pos < len(self.props['names']):
+            raise AlpacaError(ERROR_INVALID_VALUE, 'Position out of range')
+        if pos != self._position:
+            self._position = pos
+            self._move_end = time.monotonic() + self.move_time
+
+    def device_state(self):
+        return {'Position': self.get_position(None),
+                **super().device_state()}
+
+
+class SimulatedTelescope(SimulatedDevice):
+    device_type = 'telescope'
+
+    read_props = ('tracking', 'atpark', 'athome', 'canpark', 'canunpark',
+                  'cansync', 'canslew', 'canslewasync', 'cansettracking',
+                  'sideofpier', 'ispulseguiding', 'trackingrate',
+                  'alignmentmode', 'equatorialsystem')
+    write_props = {'tracking': ('Tracking', bool)}
+
+    # seconds any slew takes
+    slew_time = 2.0
+
+    def __init__(self, device_number):
+        super().__init__(device_number, 'Simulated Telescope')
+        self.props = {'tracking': False, 'atpark': False, 'athome': False,
+                      'canpark': True, 'canunpark': True, 'cansync': True,
+                      'canslew': True, 'canslewasync': True,
+                      'cansettracking': True, 'sideofpier': 0,
+                      'ispulseguiding': False, 'trackingrate': 0,
+                      'alignmentmode': 2, 'equatorialsystem': 1}
+        self._ra = 0.0
+        self._dec = 0.0
+        self._slew_end = 0
+
+    def get_rightascension(self, params):
+        return self._ra
+
+    def get_declination(self, params):
+        return self._dec
+
+    def get_altitude(self, params):
+        return 45.0
+
+    def get_azimuth(self, params):
+        return 180.0
+
+    def get_siderealtime(self, params):
+        return (time.time() / 3600 * 1.0027379) % 24
+
+    def get_slewing(self, params):
+        return time.monotonic() < self._slew_end
+
+    def _check_unparked(self):
+        if self.props['atpark']:
+            raise AlpacaError(ERROR_INVALID_OPERATION, 'Telescope is parked')
+
+    def _coordinates(self, params):
+        ra = _param(params, 'RightAscension', float)
+        dec = _param(params, 'Declination', float)
+        if not (0 <= ra < 24 and -90 <= dec <= 90):
+            raise AlpacaError(ERROR_INVALID_VALUE, 'Coordinates out of range')
+        return ra, dec
+
+    def put_slewtocoordinatesasync(self, params):
+        self._check_unparked()
+        self._ra, self._dec = self._coordinates(params)
+        self._slew_end = time.monotonic() + self.slew_time
+
+    def put_slewtocoordinates(self, params):
+        self.put_slewtocoordinatesasync(params)
+        time.sleep(self.slew_time)
+
+    def put_synctocoordinates(self, params):
+        self._check_unparked()
+        self._ra, self._dec = self._coordinates(params)
+
+    def put_abortslew(self, params):
+        self._slew_end = 0
+
+    def put_park(self, params):
+        self.props['atpark'] = True
+        self.props['tracking'] = False
+        self._slew_end = 0
+
+    def put_unpark(self, params):
+        self.props['atpark'] = False
+
+    def device_state(self):
+        return {'RightAscension': self._ra, 'Declination': self._dec,
+                'Slewing': self.get_slewing(None),
+                'Tracking': self.props['tracking'],
+                'AtPark': self.props['atpark'],
+                **super().device_state()}
+
+
+class AlpacaSimulatorServer:
+    """
+    Alpaca server with one simulated device of each type, all number 0.
+
+    :param host: Address to listen on.
+    :type host: str
+    :param port: Port to listen on - 0 picks a free port.
+    :type port: int
+    :param width: Camera sensor width in pixels.
+    :type width: int
+    :param height: Camera sensor height in pixels.
+    :type height: int
+    :param maxadu: Camera maximum pixel value.
+    :type maxadu: int
+    :param latency: Seconds each request is delayed before it is answered.
+    :type latency: float
+    :param image_modes: ImageArray transfer modes to support, any of
+                        'imagebytes', 'base64json', 'base64handoff' and
+                        'json'.  Plain JSON is always used as a fallback.
+    :type image_modes: tuple
+    :param discovery_port: UDP port to answer discovery on or None.
+    :type discovery_port: int
+    """
+
+    def __init__(self, host='127.0.0.1', port=11111, width=1024, height=768,
+                 maxadu=65535, latency=0.0, image_modes=IMAGE_MODES,
+                 discovery_port=None):
+        self.latency = latency
+        self.image_modes = tuple(image_modes)
+        self.discovery_port = discovery_port
+
+        self.devices = {
+            ('camera', 0): SimulatedCamera(0, width, height, maxadu),
+            ('focuser', 0): SimulatedFocuser(0),
+            ('filterwheel', 0): SimulatedFilterWheel(0),
+            ('telescope', 0): SimulatedTelescope(0)
+        }
+
+        self.request_count = 0
+        self._server_transaction_id = 0
+        self._count_lock = threading.Lock()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+
+        self._threads = []
+        self._udp = None
+
+    def _next_transaction(self):
+        with self._count_lock:
+            self.request_count += 1
+            self._server_transaction_id += 1
+            return self._server_transaction_id
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # headers and body go out in separate writes so without this
+            # every response waits on the client delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                logging.debug(f'simulator: {format % args}')
+
+            def _send(self, body, content_type='application/json',
+                      status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, value=None, error_number=ERROR_OK,
+                           message='', client_tid=0, server_tid=0,
+                           has_value=True):
+                resp = {'ClientTransactionID': client_tid,
+                        'ServerTransactionID': server_tid,
+                        'ErrorNumber': error_number,
+                        'ErrorMessage': message}
+                if has_value:
+                    resp['Value'] = value
+                self._send(json.dumps(resp).encode())
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if method == 'PUT':
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = self.rfile.read(length).decode()
+                    params.update({k: v[-1]
+                                   for k, v in parse_qs(body).items()})
+
+                server_tid = server._next_transaction()
+                try:
+                    client_tid = int(_param(params, 'ClientTransactionID'))
+                except (AlpacaError, ValueError):
+                    client_tid = 0
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                fields = url.path.strip('/').split('/')
+                if fields[0] == 'management':
+                    return self._management(fields, client_tid, server_tid)
+
+                if len(fields) != 5 or fields[0] != 'api':
+                    return self._send(b'Not found', 'text/plain', 404)
+
+                _, _, device_type, device_number, prop = fields
+                prop = prop.lower()
+                try:
+                    device = server.devices[(device_type.lower(),
+                                             int(device_number))]
+                except (KeyError, ValueError):
+                    return self._send(b'No such device', 'text/plain', 404)
+
+                try:
+                    with device.lock:
+                        if method == 'PUT':
+                            device.put(prop, params)
+                            return self._send_json(client_tid=client_tid,
+                                                   server_tid=server_tid,
+                                                   has_value=False)
+
+                        if prop in ('imagearray', 'imagearraybase64') \
+                           and device_type == 'camera':
+                            image = self._image(device, prop)
+                        else:
+                            image = None
+                            value = device.get(prop, params)
+                except AlpacaError as err:
+                    return self._send_json(error_number=err.error_number,
+                                           message=err.message,
+                                           client_tid=client_tid,
+                                           server_tid=server_tid,
+                                           has_value=False)
+
+                # send images outside the lock so polling carries on
+                # during a download
+                if image is not None:
+                    return self._send(*image)
+
+                self._send_json(value, client_tid=client_tid,
+                                server_tid=server_tid)
+
+            def _image(self, camera, prop):
+                # returns body and content type to send
+                if prop == 'imagearraybase64':
+                    return (camera.encoded_image('imagearraybase64'),
+                            'text/plain')
+
+                modes = server.image_modes
+                if 'imagebytes' in modes \
+                   and IMAGEBYTES_MIME_TYPE in self.headers.get('Accept', ''):
+                    return (camera.encoded_image('imagebytes'),
+                            IMAGEBYTES_MIME_TYPE)
+
+                for mode in ('base64handoff', 'base64json'):
+                    if mode in modes \
+                       and self.headers.get(mode, '').lower() == 'true':
+                        return camera.encoded_image(mode), 'application/json'
+
+                return camera.encoded_image('json'), 'application/json'
+
+            def _management(self, fields, client_tid, server_tid):
+                path = '/'.join(fields[1:])
+                if path == 'apiversions':
+                    value = [1]
+                elif path == 'v1/description':
+                    value = {'ServerName': 'pyastrobackend simulator',
+                             'Manufacturer': 'pyastrobackend',
+                             'ManufacturerVersion': '1.0',
+                             'Location': 'localhost'}
+                elif path == 'v1/configureddevices':
+                    value = [d.description() for d in server.devices.values()]
+                else:
+                    return self._send(b'Not found', 'text/plain', 404)
+                self._send_json(value, client_tid=client_tid,
+                                server_tid=server_tid)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+        return Handler
+
+    def _serve_discovery(self):
+        response = json.dumps({'AlpacaPort': self.port}).encode()
+        while True:
+            try:
+                data, addr = self._udp.recvfrom(1024)
+            except OSError:
+                return
+            if data.startswith(b'alpacadiscovery1'):
+                self._udp.sendto(response, addr)
+
+    def start(self):
+        """
+        Start serving requests on background threads.
+        """
+        thread = threading.Thread(target=self._httpd.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+        if self.discovery_port is not None:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._udp.bind(('', self.discovery_port))
+            thread = threading.Thread(target=self._serve_discovery,
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logging.info(f'Alpaca simulator serving on {self.host}:{self.port}')
+        return self
+
+    def stop(self):
+        """
+        Stop serving requests.
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated Alpaca server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11111)
+    parser.add_argument('--width', type=int, default=1024,
+                        help='Camera width in pixels')
+    parser.add_argument('--height', type=int, default=768,
+                        help='Camera height in pixels')
+    parser.add_argument('--maxadu', type=int, default=65535)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request')
+    parser.add_argument('--image-modes', nargs='+', default=IMAGE_MODES,
+                        choices=IMAGE_MODES)
+    parser.add_argument('--discovery', action='store_true',
+                        help='Answer UDP discovery on port 32227')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)-8s %(message)s')
+
+    sim = AlpacaSimulatorServer(args.host, args.port, args.width,
+                                args.height, maxadu=args.maxadu,
+                                latency=args.latency,
+                                image_modes=args.image_modes,
+                                discovery_port=32227 if args.discovery
+                                else None)
+    sim.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
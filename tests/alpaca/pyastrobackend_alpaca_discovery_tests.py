@@ -0,0 +1,151 @@
+#
+# Alpaca discovery tests
+#
+# Runs against a simulator started in process unless addresses to send the
+# discovery request to are given, for example 127.0.0.1 for a server on
+# this machine or 255.255.255.255 to broadcast.
+#
+import sys
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from pyastrobackend.Alpaca.AlpacaDiscovery import ALPACA_DISCOVERY_PORT
+from pyastrobackend.Alpaca.AlpacaDiscovery import discover_servers
+from pyastrobackend.Alpaca.AlpacaDiscovery import get_configured_devices
+from pyastrobackend.Alpaca.AlpacaDiscovery import AlpacaDeviceDirectory
+from pyastrobackend.AlpacaBackend import DeviceBackend as Backend
+
+from alpaca_simulator_server import AlpacaSimulatorServer
+
+# not the standard port so a real server on this machine does not answer
+SIMULATOR_DISCOVERY_PORT = 32228
+
+# valid JSON which is not a management API reply - get_configured_devices()
+# should treat each like a server which did not respond
+BAD_MANAGEMENT_RESPONSES = [b'[]', b'"Not an Alpaca server"', b'42', b'null',
+                            b'{"Value": "camera", "ErrorNumber": 0}',
+                            b'{"Value": [1, "camera"], "ErrorNumber": 0}']
+
+
+def start_bad_management_server(body):
+    """ HTTP server answering every request with body as JSON """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def test_bad_management_responses(servers):
+    failed = False
+    for body in BAD_MANAGEMENT_RESPONSES:
+        httpd = start_bad_management_server(body)
+        ip, port = httpd.server_address[:2]
+        try:
+            devices = get_configured_devices(ip, port)
+            logging.info(f'get_configured_devices with response {body} '
+                         f'= {devices}')
+            if devices is not None:
+                logging.error(f'Expected None for response {body}!')
+                failed = True
+
+            # good servers still listed with a bad one among them
+            directory = AlpacaDeviceDirectory(servers=servers + [(ip, port)])
+            devices = directory.get_devices()
+            if len(devices) != len(get_configured_devices(*servers[0])):
+                logging.error(f'Devices missing with bad server response '
+                              f'{body}: {devices}')
+                failed = True
+
+            # counted as not answering so backend guesses device numbers
+            if directory.server_responded(ip, port) is not False:
+                logging.error(f'Server with response {body} counted as '
+                              'responding!')
+                failed = True
+
+            devices = Backend(ip, port).getDevicesByClass('camera')
+            if len(devices) != 4:
+                logging.error(f'getDevicesByClass with response {body} = '
+                              f'{devices} - expected device numbers 0-3!')
+                failed = True
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    return not failed
+
+
+if __name__ == '__main__':
+    FORMAT = '%(asctime)s [%(filename)20s:%(lineno)3s - %(funcName)20s() ] %(levelname)-8s %(message)s'
+    logging.basicConfig(filename='pyastrobackend_alpaca_discovery_tests.log',
+                        filemode='w',
+                        level=logging.DEBUG,
+                        format=FORMAT,
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    # add to screen as well
+    LOG = logging.getLogger()
+    formatter = logging.Formatter(FORMAT)
+    CH = logging.StreamHandler()
+    CH.setLevel(logging.DEBUG)
+    CH.setFormatter(formatter)
+    LOG.addHandler(CH)
+
+    logging.info('pyastrobackend_alpaca_discovery_tests starting')
+
+    sim = None
+    if len(sys.argv) > 1:
+        addresses = sys.argv[1:]
+        discovery_port = ALPACA_DISCOVERY_PORT
+    else:
+        sim = AlpacaSimulatorServer(port=0,
+                                    discovery_port=SIMULATOR_DISCOVERY_PORT)
+        sim.start()
+        addresses = ['127.0.0.1']
+        discovery_port = SIMULATOR_DISCOVERY_PORT
+
+    logging.info(f'Sending discovery request to {addresses}')
+    servers = discover_servers(timeout=2.0, addresses=addresses,
+                               discovery_port=discovery_port)
+    logging.info(f'Servers found = {servers}')
+
+    if len(servers) < 1:
+        logging.error('No Alpaca servers found!')
+        sys.exit(1)
+
+    directory = AlpacaDeviceDirectory(servers=servers)
+    for dev in directory.get_devices():
+        logging.info(f'Device: {dev}')
+
+    if not test_bad_management_responses(servers[:1]):
+        logging.error('Bad management API responses not handled!')
+        sys.exit(1)
+
+    ip, port = servers[0]
+    logging.info(f'Connecting backend to {ip}:{port}')
+    backend = Backend(ip, port)
+    rc = backend.connect()
+    if not rc:
+        logging.error('Failed to connect to backend!')
+        sys.exit(1)
+
+    for device_class in ['camera', 'focuser', 'filterwheel', 'telescope']:
+        devices = backend.getDevicesByClass(device_class)
+        logging.info(f'getDevicesByClass({device_class}) = {devices}')
+
+    backend.disconnect()
+    if sim is not None:
+        sim.stop()
+
+    logging.info('pyastrobackend_alpaca_discovery_tests passed')
@@ -0,0 +1,96 @@
+# time how fast RPCDeviceThread splits bursts of responses into JSON
+# messages - no RPC server needed
+#
+# python pyastrobackend_rpc_framing_benchmark.py [recv size]
+
+import sys
+import json
+import time
+import socket
+import threading
+
+from pyastrobackend.RPC.RPCDeviceBase import RPCDeviceThread, DEFAULT_RECV_SIZE
+
+
+class StrFraming:
+    """ framing as done before the bytearray buffer for comparison """
+
+    def __init__(self, sock, recv_size=4096):
+        self.rpc_socket = sock
+        self.recv_size = recv_size
+        self.buffer = ''
+
+    def populate_buffer(self):
+        data = self.rpc_socket.recv(self.recv_size)
+        if not data:
+            raise BrokenPipeError
+        self.buffer += data.decode()
+
+    def read_next_json_block(self):
+        try:
+            json_start = self.buffer.index('{')
+        except ValueError:
+            return None
+        try:
+            json_end = self.buffer[json_start:].index('\n')
+        except ValueError:
+            return None
+        ret = self.buffer[json_start:json_start + json_end]
+        self.buffer = self.buffer[json_start + json_end:]
+        return ret
+
+
+def make_burst(nmsgs, msg_size):
+    msgs = []
+    for i in range(nmsgs):
+        pad = 'x' * max(0, msg_size - 40)
+        msgs.append(json.dumps({'id': i, 'result': {'pad': pad}}) + '\n')
+    return ''.join(msgs).encode()
+
+
+def run(framing, sock_send, burst, nmsgs):
+    # writer thread so large bursts do not deadlock on socket buffers
+    writer = threading.Thread(target=sock_send.sendall, args=(burst,))
+
+    ts = time.perf_counter()
+    writer.start()
+    nread = 0
+    while nread < nmsgs:
+        framing.populate_buffer()
+        while True:
+            j = framing.read_next_json_block()
+            if j is None:
+                break
+            json.loads(j)
+            nread += 1
+    te = time.perf_counter()
+
+    writer.join()
+    return te - ts
+
+
+if __name__ == '__main__':
+    recv_size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RECV_SIZE
+
+    print(f'recv size {recv_size}')
+    print(f'{"messages":>8s} {"msg bytes":>10s} {"old str s":>10s} '
+          f'{"bytearray s":>12s} {"speedup":>8s}')
+
+    for nmsgs, msg_size in [(100, 100), (1000, 100), (10000, 100),
+                            (10, 100000), (100, 100000), (5, 2000000)]:
+        burst = make_burst(nmsgs, msg_size)
+
+        a, b = socket.socketpair()
+        old_time = run(StrFraming(a), b, burst, nmsgs)
+        a.close()
+        b.close()
+
+        a, b = socket.socketpair()
+        framing = RPCDeviceThread(0, None, recv_size=recv_size)
+        framing.rpc_socket = a
+        new_time = run(framing, b, burst, nmsgs)
+        a.close()
+        b.close()
+
+        print(f'{nmsgs:8d} {msg_size:10d} {old_time:10.4f} {new_time:12.4f} '
+              f'{old_time/new_time:7.1f}x')